@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""Run ciocheck with `python -m ciocheck`."""
+
+# Local imports
+from ciocheck.main import main
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,691 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""
+Benchmarks of the ciocheck stages.
+
+The synthetic benchmark generates a throwaway git repository and times each
+stage of a check separately. The replay benchmark checks each commit of a
+range of a real repository against its parent, like a pre-commit check.
+Results are written as json so runs can be compared with
+`ciocheck-bench compare`.
+"""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+from collections import OrderedDict
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Third party imports
+from six.moves import cStringIO as StringIO
+
+# Local imports
+from ciocheck import __version__
+from ciocheck.config import COMMITED_MODE, DEFAULT_BRANCH, MODIFIED_LINES
+from ciocheck.files import FileManager
+from ciocheck.formatters import MultiFormatter
+from ciocheck.registry import LINTER, MULTI_FORMATTER, REGISTRY
+from ciocheck.utils import cpu_count, run_command
+from ciocheck.vcs import GitDiffTool
+
+# Lines of each generated function, including the blank lines before it
+FUNCTION_LINES = 6
+
+# Name of the generated package in the synthetic repository
+PACKAGE = 'pkg'
+
+DEFAULT_CHECK = ['pep8', 'flake8', 'isort', 'yapf', 'autopep8']
+
+# Runs this ciocheck, the current folder is removed from the python path so
+# a ciocheck package in the checked repository is not imported instead
+RUN_CIOCHECK = ("import sys; sys.path.pop(0); sys.argv[0] = 'ciocheck'; "
+                "from ciocheck.main import main; main()")
+
+
+def make_module(rng, functions, violations, changed=()):
+    """
+    Return the source of a module with `functions` simple functions.
+
+    A `violations` fraction of the statements breaks pep8 rules. Functions
+    with their index in `changed` get a different body.
+    """
+    lines = ['"""Generated module."""', '', 'import os', 'import sys']
+    for index in range(functions):
+        operator = '*' if index in changed else '+'
+        statement = 'result = value {0} {1}'.format(operator, index)
+        if rng.random() < violations:
+            statement = rng.choice([
+                statement.replace(' ', ''),
+                statement + '  # ' + 'x' * 80,
+                statement + ' ',
+            ])
+        lines += [
+            '',
+            '',
+            'def function_{0}(value):'.format(index),
+            '    """Return the value changed by {0}."""'.format(index),
+            '    ' + statement,
+            '    return result, os.sep, sys.platform',
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+def git(root, *args):
+    """Run git `args` in `root` and return the output."""
+    output, error = run_command(
+        ['git', '-c', 'user.name=ciocheck', '-c', 'user.email=ciocheck@bench'
+         ] + list(args),
+        cwd=root)
+    return output
+
+
+def make_repo(root,
+              files=50,
+              lines=200,
+              changed_files=10,
+              changed_lines=5,
+              violations=0.05,
+              seed=0):
+    """
+    Create a git repository of generated python files in `root`.
+
+    The repository has a commit with the original files, also referenced as
+    the default branch to compare to, and a commit changing `changed_lines`
+    lines of `changed_files` files.
+    """
+    rng = random.Random(seed)
+    functions = max(1, lines // FUNCTION_LINES)
+    package = os.path.join(root, PACKAGE)
+    os.makedirs(package)
+
+    def write_modules(changed_modules):
+        """Write all modules, changing functions of `changed_modules`."""
+        module_rng = random.Random(seed)
+        for index in range(files):
+            changed = changed_modules.get(index, ())
+            source = make_module(module_rng, functions, violations, changed)
+            path = os.path.join(package, 'module_{0}.py'.format(index))
+            with open(path, 'w') as file_obj:
+                file_obj.write(source)
+
+    with open(os.path.join(package, '__init__.py'), 'w') as file_obj:
+        file_obj.write('"""Generated package."""\n')
+    write_modules({})
+    git(root, 'init', '-q')
+    git(root, 'add', '.')
+    git(root, 'commit', '-q', '-m', 'Original files')
+    git(root, 'update-ref', 'refs/remotes/' + DEFAULT_BRANCH, 'HEAD')
+
+    changed_modules = {}
+    for index in rng.sample(range(files), min(changed_files, files)):
+        count = min(changed_lines, functions)
+        changed_modules[index] = set(rng.sample(range(functions), count))
+    write_modules(changed_modules)
+    git(root, 'commit', '-q', '-a', '-m', 'Changed files')
+    return package
+
+
+def time_call(func, repeat=3, setup=None):
+    """
+    Call `func` `repeat` times, return the durations and the last result.
+
+    `setup` is called before each call and is not timed.
+    """
+    times = []
+    result = None
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.time()
+        result = func()
+        times.append(time.time() - start)
+    return times, result
+
+
+def percentile(values, fraction):
+    """Return the `fraction` percentile of `values`, interpolated."""
+    ordered = list(sorted(values))
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    weight = position - lower
+    return ordered[lower] * (1 - weight) + ordered[upper] * weight
+
+
+def summarize(times, items=None):
+    """Return the statistics of the durations `times`."""
+    return OrderedDict([
+        ('min', min(times)),
+        ('median', percentile(times, 0.5)),
+        ('p90', percentile(times, 0.9)),
+        ('p95', percentile(times, 0.95)),
+        ('p99', percentile(times, 0.99)),
+        ('max', max(times)),
+        ('times', times),
+        ('items', items),
+    ])
+
+
+class SyntheticBenchmark(object):
+    """Time each stage of a check of a generated repository."""
+
+    def __init__(self, root, check=None, repeat=3):
+        """Time each stage of a check of a generated repository.
+
+        `root` is a repository created with `make_repo`. Only the tools in
+        `check` are timed.
+        """
+        self.root = root
+        self.package = os.path.join(root, PACKAGE)
+        self.check = DEFAULT_CHECK if check is None else check
+        self.repeat = repeat
+        self.results = OrderedDict()
+        self.all_results = OrderedDict()
+
+    def restore(self):
+        """Undo changes made by formatters."""
+        git(self.root, 'checkout', '-q', '--', '.')
+
+    def measure(self, name, func, setup=None, items=None):
+        """Time `func`, store its statistics as `name` and return its result.
+
+        Errors, like tools that are not installed, are stored instead of
+        stopping the benchmark.
+        """
+        print('Running "{0}" ...'.format(name))
+        try:
+            times, result = time_call(func, repeat=self.repeat, setup=setup)
+        except Exception as error:
+            self.results[name] = {'error': str(error)}
+            return None
+
+        if items is None and result is not None:
+            items = len(result)
+        self.results[name] = summarize(times, items=items)
+        return result
+
+    def run_diff(self):
+        """Time parsing the diff of the changed files."""
+        diff_tool = GitDiffTool(self.root)
+        diff_str = diff_tool._git_run_helper(
+            branch=DEFAULT_BRANCH, mode=COMMITED_MODE)
+        self.measure('diff parse',
+                     lambda: diff_tool._parse_diff_str(diff_str))
+
+    def run_get_files(self):
+        """Time finding the changed files and lines, return them."""
+        file_manager = FileManager(folders=[self.package])
+        return self.measure(
+            'get files',
+            lambda: file_manager.get_files(
+                branch=DEFAULT_BRANCH,
+                diff_mode=COMMITED_MODE,
+                file_mode=MODIFIED_LINES,
+                extensions=('py', )),
+            setup=file_manager.clear_cache)
+
+    def run_multi_formatter(self, config, files):
+        """Time the multi formatter on `files`."""
+        formatters = REGISTRY.load([MULTI_FORMATTER], self.check)
+        if not formatters:
+            return
+
+        for formatter in formatters:
+            formatter(self.root).create_config(config)
+        tool = MultiFormatter(self.root, self.check)
+        results = self.measure(
+            tool.name,
+            lambda: tool.run(files),
+            setup=self.restore,
+            items=len(files))
+        self.restore()
+
+        for name, values in (results or {}).items():
+            self.all_results[name] = {'files': files, 'results': values}
+
+    def run_linters(self, config, files):
+        """Time each linter on `files`."""
+        for linter in REGISTRY.load([LINTER], self.check):
+            linter(self.root).create_config(config)
+            # Linters keep per run state, use a fresh instance per run
+            results = self.measure(
+                linter.name,
+                lambda: linter(self.root).run(files),
+                items=len(files))
+            if results:
+                self.all_results[linter.name] = {
+                    'files': files,
+                    'results': results,
+                }
+
+    def run_process_results(self, runner):
+        """Time building the text report of the collected results."""
+
+        def process_results():
+            """Build the report, discarding the output."""
+            stdout = sys.stdout
+            sys.stdout = StringIO()
+            try:
+                runner.process_results(self.all_results)
+            finally:
+                sys.stdout = stdout
+
+        self.measure(
+            'process results',
+            process_results,
+            items=sum(len(data['results'])
+                      for data in self.all_results.values()))
+
+    def run(self):
+        """Run all the benchmarks and return their statistics."""
+        # Imported here, main imports every part of ciocheck
+        from ciocheck.main import Runner, create_parser
+
+        args = [self.package, '--diff-mode', COMMITED_MODE]
+        if self.check:
+            args += ['--check'] + list(self.check)
+        cli_args = create_parser().parse_args(args)
+        runner = Runner(self.root, cli_args, folders=[self.package])
+        self.run_diff()
+        files = self.run_get_files() or {}
+        self.run_multi_formatter(runner.config, files)
+        self.run_linters(runner.config, files)
+        self.run_process_results(runner)
+        return self.results
+
+
+def run_synthetic(cli_args):
+    """Run the synthetic benchmark and return the report."""
+    params = OrderedDict([
+        ('files', cli_args.files),
+        ('lines', cli_args.lines),
+        ('changed_files', cli_args.changed_files),
+        ('changed_lines', cli_args.changed_lines),
+        ('violations', cli_args.violations),
+        ('seed', cli_args.seed),
+        ('check', cli_args.check),
+        ('repeat', cli_args.repeat),
+    ])
+    root = tempfile.mkdtemp(prefix='ciocheck-bench-')
+    # Some tools resolve symbolic links, like /tmp on macOS
+    root = os.path.realpath(root)
+    old_cwd = os.getcwd()
+    try:
+        make_repo(
+            root,
+            files=cli_args.files,
+            lines=cli_args.lines,
+            changed_files=cli_args.changed_files,
+            changed_lines=cli_args.changed_lines,
+            violations=cli_args.violations,
+            seed=cli_args.seed)
+        os.chdir(root)
+        benchmark = SyntheticBenchmark(
+            root, check=cli_args.check, repeat=cli_args.repeat)
+        results = benchmark.run()
+    finally:
+        os.chdir(old_cwd)
+        shutil.rmtree(root, ignore_errors=True)
+
+    return make_report('synthetic', params, results)
+
+
+def read_trace(path):
+    """
+    Return the stage durations and cache counters of a trace of a run.
+
+    Durations are in seconds, by stage name. Cache counters are dicts of
+    tool name: count, for "hits" and "misses".
+    """
+    with open(path, 'r') as file_obj:
+        events = json.load(file_obj)['traceEvents']
+
+    stages = OrderedDict()
+    cache = {'hits': {}, 'misses': {}}
+    for event in events:
+        if event['ph'] == 'X' and event.get('cat') in ('stage', 'tester'):
+            name = event['name']
+            stages[name] = stages.get(name, 0) + event['dur'] / 1e6
+        elif event['ph'] == 'C' and event['name'] == 'cache hits':
+            cache['hits'] = event['args']
+        elif event['ph'] == 'C' and event['name'] == 'cache misses':
+            cache['misses'] = event['args']
+    return stages, cache
+
+
+class ReplayBenchmark(object):
+    """Check each commit of a range against its parent and time it."""
+
+    def __init__(self, repo, commit_range, folders=('.', ), args=()):
+        """Check each commit of a range against its parent and time it.
+
+        Commits are checked out in a scratch worktree of the git repository
+        `repo`, so its working copy is left alone. `args` are extra
+        arguments given to ciocheck, like `--check` or `--cache`.
+        """
+        self.repo = os.path.realpath(repo)
+        self.commit_range = commit_range
+        self.folders = list(folders)
+        self.args = list(args)
+        self.commits = []
+
+    def commit_list(self):
+        """Return the commits of the range with a parent, oldest first."""
+        output = git(self.repo, 'rev-list', '--reverse', '--first-parent',
+                     '--parents', self.commit_range)
+        commits = []
+        for line in output.splitlines():
+            parts = line.split()
+            if len(parts) > 1:
+                commits.append((parts[0], parts[1]))
+        return commits
+
+    def check_commit(self, worktree, commit, parent, trace_path):
+        """
+        Check `commit` against `parent` and return the record of the run.
+
+        The replay failed if the run did not write its trace to `trace_path`.
+        """
+        git(worktree, 'checkout', '-q', '-f', '--detach', commit)
+        # Remove files created by formatters of the previous check
+        git(worktree, 'clean', '-q', '-f', '-d')
+        if os.path.exists(trace_path):
+            os.remove(trace_path)
+
+        cmd = [sys.executable, '-c', RUN_CIOCHECK] + self.folders + [
+            '--diff-mode', COMMITED_MODE, '--branch', parent, '--trace',
+            trace_path
+        ] + self.args
+        start = time.time()
+        process = subprocess.Popen(
+            cmd, cwd=worktree, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        process.communicate()
+        seconds = time.time() - start
+
+        record = OrderedDict([
+            ('commit', commit),
+            ('parent', parent),
+            ('seconds', seconds),
+            ('returncode', process.returncode),
+            ('failed', False),
+        ])
+        try:
+            record['stages'], record['cache'] = read_trace(trace_path)
+        except (IOError, OSError, ValueError, KeyError):
+            # The run crashed before writing its trace
+            print('No trace written checking {0}'.format(commit[:10]))
+            record['failed'] = True
+            record['stages'] = OrderedDict()
+            record['cache'] = {'hits': {}, 'misses': {}}
+        return record
+
+    def run(self):
+        """Check all commits and return the records of the runs."""
+        scratch = os.path.realpath(tempfile.mkdtemp(prefix='ciocheck-replay-'))
+        worktree = os.path.join(scratch, 'worktree')
+        self.commits = []
+        commits = self.commit_list()
+        try:
+            git(self.repo, 'worktree', 'add', '-q', '--detach', worktree,
+                commits[0][0] if commits else 'HEAD')
+            for index, (commit, parent) in enumerate(commits):
+                print('Checking {0} ({1}/{2}) ...'.format(
+                    commit[:10], index + 1, len(commits)))
+                trace_path = os.path.join(scratch,
+                                          'trace-{0}.json'.format(commit))
+                self.commits.append(
+                    self.check_commit(worktree, commit, parent, trace_path))
+        finally:
+            git(self.repo, 'worktree', 'remove', '--force', worktree)
+            shutil.rmtree(scratch, ignore_errors=True)
+        return self.commits
+
+    def failed(self):
+        """Return the commits of replays that did not write a trace."""
+        return [r['commit'] for r in self.commits if r['failed']]
+
+    def results(self):
+        """Return the statistics of the total time and of each stage."""
+        results = OrderedDict()
+        # Failed replays did not run all stages, their times are not kept
+        records = [r for r in self.commits if not r['failed']]
+        if not records:
+            return results
+
+        results['total'] = summarize([r['seconds'] for r in records],
+                                     items=len(records))
+        stage_times = OrderedDict()
+        for record in records:
+            for name, seconds in record['stages'].items():
+                stage_times.setdefault(name, []).append(seconds)
+        for name, times in stage_times.items():
+            results[name] = summarize(times, items=len(times))
+        return results
+
+    def cache_stats(self):
+        """Return the hits, misses and hit rate of each tool and in total."""
+        totals = OrderedDict()
+        for record in self.commits:
+            for key in ['hits', 'misses']:
+                for name, count in record['cache'][key].items():
+                    counts = totals.setdefault(name, {'hits': 0, 'misses': 0})
+                    counts[key] += count
+
+        all_counts = {'hits': 0, 'misses': 0}
+        for counts in totals.values():
+            all_counts['hits'] += counts['hits']
+            all_counts['misses'] += counts['misses']
+        totals['total'] = all_counts
+
+        for counts in totals.values():
+            lookups = counts['hits'] + counts['misses']
+            counts['hit_rate'] = (1.0 * counts['hits'] / lookups
+                                  if lookups else None)
+        return totals
+
+
+def run_replay(cli_args, extra_args):
+    """Run the replay benchmark and return the report."""
+    params = OrderedDict([
+        ('repo', os.path.realpath(cli_args.repo)),
+        ('range', cli_args.range),
+        ('folders', cli_args.folders),
+        ('args', extra_args),
+    ])
+    benchmark = ReplayBenchmark(
+        cli_args.repo,
+        cli_args.range,
+        folders=cli_args.folders,
+        args=extra_args)
+    benchmark.run()
+    report = make_report('replay', params, benchmark.results())
+    report['cache'] = benchmark.cache_stats()
+    report['commits'] = benchmark.commits
+    report['failed'] = benchmark.failed()
+    return report
+
+
+def make_report(kind, params, results):
+    """Return a json serializable report with details of the machine."""
+    return OrderedDict([
+        ('benchmark', kind),
+        ('version', __version__),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('cpus', cpu_count()),
+        ('time', time.time()),
+        ('params', params),
+        ('results', results),
+    ])
+
+
+def compare_reports(old_report, new_report):
+    """Return the lines of a table comparing the medians of two reports."""
+    lines = ['{0:<24} {1:>10} {2:>10} {3:>8}'.format('benchmark', 'old (s)',
+                                                     'new (s)', 'change')]
+    old_results = old_report['results']
+    new_results = new_report['results']
+    for name in list(old_results) + [
+            n for n in new_results if n not in old_results
+    ]:
+        old_median = old_results.get(name, {}).get('median')
+        new_median = new_results.get(name, {}).get('median')
+        if old_median and new_median is not None:
+            change = '{0:+.1f}%'.format(
+                (new_median - old_median) / old_median * 100)
+        else:
+            change = '-'
+        lines.append('{0:<24} {1:>10} {2:>10} {3:>8}'.format(
+            name, _format_seconds(old_median), _format_seconds(new_median),
+            change))
+    return lines
+
+
+def _format_seconds(seconds):
+    """Format a duration or a dash if it is not available."""
+    return '-' if seconds is None else '{0:.4f}'.format(seconds)
+
+
+def write_report(report, path):
+    """Write `report` as json to `path`, or to stdout if path is None."""
+    data = json.dumps(report, indent=2)
+    if path is None:
+        print(data)
+    else:
+        with open(path, 'w') as file_obj:
+            file_obj.write(data + '\n')
+        print('Results written to "{0}"'.format(path))
+
+
+def main():
+    """CLI parser for the ciocheck benchmarks."""
+    description = 'Benchmark the stages of ciocheck.'
+    parser = argparse.ArgumentParser(description=description)
+    subparsers = parser.add_subparsers(dest='command')
+
+    synthetic = subparsers.add_parser(
+        'synthetic', help='Time each stage on a generated git repository')
+    synthetic.add_argument(
+        '--files',
+        type=int,
+        default=50,
+        help='Number of generated python files. Default is 50.')
+    synthetic.add_argument(
+        '--lines',
+        type=int,
+        default=200,
+        help='Approximate number of lines of each file. Default is 200.')
+    synthetic.add_argument(
+        '--changed-files',
+        dest='changed_files',
+        type=int,
+        default=10,
+        help='Number of files changed by the last commit. Default is 10.')
+    synthetic.add_argument(
+        '--changed-lines',
+        dest='changed_lines',
+        type=int,
+        default=5,
+        help='Number of lines changed in each changed file. Default is 5.')
+    synthetic.add_argument(
+        '--violations',
+        type=float,
+        default=0.05,
+        help=('Fraction of statements breaking style rules. Default is '
+              '0.05.'))
+    synthetic.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Seed of the generated contents. Default is 0.')
+    synthetic.add_argument(
+        '--check',
+        '-c',
+        nargs='+',
+        choices=REGISTRY.choices(),
+        default=DEFAULT_CHECK,
+        help='Tools to time. Default is "{0}".'.format(
+            ' '.join(DEFAULT_CHECK)))
+    synthetic.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help='Number of times each stage is timed. Default is 3.')
+    synthetic.add_argument(
+        '--output',
+        '-o',
+        default=None,
+        help='Write results to this json file. Default is stdout.')
+
+    replay = subparsers.add_parser(
+        'replay',
+        help=('Check each commit of a range of a git repository against its '
+              'parent'))
+    replay.add_argument('repo', help='Path of a local git repository.')
+    replay.add_argument(
+        'range', help='Commits to check, like "v1.0..master" or "HEAD~20..".')
+    replay.add_argument(
+        '--folders',
+        nargs='+',
+        default=['.'],
+        help='Folders to check, relative to the repository root.')
+    replay.add_argument(
+        '--output',
+        '-o',
+        default=None,
+        help='Write results to this json file. Default is stdout.')
+
+    compare = subparsers.add_parser(
+        'compare', help='Compare the results of two benchmark runs')
+    compare.add_argument('old', help='Json results of the reference run.')
+    compare.add_argument('new', help='Json results of the new run.')
+
+    # Unknown arguments of replay are given to ciocheck
+    cli_args, extra_args = parser.parse_known_args()
+    if extra_args and cli_args.command != 'replay':
+        parser.error('unrecognized arguments: ' + ' '.join(extra_args))
+
+    if cli_args.command in ('synthetic', 'replay'):
+        # Keep stdout for the results
+        stdout = sys.stdout
+        if cli_args.output is None:
+            sys.stdout = sys.stderr
+        try:
+            if cli_args.command == 'synthetic':
+                report = run_synthetic(cli_args)
+            else:
+                report = run_replay(cli_args, extra_args)
+        finally:
+            sys.stdout = stdout
+        write_report(report, cli_args.output)
+        if report.get('failed'):
+            # Commits of replays without a trace are listed in the report
+            sys.exit(1)
+    elif cli_args.command == 'compare':
+        with open(cli_args.old, 'r') as file_obj:
+            old_report = json.load(file_obj)
+        with open(cli_args.new, 'r') as file_obj:
+            new_report = json.load(file_obj)
+        for line in compare_reports(old_report, new_report):
+            print(line)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
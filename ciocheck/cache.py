@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""
+Persistent content addressed cache of tool results.
+
+The cache folder can be shared by several ciocheck processes, on one or many
+machines. Entries are published with an atomic rename so readers never see
+partially written entries and reads do not need any locking. Unreadable
+entries are treated as missing.
+"""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+from collections import OrderedDict
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Local imports
+from ciocheck.config import load_config
+from ciocheck.utils import atomic_replace, filter_paths, processes_killed
+
+# Default maximum size of the cache in megabytes
+DEFAULT_CACHE_SIZE = 256
+
+# Extension of published cache entries
+ENTRY_EXTENSION = '.json'
+
+# Temporary files older than this many seconds were left behind by writers
+# that died before publishing their entry
+STALE_TMP_AGE = 3600
+
+# File of the index of formatted contents, in the cache folder
+FORMATTED_INDEX_FILE = 'formatted.json'
+
+# Default maximum number of keys in the index of formatted contents
+DEFAULT_INDEX_SIZE = 100000
+
+
+def hash_string(string):
+    """Return the sha1 hex digest of a string."""
+    if not isinstance(string, bytes):
+        string = string.encode('utf-8')
+    return hashlib.sha1(string).hexdigest()
+
+
+def hash_file(path):
+    """Return the sha1 hex digest of the contents of file `path`."""
+    with open(path, 'rb') as file_obj:
+        return hash_string(file_obj.read())
+
+
+def file_stamp(path):
+    """
+    Return a stamp of file `path` that changes when the file is changed.
+
+    Formatters may rewrite a file within the mtime granularity, keeping its
+    size, so the inode and change time are also part of it.
+    """
+    stat = os.stat(path)
+    return (getattr(stat, 'st_mtime_ns', stat.st_mtime),
+            getattr(stat, 'st_ctime_ns', stat.st_ctime), stat.st_ino,
+            stat.st_size)
+
+
+class ResultCache(object):
+    """
+    On disk cache of tool results, keyed on file contents.
+
+    Entries are json files stored in `path`. Reading an entry updates its
+    modification time, so least recently used entries are the first ones
+    removed when the cache grows over `max_size`.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_CACHE_SIZE):
+        """On disk cache of tool results, keyed on file contents.
+
+        Parameters
+        ----------
+        path : str
+            Folder where the cache entries are stored.
+        max_size : int
+            Maximum size of the cache in megabytes.
+        """
+        self.path = path
+        self.max_size = max_size * 1024 * 1024
+        self.hits = OrderedDict()
+        self.misses = OrderedDict()
+        self._file_hashes = {}
+        self._lock = threading.Lock()
+
+    def _entry_path(self, key):
+        """Return the path of the entry for `key`."""
+        return os.path.join(self.path, key[:2], key + '.json')
+
+    def _count(self, counter, tool_name):
+        """Increase the hit or miss `counter` of `tool_name`."""
+        with self._lock:
+            counter[tool_name] = counter.get(tool_name, 0) + 1
+
+    def hash_file(self, path):
+        """
+        Return the sha1 hex digest of the contents of file `path`.
+
+        Digests are kept while the stamp of the file is not changed.
+        """
+        stat_key = (path, ) + file_stamp(path)
+        if stat_key not in self._file_hashes:
+            self._file_hashes[stat_key] = hash_file(path)
+        return self._file_hashes[stat_key]
+
+    @staticmethod
+    def make_key(*parts):
+        """Return a cache key for the given string parts."""
+        return hash_string('\0'.join(parts))
+
+    def get(self, tool_name, key):
+        """Return the value stored for `key` or None if missing."""
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'r') as file_obj:
+                value = json.load(file_obj)
+        except (IOError, OSError, ValueError):
+            self._count(self.misses, tool_name)
+            return None
+
+        try:
+            os.utime(entry_path, None)
+        except OSError:
+            # Removed by another process after it was read
+            pass
+
+        self._count(self.hits, tool_name)
+        return value
+
+    def set(self, key, value):
+        """
+        Store json serializable `value` for `key`.
+
+        The entry is written to a temporary file and renamed into place, so
+        concurrent readers see either the whole entry or no entry at all.
+        """
+        entry_path = self._entry_path(key)
+        folder = os.path.dirname(entry_path)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                # Created by another thread in the meantime
+                pass
+
+        try:
+            atomic_replace(entry_path, json.dumps(value), 'utf-8')
+        except (IOError, OSError):
+            # A read only or full cache folder should not fail the run
+            pass
+
+    def _entries(self, extension=ENTRY_EXTENSION):
+        """Return a list of (modification time, size, path) of entries."""
+        entries = []
+        for root, folders, files in os.walk(self.path):
+            for file_name in files:
+                if extension and not file_name.endswith(extension):
+                    continue
+                if root == self.path and file_name == FORMATTED_INDEX_FILE:
+                    # Limited by its own number of keys
+                    continue
+                entry_path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(entry_path)
+                except OSError:
+                    # Removed by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry_path))
+        return entries
+
+    def evict(self):
+        """Remove least recently used entries until under `max_size`."""
+        entries = self._entries()
+        total_size = sum(size for (mtime, size, entry_path) in entries)
+        for mtime, size, entry_path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(entry_path)
+            except OSError:
+                pass
+            total_size -= size
+
+    def compact(self):
+        """
+        Compact the cache folder and return the number of removed files.
+
+        Removes temporary files of writers that died before publishing,
+        unreadable entries and empty folders, then evicts least recently
+        used entries until the cache is under `max_size`. It is safe to run
+        while other processes use the cache.
+        """
+        removed = 0
+        now = time.time()
+        for mtime, size, path in self._entries(extension=None):
+            if path.endswith(ENTRY_EXTENSION):
+                try:
+                    with open(path, 'r') as file_obj:
+                        json.load(file_obj)
+                    continue
+                except ValueError:
+                    pass
+                except (IOError, OSError):
+                    continue
+            elif now - mtime < STALE_TMP_AGE:
+                # Possibly still being written
+                continue
+
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+
+        count = len(self._entries())
+        self.evict()
+        removed += count - len(self._entries())
+
+        for root, folders, files in os.walk(self.path, topdown=False):
+            if root != self.path and not folders and not files:
+                try:
+                    os.rmdir(root)
+                except OSError:
+                    # A writer created an entry in the meantime
+                    pass
+        return removed
+
+    def format_stats(self):
+        """Return a one line summary of hits and misses per tool."""
+        tool_names = list(self.hits)
+        tool_names += [name for name in self.misses if name not in self.hits]
+        stats = [
+            '{0} {1}/{2}'.format(name,
+                                 self.hits.get(name, 0),
+                                 self.misses.get(name, 0))
+            for name in tool_names
+        ]
+        return 'Cache hits/misses: ' + ', '.join(stats)
+
+
+class FormattedIndex(object):
+    """
+    Persistent index of file contents left unchanged by formatters.
+
+    Keys identify the contents of a file and the formatters setup, so files
+    already formatted can be skipped without running any formatter. The index
+    is a single json file of key: last use time, keys unused for the longest
+    time are dropped when there are more than `max_size` of them.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_INDEX_SIZE):
+        """Persistent index of file contents left unchanged by formatters.
+
+        Parameters
+        ----------
+        path : str
+            The index file.
+        max_size : int
+            Maximum number of keys kept in the index.
+        """
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._keys = None
+        self._used = {}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """Return the saved keys, a missing or broken file is ignored."""
+        try:
+            with open(self.path, 'r') as file_obj:
+                return dict(json.load(file_obj))
+        except (IOError, OSError, ValueError, TypeError):
+            return {}
+
+    @staticmethod
+    def make_key(fingerprint, contents_hash, line_ranges=None):
+        """
+        Return the key of contents for the formatters `fingerprint`.
+
+        Contents left unchanged when formatting only `line_ranges` are not
+        known to be formatted outside of them, so ranges are part of the key.
+        """
+        return ResultCache.make_key(*(fingerprint + (contents_hash,
+                                                     repr(line_ranges))))
+
+    def contains(self, *keys):
+        """Return True if any of `keys` is known to be formatted."""
+        with self._lock:
+            if self._keys is None:
+                self._keys = self._load()
+            for key in keys:
+                if key in self._keys:
+                    self._used[key] = time.time()
+                    self.hits += 1
+                    return True
+            self.misses += 1
+            return False
+
+    def add(self, key):
+        """Add `key` of contents left unchanged by the formatters."""
+        with self._lock:
+            self._used[key] = time.time()
+
+    def save(self):
+        """Merge keys used in this run into the index file."""
+        with self._lock:
+            if not self._used:
+                return
+            # Reload to keep keys written by other processes in the meantime
+            keys = self._load()
+            keys.update(self._used)
+            self._used = {}
+
+        if len(keys) > self.max_size:
+            newest = sorted(keys, key=lambda key: -keys[key])[:self.max_size]
+            keys = dict((key, keys[key]) for key in newest)
+
+        folder = os.path.dirname(self.path)
+        try:
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            atomic_replace(self.path, json.dumps(keys), 'utf-8')
+        except (IOError, OSError):
+            # A read only cache folder should not fail the run
+            pass
+        self._keys = keys
+
+
+def get_cache_dir(cmd_root, cache_dir):
+    """
+    Return the absolute cache folder for `cache_dir`.
+
+    User and environment variables are expanded, so the cache can live on a
+    volume shared between CI runners, e.g. `$CI_CACHE_DIR/ciocheck`.
+    Relative folders are relative to `cmd_root`.
+    """
+    cache_dir = os.path.expanduser(os.path.expandvars(cache_dir))
+    return os.path.join(cmd_root, cache_dir)
+
+
+def tool_fingerprint(tool, cmd_root):
+    """Return the parts identifying a tool setup: name, version, config."""
+    return (tool.name, tool.get_version(), tool.get_config_hash(cmd_root))
+
+
+def run_cached(cache, tool, files):
+    """
+    Run `tool` only on the `files` missing from `cache`.
+
+    Results are cached per file, keyed on the tool fingerprint, the path
+    relative to the tool root (config files can exclude paths) and the file
+    contents. Returned results are sorted by path.
+    """
+    if cache is None:
+        return tool.run(files)
+
+    fingerprint = tool_fingerprint(tool, tool.cmd_root)
+    results = []
+    keys = OrderedDict()
+    for path in files:
+        relative_path = os.path.relpath(path, tool.cmd_root)
+        key = cache.make_key(*(fingerprint +
+                               (relative_path, cache.hash_file(path))))
+        cached_results = cache.get(tool.name, key)
+        if cached_results is None:
+            keys[path] = key
+        else:
+            results += [dict(item, path=path) for item in cached_results]
+
+    if keys:
+        new_results = tool.run(filter_paths(files, list(keys)))
+        results_by_path = dict((path, []) for path in keys)
+        for result in new_results:
+            if result['path'] in results_by_path:
+                item = dict(result)
+                item.pop('path')
+                results_by_path[result['path']].append(item)
+
+        # Results of killed subprocesses are incomplete
+        if not processes_killed():
+            for path, key in keys.items():
+                cache.set(key, results_by_path[path])
+        results += new_results
+
+    return sorted(results, key=lambda result: result['path'])
+
+
+def main():
+    """CLI parser for the ciocheck result cache."""
+    description = 'Manage the ciocheck result cache.'
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '--cache-dir',
+        dest='cache_dir',
+        default=None,
+        help=('Folder where cached results are stored. Default is the '
+              '"cache_dir" option of the config file.'))
+    parser.add_argument(
+        '--cache-size',
+        dest='cache_size',
+        type=int,
+        default=None,
+        help=('Maximum size of the cache in megabytes. Default is the '
+              '"cache_size" option of the config file.'))
+    parser.add_argument(
+        '--config',
+        '-cf',
+        dest='config_file',
+        default=None,
+        help=('Select a config file to use. Default is none.'))
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser(
+        'compact',
+        help=('Remove leftover temporary files and unreadable entries and '
+              'evict entries over the cache size'))
+
+    cli_args = parser.parse_args()
+    root = os.getcwd()
+    config = load_config(root, cli_args)
+    cache = ResultCache(
+        get_cache_dir(root, config.get_value('cache_dir')),
+        max_size=config.get_value('cache_size'))
+
+    if cli_args.command == 'compact':
+        removed = cache.compact()
+        print('Removed {0} files from "{1}"'.format(removed, cache.path))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -32,6 +32,14 @@ CONFIGURATION_FILE = '.ciocheck'
 COVERAGE_CONFIGURATION_FILE = '.coveragerc'
 
 COPYRIGHT_HEADER_FILE = '.ciocopyright'
+DEFAULT_CACHE_DIR = '.ciocheck_cache'
+HISTORY_FILE = '.ciocheck_history'
+COSTS_FILE = '.ciocheck_costs'
+FORMAT_COSTS_FILE = '.ciocheck_format_costs'
+
+# Output formats
+TEXT_OUTPUT = 'text'
+JSONL_OUTPUT = 'jsonl'
 
 DEFAULT_ENCODING_HEADER = u"# -*- coding: utf-8 -*-\n"
 DEFAULT_COPYRIGHT_HEADER = u"""
@@ -57,6 +65,27 @@ DEFAULT_CIOCHECK_CONFIG = {
     # Linters/Formatters/Testers
     'check': ['pep8'],
     'enforce': [],
+    # Concurrency, 0 means use the cpu count
+    'jobs': 0,
+    'stream': False,
+    'fail_fast': False,
+    # Formatter workers are replaced after this many batches or megabytes of
+    # memory, 0 means no limit
+    'worker_tasks': 500,
+    'worker_memory': 1024,
+    # Formatting a file is stopped after this many seconds or megabytes of
+    # memory of its worker, and the file skipped, 0 means no limit
+    'format_timeout': 120,
+    'format_memory': 0,
+    'output_format': TEXT_OUTPUT,
+    # Result cache, size in megabytes
+    'cache': False,
+    'cache_dir': DEFAULT_CACHE_DIR,
+    'cache_size': 256,
+    # Index of formatted file contents in the cache folder, formatters skip
+    # files known to be formatted. Off by default as the cache folder is
+    # created in the checked repository
+    'format_index': False,
 }
 
 
@@ -75,6 +104,8 @@ class CustomConfigParser(configparser.ConfigParser):
         val = self.get(self.SECTION, option)
         if isinstance(default_value, bool):
             value = True if val.lower() == 'true' else False
+        elif isinstance(default_value, int):
+            value = int(val)
         elif isinstance(default_value, list):
             if val:
                 value = val.split(',')
@@ -94,11 +125,10 @@ class CustomConfigParser(configparser.ConfigParser):
         if isinstance(default_value, bool):
             val = 'true' if value else 'false'
             self.set(self.SECTION, option, val)
+        elif isinstance(default_value, int):
+            self.set(self.SECTION, option, str(value))
         elif isinstance(default_value, list):
-            if default_value:
-                val = ','.join(value)
-            else:
-                val = ''
+            val = ','.join(value)
             self.set(self.SECTION, option, val)
         else:
             self.set(self.SECTION, option, value)
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""
+Persistent ciocheck server and thin client.
+
+The server keeps imported tools, version control state and formatter worker
+processes warm between checks, so repeated checks of small diffs avoid
+paying for interpreter startup and imports. The client does not import any
+tool so it starts fast.
+"""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import traceback
+
+# Third party imports
+from six.moves import cStringIO as StringIO
+from six.moves import socketserver
+
+DEFAULT_SOCKET = '.ciocheck.sock'
+
+
+class CiocheckRequestHandler(socketserver.StreamRequestHandler):
+    """Handle a single json encoded request per connection."""
+
+    def handle(self):
+        """Read a request, run it and write back a json encoded response."""
+        request = json.loads(self.rfile.readline().decode('utf-8'))
+        command = request.get('command')
+
+        if command == 'check':
+            output, error_output, status = self.server.check(
+                request['cwd'], request['argv'])
+            response = {
+                'output': output,
+                'error_output': error_output,
+                'status': status,
+            }
+        elif command == 'stop':
+            response = {'output': 'Server stopped\n', 'status': 0}
+            # shutdown blocks until serve_forever returns, so it can not be
+            # called from the serving thread
+            thread = threading.Thread(target=self.server.shutdown)
+            thread.daemon = True
+            thread.start()
+        else:
+            response = {
+                'output': '',
+                'error_output': 'Unknown command: {0}\n'.format(command),
+                'status': 2,
+            }
+
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class CiocheckServer(socketserver.UnixStreamServer):
+    """Unix socket server running checks with warm tool state.
+
+    Requests are handled one at a time, as checks change the working
+    directory and capture stdout for the whole process.
+    """
+
+    def __init__(self, socket_path):
+        """Unix socket server running checks with warm tool state."""
+        # Tools are imported by the first check using them and stay loaded
+        from ciocheck import main as ciocheck_main
+
+        self.main = ciocheck_main
+        self.parser = ciocheck_main.create_parser()
+        self.socket_path = socket_path
+        self.file_managers = {}
+        self.formatter_pools = {}
+
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        socketserver.UnixStreamServer.__init__(self, socket_path,
+                                               CiocheckRequestHandler)
+
+    def _get_file_manager(self, folders, files):
+        """Return a file manager for the given paths, reusing old ones."""
+        # Imported here to keep the client startup light
+        from ciocheck.files import FileManager
+
+        key = (tuple(folders), tuple(files))
+        file_manager = self.file_managers.get(key)
+        if file_manager is None:
+            file_manager = FileManager(folders=folders, files=files)
+            self.file_managers[key] = file_manager
+        else:
+            # Diffs change between checks, repository details do not
+            file_manager.clear_cache()
+        return file_manager
+
+    def check(self, cwd, argv):
+        """Run a check as if `ciocheck argv` was called in `cwd`.
+
+        Return the captured stdout and stderr, and the exit status. They are
+        kept apart, records written to stdout in jsonl output format are not
+        mixed with other output.
+        """
+        old_cwd = os.getcwd()
+        old_stdout, old_stderr = sys.stdout, sys.stderr
+        sys.stdout = output = StringIO()
+        sys.stderr = error_output = StringIO()
+        status = 0
+        try:
+            os.chdir(cwd)
+            cli_args = self.parser.parse_args(argv)
+            folders, files = self.main.get_paths(cli_args.folders, cwd)
+            if cli_args.watch:
+                print('Watch mode is not available through the server',
+                      file=sys.stderr)
+                status = 2
+            elif folders or files:
+                self.main.run_checks(
+                    cwd,
+                    cli_args,
+                    folders,
+                    files,
+                    file_manager=self._get_file_manager(folders, files),
+                    formatter_pools=self.formatter_pools)
+            else:
+                print('Invalid folders or files!')
+        except SystemExit as err:
+            # Like sys.exit, None means success and other objects failure
+            if err.code is None:
+                status = 0
+            elif isinstance(err.code, int):
+                status = err.code
+            else:
+                status = 1
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stdout, sys.stderr = old_stdout, old_stderr
+            os.chdir(old_cwd)
+
+        return output.getvalue(), error_output.getvalue(), status
+
+    def server_close(self):
+        """Close the server, its formatter workers and the socket file."""
+        socketserver.UnixStreamServer.server_close(self)
+        for pool in self.formatter_pools.values():
+            pool.close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+def send_request(socket_path, request):
+    """Send a request to the server at `socket_path` and return the reply."""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        chunks = []
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        client.close()
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+
+def write_response(response):
+    """Write the output of a server `response` to stdout and stderr."""
+    sys.stdout.write(response['output'])
+    sys.stdout.flush()
+    sys.stderr.write(response.get('error_output', ''))
+
+
+def main():
+    """CLI parser for the ciocheck server and client."""
+    description = 'Run ciocheck through a persistent server.'
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '--socket',
+        '-so',
+        dest='socket',
+        default=DEFAULT_SOCKET,
+        help=('Path of the server unix socket. Default is "{0}" in the '
+              'current folder.'.format(DEFAULT_SOCKET)))
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('start', help='Start the server in the foreground')
+    subparsers.add_parser('stop', help='Stop a running server')
+    check_parser = subparsers.add_parser(
+        'check',
+        help=('Run ciocheck on the server, falling back to running it '
+              'locally if no server is running'))
+    check_parser.add_argument(
+        'args', nargs=argparse.REMAINDER, help='ciocheck arguments')
+
+    cli_args = parser.parse_args()
+    if not hasattr(socket, 'AF_UNIX'):
+        print('The ciocheck server needs unix socket support')
+        sys.exit(1)
+
+    socket_path = os.path.abspath(cli_args.socket)
+    if cli_args.command == 'start':
+        server = CiocheckServer(socket_path)
+        print('Serving ciocheck on {0}'.format(socket_path))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    elif cli_args.command == 'stop':
+        response = send_request(socket_path, {'command': 'stop'})
+        write_response(response)
+    elif cli_args.command == 'check':
+        request = {
+            'command': 'check',
+            'cwd': os.getcwd(),
+            'argv': cli_args.args,
+        }
+        try:
+            response = send_request(socket_path, request)
+        except socket.error:
+            # No server running, run ciocheck locally
+            from ciocheck.main import main as ciocheck_main
+            sys.argv = [sys.argv[0]] + cli_args.args
+            ciocheck_main()
+        else:
+            write_response(response)
+            sys.exit(response['status'])
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -12,9 +12,13 @@ import os
 
 # Local imports
 from ciocheck.config import (ALL_FILES, COMMITED_MODE, DEFAULT_BRANCH,
+                             DEFAULT_IGNORE_EXTENSIONS, DEFAULT_IGNORE_FOLDERS,
                              MODIFIED_FILES, MODIFIED_LINES, STAGED_MODE,
                              UNSTAGED_MODE)
-from ciocheck.utils import filter_files, get_files
+from ciocheck.shard import partition
+from ciocheck.trace import TRACER
+from ciocheck.utils import (filter_files, filter_paths, get_files,
+                            make_sorted_dict)
 from ciocheck.vcs import DiffTool
 
 
@@ -28,6 +32,108 @@ class FileManager(object):
         self.paths = self.files + self.folders
         self.diff_tool = DiffTool(paths=folders)
         self.cache = {}
+        self.shard = None
+        self.costs = None
+        self.shard_cache = {}
+
+    def clear_cache(self):
+        """Forget found files, but keep the version control state."""
+        self.cache = {}
+        self.shard_cache = {}
+
+    def set_shard(self, shard, costs=None):
+        """
+        Only return the files of `shard`, an `(index, count)` tuple.
+
+        Files are split using the expected `costs` (a FileCosts), see
+        `ciocheck.shard.partition`. If `shard` is None, all files are
+        returned.
+        """
+        if shard != self.shard or costs is not self.costs:
+            self.shard = shard
+            self.costs = costs
+            self.clear_cache()
+
+    def _shard_paths(self, branch, diff_mode, file_mode):
+        """
+        Return the sorted paths of the current shard.
+
+        The partition is made once on all the files, whatever their
+        extension, so every tool sees the same split.
+        """
+        return self.get_shard(branch, diff_mode, file_mode)[0]
+
+    def get_shard(self, branch, diff_mode, file_mode):
+        """Return the sorted paths of the current shard and of all shards."""
+        shard_key = (branch, diff_mode, file_mode)
+        if shard_key not in self.shard_cache:
+            index, count = self.shard
+            paths = list(
+                self._find_all_files(branch, diff_mode, file_mode, ()))
+            shards = partition(paths, count, costs=self.costs)
+            self.shard_cache[shard_key] = (shards[index - 1], sorted(paths))
+        return self.shard_cache[shard_key]
+
+    def _find_files(self, branch, diff_mode, file_mode, extensions,
+                    paths=None):
+        """Find files without using the cache, limited to `paths` if given."""
+        results = self._find_all_files(branch, diff_mode, file_mode,
+                                       extensions, paths=paths)
+        if self.shard is not None:
+            results = filter_paths(
+                results, self._shard_paths(branch, diff_mode, file_mode))
+        return results
+
+    def _find_all_files(self, branch, diff_mode, file_mode, extensions,
+                        paths=None):
+        """Find files of all shards, limited to `paths` if given."""
+        if file_mode == ALL_FILES:
+            if paths is None:
+                results = get_files(paths=self.paths)
+            else:
+                results = [
+                    p for p in sorted(paths)
+                    if os.path.isfile(p) and self._is_included(p)
+                ]
+        elif file_mode == MODIFIED_FILES:
+            if diff_mode == COMMITED_MODE:
+                results = self.diff_tool.commited_files(
+                    branch=branch, paths=paths)
+            elif diff_mode == STAGED_MODE:
+                results = self.diff_tool.staged_files(paths=paths)
+            elif diff_mode == UNSTAGED_MODE:
+                results = self.diff_tool.unstaged_files(paths=paths)
+        elif file_mode == MODIFIED_LINES:
+            if diff_mode == COMMITED_MODE:
+                results = self.diff_tool.commited_file_lines(
+                    branch=branch, paths=paths)
+            elif diff_mode == STAGED_MODE:
+                results = self.diff_tool.staged_file_lines(paths=paths)
+            elif diff_mode == UNSTAGED_MODE:
+                results = self.diff_tool.unstaged_file_lines(paths=paths)
+        return filter_files(results, extensions)
+
+    def _is_included(self, path):
+        """
+        Return True if path is one of the files or inside the folders.
+
+        Files inside folders follow the same rules used by `get_files`, hidden
+        and ignored files and folders are excluded.
+        """
+        if path in self.files:
+            return True
+
+        if any(path.endswith('.' + ext) for ext in DEFAULT_IGNORE_EXTENSIONS):
+            return False
+
+        for folder in self.folders:
+            if path.startswith(os.path.join(folder, '')):
+                parts = os.path.relpath(path, folder).split(os.sep)
+                hidden = any(part.startswith('.') for part in parts)
+                ignored = any(part in DEFAULT_IGNORE_FOLDERS
+                              for part in parts[:-1])
+                return not hidden and not ignored
+        return False
 
     def get_files(self,
                   branch=DEFAULT_BRANCH,
@@ -39,15 +145,11 @@ class FileManager(object):
         if cache_key in self.cache:
             results = self.cache[cache_key]
         else:
-            if file_mode == ALL_FILES:
-                results = get_files(paths=self.paths)
-                results = filter_files(results, extensions)
-            elif file_mode == MODIFIED_FILES:
-                results = self.get_modified_files(
-                    branch=branch, diff_mode=diff_mode, extensions=extensions)
-            elif file_mode == MODIFIED_LINES:
-                results = self.get_modified_file_lines(
-                    branch=branch, diff_mode=diff_mode, extensions=extensions)
+            with TRACER.span('find files', 'diff', file_mode=file_mode,
+                             diff_mode=diff_mode) as span:
+                results = self._find_files(branch, diff_mode, file_mode,
+                                           extensions)
+                span.args['files'] = len(results)
             self.cache[cache_key] = results
 
         return results
@@ -57,40 +159,43 @@ class FileManager(object):
                                 diff_mode=STAGED_MODE,
                                 extensions=()):
         """Find modified lines of files in paths."""
-        cache_key = (branch, diff_mode, tuple(extensions), 'lines')
-        if cache_key in self.cache:
-            results = self.cache[cache_key]
-        else:
-            if diff_mode == COMMITED_MODE:
-                results = self.diff_tool.commited_file_lines(branch=branch)
-            elif diff_mode == STAGED_MODE:
-                results = self.diff_tool.staged_file_lines()
-            elif diff_mode == UNSTAGED_MODE:
-                results = self.diff_tool.unstaged_file_lines()
-            results = filter_files(results, extensions)
-            self.cache[cache_key] = results
-
-        return results
+        return self.get_files(
+            branch=branch,
+            diff_mode=diff_mode,
+            file_mode=MODIFIED_LINES,
+            extensions=extensions)
 
     def get_modified_files(self,
                            branch=DEFAULT_BRANCH,
                            diff_mode=STAGED_MODE,
                            extensions=()):
         """Find modified files in paths."""
-        cache_key = (branch, diff_mode, tuple(extensions))
-        if cache_key in self.cache:
-            results = self.cache[cache_key]
-        else:
-            if diff_mode == COMMITED_MODE:
-                results = self.diff_tool.commited_files(branch=branch)
-            elif diff_mode == STAGED_MODE:
-                results = self.diff_tool.staged_files()
-            elif diff_mode == UNSTAGED_MODE:
-                results = self.diff_tool.unstaged_files()
-            results = filter_files(results, extensions)
-            self.cache[cache_key] = results
+        return self.get_files(
+            branch=branch,
+            diff_mode=diff_mode,
+            file_mode=MODIFIED_FILES,
+            extensions=extensions)
 
-        return results
+    def refresh(self, paths):
+        """
+        Update cached results for `paths` only.
+
+        Diffs are computed only for the given paths, results for other files
+        are kept. Cached results are replaced by new objects, not modified.
+        """
+        paths = set(paths)
+        for cache_key, old_results in list(self.cache.items()):
+            new_results = self._find_files(*cache_key, paths=list(paths))
+            if isinstance(old_results, dict):
+                results = dict(
+                    (path, lines) for (path, lines) in old_results.items()
+                    if path not in paths)
+                results.update(new_results)
+                results = make_sorted_dict(results)
+            else:
+                results = [p for p in old_results if p not in paths]
+                results = list(sorted(results + list(new_results)))
+            self.cache[cache_key] = results
 
 
 def test():
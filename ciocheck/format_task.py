@@ -5,47 +5,174 @@
 # Licensed under the terms of the MIT License
 # (see LICENSE.txt for details)
 # -----------------------------------------------------------------------------
-"""Setup auxiliary process so we can run formatters in parallel."""
+"""
+Setup auxiliary process so we can run formatters in parallel.
+
+Results are written as one json line per file as soon as it is formatted.
+With `--worker`, the process imports the formatters, writes a json line with
+`ready` and keeps running, formatting the files of each json list of
+`[path, line ranges]` read on stdin and writing a json line with `done` after
+the results of each list. A worker running out of memory writes
+a json line with the `skipped` file and exits.
+"""
 
 from __future__ import absolute_import, print_function
 
 # Standard library imports
 import ast
+import importlib
 import json
 import os
 import sys
 
 # Local imports
-from ciocheck.formatters import MULTI_FORMATTERS
-from ciocheck.utils import filter_files
+from ciocheck.registry import MULTI_FORMATTER, REGISTRY
+from ciocheck.utils import (atomic_replace, filter_files, max_rss,
+                            remap_line_ranges)
 
 
-def format_file(path):
-    """Format a file (path) using the available formatters."""
-    root_path = os.environ.get('CIOCHECK_PROJECT_ROOT')
-    check = ast.literal_eval(os.environ.get('CIOCHECK_CHECK'))
-    check_multi_formatters = [f for f in MULTI_FORMATTERS if f.name in check]
+def format_file(path, root_path=None, check=None, line_ranges=None):
+    """
+    Format a file (path) using the available formatters.
+
+    When running as a helper process, `root_path` and `check` are read from
+    the environment. If `line_ranges` is given, formatters supporting it
+    only format those `(start, end)` lines.
+    """
+    if root_path is None:
+        root_path = os.environ.get('CIOCHECK_PROJECT_ROOT')
+    if check is None:
+        check = ast.literal_eval(os.environ.get('CIOCHECK_CHECK'))
+    formatters = [
+        formatter
+        for formatter in REGISTRY.load([MULTI_FORMATTER], check)
+        if filter_files([path], formatter.extensions)
+    ]
+    if not formatters:
+        return {}
 
+    # Formatters run one after the other on the contents in memory, the file
+    # is read and written once
+    try:
+        old_contents, encoding = formatters[0].read_file(path)
+    except (UnicodeDecodeError, IOError, OSError) as error:
+        return skipped_result(path, 'could not read the file: {0}', error)
+    contents = old_contents
     results = {}
+    for formatter in formatters:
+        formatter.cmd_root = root_path
+        new_contents, encoding, result = formatter.format_contents(
+            path, contents, encoding, line_ranges)
+        if result:
+            # The diff of each formatter is against the previous one output
+            results[formatter.name] = result
+            if line_ranges:
+                # Lines moved, keep ranges on the same code
+                line_ranges = remap_line_ranges(contents, new_contents,
+                                                line_ranges)
+        contents = new_contents
 
-    for formatter in check_multi_formatters:
-        paths = filter_files([path], formatter.extensions)
-        if paths:
-            formatter.cmd_root = root_path
-            result = formatter.format_task(path)
-            if result:
-                results[formatter.name] = result
+    if contents != old_contents:
+        try:
+            atomic_replace(path, contents, encoding)
+        except (UnicodeEncodeError, IOError, OSError) as error:
+            return skipped_result(path, 'could not write the file: {0}', error)
     return results
 
 
+def skipped_result(path, reason, error):
+    """Return the results of a file left unchanged because of `error`."""
+    return {
+        MULTI_FORMATTER: {
+            'path': path,
+            'skipped': reason.format(error),
+        },
+    }
+
+
+def write_record(output, record):
+    """Write `record` as a json line and flush, so it is read right away."""
+    output.write(json.dumps(record) + '\n')
+    output.flush()
+
+
+def format_paths(tasks, output):
+    """
+    Format the `(path, line ranges)` of `tasks`.
+
+    The results of each file are written once it is done. Return False if a
+    file was skipped for running out of memory.
+    """
+    for path, line_ranges in tasks:
+        if line_ranges is not None:
+            line_ranges = [tuple(line_range) for line_range in line_ranges]
+        results = None
+        try:
+            results = format_file(path, line_ranges=line_ranges)
+        except MemoryError:
+            # The memory used by formatters is freed after handling the error
+            pass
+
+        if results is None:
+            write_record(output, {
+                'path': path,
+                'skipped': 'went over the memory limit',
+            })
+            return False
+        write_record(output, {'path': path, 'results': results})
+    return True
+
+
+def limit_memory(megabytes):
+    """Limit the memory of this process to `megabytes`, 0 means no limit."""
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return
+    if not megabytes:
+        return
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = megabytes * 1024 * 1024
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def import_formatters():
+    """Import the modules of the selected formatters."""
+    check = ast.literal_eval(os.environ.get('CIOCHECK_CHECK'))
+    for formatter in REGISTRY.load([MULTI_FORMATTER], check):
+        try:
+            importlib.import_module(formatter.module or formatter.name)
+        except ImportError:
+            # Files are left unchanged when formatting fails
+            pass
+
+
+def worker():
+    """Format batches of files read from stdin until it is closed."""
+    output = sys.stdout
+    # Formatters may print, only results go to the real stdout
+    sys.stdout = sys.stderr
+    limit_memory(int(os.environ.get('CIOCHECK_MEMORY_LIMIT') or 0))
+    # Startup time is not counted in the time of the first formatted file
+    import_formatters()
+    write_record(output, {'ready': True})
+    for line in iter(sys.stdin.readline, ''):
+        if not format_paths(json.loads(line), output):
+            # The memory of the process may be in a bad state
+            break
+        write_record(output, {'done': True, 'memory': max_rss()})
+
+
 def main():
     """Main script."""
-    task_results = []
-    for filename in sys.argv[1:]:
-        task_result = format_file(filename)
-        if task_result:
-            task_results.append(task_result)
-    print(json.dumps(task_results))
+    if sys.argv[1:] == ['--worker']:
+        worker()
+    else:
+        format_paths([(path, None) for path in sys.argv[1:]], sys.stdout)
     sys.exit(0)
 
 
@@ -8,69 +8,125 @@
 """Generic and custom code formatters."""
 
 # Standard library imports
+from collections import OrderedDict
 import codecs
-import json
+import copy
 import os
 import platform
 import re
-import subprocess
-import sys
-
-# Third party imports
-from yapf.yapflib.yapf_api import FormatCode
-import autopep8
-import isort
+import time
 
 # Local imports
+from ciocheck.cache import file_stamp, hash_file, tool_fingerprint
 from ciocheck.config import DEFAULT_COPYRIGHT_HEADER
+from ciocheck.registry import MULTI_FORMATTER, REGISTRY
 from ciocheck.tools import Tool
-from ciocheck.utils import atomic_replace, cpu_count, diff
+from ciocheck.trace import TRACER
+from ciocheck.utils import atomic_replace, cpu_count, diff, to_line_ranges
+from ciocheck.workers import (FORMAT_COSTS, FormatterPool, add_costs,
+                              make_batches)
+
+# Parsed formatter configs by config path, with the (mtime, size) of the
+# config file they were parsed from
+_CONFIGS = {}
+
+
+def _file_stamp(path):
+    """Return the stamp of `path`, or None if it does not exist."""
+    try:
+        return file_stamp(path)
+    except OSError:
+        return None
 
-HERE = os.path.dirname(os.path.realpath(__file__))
+
+def _out_of_memory(error):
+    """Return True if `error` is or was raised handling a MemoryError."""
+    while error is not None:
+        if isinstance(error, MemoryError):
+            return True
+        # Formatters like yapf turn errors into their own
+        error = getattr(error, '__context__', None)
+    return False
 
 
 class Formatter(Tool):
     """Generic formatter tool."""
 
+    # If True, `format_string` can limit changes to given line ranges
+    supports_line_ranges = False
+
     @classmethod
     def format_task(cls, path):
         """Forma trask executed by parallel script helper."""
-        changed = False
-        old_contents, new_contents = '', ''
-        error = None
-        try:
-            old_contents, new_contents, encoding = cls.format_file(path)
-            changed = new_contents != old_contents
-        except Exception as err:
-            error = "{name} crashed on {path}: {error}".format(
-                name=cls.name, path=path, error=err)
-
-        if changed:
-            result = {
-                'path': path,
-                'error': error,
-                #            'new-contents': new_contents,
-                #            'old-contents': old_contents,
-                'diff': diff(old_contents, new_contents),
-                'created': False,  # pyformat might create new init files.
-            }
+        old_contents, encoding = cls.read_file(path)
+        new_contents, encoding, result = cls.format_contents(
+            path, old_contents, encoding)
+        if result:
             atomic_replace(path, new_contents, encoding)
-        else:
-            return {}
-
         return result
 
     @classmethod
-    def format_string(cls, old_contents):
-        """Format content of a file."""
+    def format_contents(cls, path, old_contents, encoding, line_ranges=None):
+        """
+        Format `old_contents` of `path` without writing the file.
+
+        If `line_ranges` is given, formatters supporting it only format those
+        `(start, end)` lines. Return `(new_contents, encoding, result)`, the
+        result is empty if the formatter did not change anything.
+        """
+        try:
+            if line_ranges is None or not cls.supports_line_ranges:
+                old_contents, new_contents, encoding = cls.format_string(
+                    old_contents)
+            elif line_ranges:
+                old_contents, new_contents, encoding = cls.format_string(
+                    old_contents, line_ranges=line_ranges)
+            else:
+                # No lines to format
+                return old_contents, encoding, {}
+        except Exception as error:
+            if _out_of_memory(error):
+                # Worker processes skip files going over their memory limit
+                raise MemoryError()
+            # A crashing formatter leaves the contents as they were
+            return old_contents, encoding, {}
+
+        if new_contents == old_contents:
+            return old_contents, encoding, {}
+
+        result = {
+            'path': path,
+            'error': None,
+            'diff': diff(old_contents, new_contents),
+            'created': False,  # pyformat might create new init files.
+        }
+        return new_contents, encoding, result
+
+    @classmethod
+    def format_string(cls, old_contents, line_ranges=None):
+        """Format content of a file, limited to `line_ranges` if supported."""
         raise NotImplementedError
 
     @classmethod
-    def format_file(cls, path):
-        """Format file for use with task queue."""
+    def cached_config(cls, config_path, load):
+        """
+        Return `load(config_path)`, parsed once per process.
+
+        The parsed config is reused until the config file changes.
+        """
+        key = (cls.name, config_path)
+        stamp = _file_stamp(config_path)
+        cached = _CONFIGS.get(key)
+        if cached is None or cached[0] != stamp:
+            cached = (stamp, load(config_path))
+            _CONFIGS[key] = cached
+        return cached[1]
+
+    @classmethod
+    def read_file(cls, path):
+        """Return the contents of `path` and the encoding to write it."""
         with open(path, 'r') as file_obj:
-            old_contents = file_obj.read()
-        return cls.format_string(old_contents)
+            return file_obj.read(), 'utf-8'
 
     def run(self, paths):
         """Format paths."""
@@ -95,6 +151,9 @@ class IsortFormatter(Formatter):
     @classmethod
     def format_string(cls, old_contents):
         """Format content of a file."""
+        # Formatters are imported when used, to keep startup fast
+        import isort
+
         new_contents = isort.SortImports(file_contents=old_contents).output
         return old_contents, new_contents, 'utf-8'
 
@@ -109,21 +168,43 @@ class YapfFormatter(Formatter):
     # Config
     config_file = '.style.yapf'
     config_sections = [('yapf:style', 'style')]
+    supports_line_ranges = True
 
     def run(self, paths):
         """Format paths."""
         pass
 
+    @staticmethod
+    def _load_style(style_config):
+        """Return the parsed style of `style_config` and if it is reusable."""
+        from yapf.yapflib import style
+
+        parsed_style = style.CreateStyleFromConfig(style_config)
+        # Without a style config, yapf uses the global style, or a new
+        # default style if it is equal to a predefined style
+        style.SetGlobalStyle(parsed_style)
+        reusable = style.CreateStyleFromConfig(None) == parsed_style
+        return parsed_style, reusable
+
     @classmethod
-    def format_string(cls, old_contents):
+    def format_string(cls, old_contents, line_ranges=None):
         """Format file for use with task queue."""
+        from yapf.yapflib import style
+        from yapf.yapflib.yapf_api import FormatCode
+
         # cmd_root is assigned to formatter inside format_task... ugly!
         style_config = os.path.join(cls.cmd_root, cls.config_file)
+        parsed_style, reusable = cls.cached_config(style_config,
+                                                   cls._load_style)
+        if reusable:
+            # Avoid reading and parsing the style file for every file
+            style.SetGlobalStyle(parsed_style)
+            style_config = None
         # It might be tempting to use the "inplace" option to FormatFile, but
         # it doesn't do an atomic replace, which is dangerous, so don't use
         # it unless you submit a fix to yapf.
         (new_contents, changed) = FormatCode(
-            old_contents, style_config=style_config)
+            old_contents, style_config=style_config, lines=line_ranges)
 
         if platform.system() == 'Windows':
             # yapf screws up line endings on windows
@@ -145,17 +226,41 @@ class Autopep8Formatter(Formatter):
     # Config
     config_file = '.autopep8'
     config_sections = [('autopep8', 'pep8')]
+    supports_line_ranges = True
 
     def run(self, paths):
         """Format paths."""
         pass
 
+    @staticmethod
+    def _load_options(config_path):
+        """Return the parsed autopep8 options."""
+        import autopep8
+
+        # Options of the config file are not applied, autopep8 rejects some
+        # of the values read by `make_config_dictionary`
+        return autopep8.parse_args([''], apply_config=False)
+
     @classmethod
-    def format_string(cls, old_contents):
+    def format_string(cls, old_contents, line_ranges=None):
         """Format file for use with task queue."""
-        config_options = cls.make_config_dictionary()
-        config_options = {}
-        new_contents = autopep8.fix_code(old_contents, options=config_options)
+        import autopep8
+
+        # Parsing options takes longer than fixing a small file, autopep8
+        # uses parsed options as they are
+        config_path = os.path.join(cls.cmd_root, cls.config_file)
+        config_options = cls.cached_config(config_path, cls._load_options)
+        if line_ranges is None:
+            new_contents = autopep8.fix_code(
+                old_contents, options=copy.copy(config_options))
+        else:
+            # Autopep8 takes a single range, fixing the last range first
+            # keeps the line numbers of the others valid
+            new_contents = old_contents
+            for start, end in reversed(line_ranges):
+                options = copy.copy(config_options)
+                options.line_range = [start, end]
+                new_contents = autopep8.fix_code(new_contents, options=options)
         return old_contents, new_contents, 'utf-8'
 
 
@@ -165,25 +270,44 @@ class MultiFormatter(object):
     language = 'generic'
     name = 'multiformatter'
 
-    def __init__(self, cmd_root, check):
-        """Formatter handling multiple formatters in parallel."""
+    def __init__(self,
+                 cmd_root,
+                 check,
+                 in_process=False,
+                 cache=None,
+                 index=None,
+                 worker_tasks=0,
+                 worker_memory=0,
+                 format_timeout=0,
+                 format_memory=0,
+                 pools=None):
+        """Formatter handling multiple formatters in parallel.
+
+        If `in_process` is True, files are formatted one after the other in
+        the current process, reusing already imported formatters. If a result
+        `cache` is given, files with cached results are not formatted again.
+        If a formatted `index` is given, files with contents known to be
+        formatted are skipped and files left unchanged are added to it.
+
+        Otherwise files are formatted by a pool of worker processes, replaced
+        after formatting `worker_tasks` batches or using more than
+        `worker_memory` megabytes. Files taking more than `format_timeout`
+        seconds or `format_memory` megabytes are skipped and their worker
+        replaced. 0 means no limit. If a `pools` dict is given, worker pools
+        are kept in it and their workers are reused by the next runs.
+        """
         self.cmd_root = cmd_root
         self.check = check
-
-    def _format_files(self, paths):
-        """Helper method to start a seaparate subprocess."""
-        cmd = [sys.executable, os.path.join(HERE, 'format_task.py')]
-        env = os.environ.copy()
-        env['CIOCHECK_PROJECT_ROOT'] = self.cmd_root
-        env['CIOCHECK_CHECK'] = str(self.check)
-        proc = subprocess.Popen(
-            cmd + paths,
-            env=env,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE)
-        return proc
-
-    def _format_results(self, results):
+        self.in_process = in_process
+        self.cache = cache
+        self.index = index
+        self.worker_tasks = worker_tasks
+        self.worker_memory = worker_memory
+        self.format_timeout = format_timeout
+        self.format_memory = format_memory
+        self.pools = pools
+
+    def format_results(self, results):
         """Rearrange results for standard consumption."""
         new_results = {}
         for item in results:
@@ -201,79 +325,207 @@ class MultiFormatter(object):
     def extensions(self):
         """Return all extensions of the used multiformatters."""
         all_extensions = []
-        for formatter in MULTI_FORMATTERS:
-            all_extensions += list(formatter.extensions)
+        for spec in REGISTRY.specs([MULTI_FORMATTER]):
+            all_extensions += list(spec.extensions)
         return all_extensions
 
-    def run(self, paths):
+    def _fingerprint(self):
+        """Return the parts identifying the enabled formatters setup."""
+        parts = (self.name, )
+        for formatter in REGISTRY.load([MULTI_FORMATTER], self.check):
+            parts += tool_fingerprint(formatter, self.cmd_root)
+        return parts
+
+    def iter_run(self, paths):
         """
-        Run formatters.
+        Run formatters and yield results as soon as files are done.
 
-        This uses some silly multi-process stuff because Yapf is very slow and
-        CPU-bound.
+        Yields `(batch_paths, batch_results)` tuples in completion order,
+        worker processes yield each file on its own. When
+        using a cache, files with cached results are yielded first as a
+        single batch, their cached new contents are written back. Files known
+        to be formatted by the index are yielded first, without results.
 
-        Not using a multiprocessing because not sure how its "magic" (pickling,
-        __main__ import) really works.
+        If `paths` is a dict of path: (added lines, deleted lines), like in
+        the modified lines file mode, only the added lines are formatted by
+        formatters supporting line ranges.
         """
-        processes = []
+        line_ranges = None
         if isinstance(paths, dict):
+            line_ranges = dict((path, self._line_ranges(lines))
+                               for (path, lines) in paths.items())
             paths = list(sorted(paths.keys()))
+        else:
+            paths = list(paths)
+
+        if self.index is None:
+            for batch, output in self._iter_cached(paths, line_ranges):
+                yield batch, output
+            return
+
+        fingerprint = self._fingerprint()
+        keys = OrderedDict()
+        formatted_paths = []
+        for path in paths:
+            ranges = line_ranges.get(path) if line_ranges else None
+            contents_hash = hash_file(path)
+            key = self.index.make_key(fingerprint, contents_hash, ranges)
+            # Formatted contents are also formatted in any line range
+            full_key = self.index.make_key(fingerprint, contents_hash)
+            if self.index.contains(full_key, key):
+                formatted_paths.append(path)
+            else:
+                keys[path] = key
+
+        if formatted_paths:
+            yield formatted_paths, []
+
+        for batch, output in self._iter_cached(list(keys), line_ranges,
+                                               fingerprint):
+            changed_paths = set(result['path'] for item in output
+                                for result in item.values())
+            for path in batch:
+                if path not in changed_paths:
+                    self.index.add(keys[path])
+            yield batch, output
+
+    def _iter_cached(self, paths, line_ranges, fingerprint=None):
+        """Format `paths` like `iter_run`, using the result cache if any."""
+        if self.cache is None:
+            for batch, output in self._iter_format(paths, line_ranges):
+                yield batch, output
+            return
+
+        fingerprint = fingerprint or self._fingerprint()
+        keys = OrderedDict()
+        cached_paths = []
+        cached_results = []
+        for path in paths:
+            relative_path = os.path.relpath(path, self.cmd_root)
+            ranges = line_ranges.get(path) if line_ranges else None
+            key = self.cache.make_key(*(fingerprint + (
+                relative_path, self.cache.hash_file(path), repr(ranges))))
+            value = self.cache.get(self.name, key)
+            if value is None:
+                keys[path] = key
+                continue
+
+            if value['contents'] is not None:
+                atomic_replace(path, value['contents'], 'utf-8')
+            cached_paths.append(path)
+            if value['results']:
+                cached_results.append(
+                    dict((name, dict(result, path=path))
+                         for (name, result) in value['results'].items()))
+
+        if cached_paths:
+            yield cached_paths, cached_results
+
+        for batch, output in self._iter_format(list(keys), line_ranges):
+            results_by_path = {}
+            for item in output:
+                for name, result in item.items():
+                    result = dict(result)
+                    path = result.pop('path')
+                    results_by_path.setdefault(path, {})[name] = result
+
+            for path in batch:
+                results = results_by_path.get(path, {})
+                if self.name in results:
+                    # Skipped, limits may not be reached on the next run
+                    continue
+                contents = None
+                if results:
+                    with codecs.open(path, 'r', 'utf-8') as file_obj:
+                        contents = file_obj.read()
+                self.cache.set(keys[path], {
+                    'results': results,
+                    'contents': contents,
+                })
+            yield batch, output
+
+    @staticmethod
+    def _line_ranges(lines):
+        """Return the ranges of added `lines`, None to format all lines."""
+        added_lines = lines[0] if lines else []
+        if added_lines == [-1]:
+            # Files outside version control have all their lines changed
+            return None
+        return to_line_ranges(added_lines)
+
+    def _iter_format(self, paths, line_ranges=None):
+        """
+        Format paths, yielding `(batch_paths, batch_results)` tuples.
 
-        def await_one_process():
-            """Wait for one process and parse output."""
-            if processes:
-                # We pop(0) because the first process is the oldest
-                proc = processes.pop(0)
-                output, error = proc.communicate()
-
-                if isinstance(output, bytes):
-                    output = output.decode()
-
-                if isinstance(error, bytes):
-                    error = error.decode()
-
-                output = json.loads(output)
-                if error:
-                    print(error)
+        This uses some silly multi-process stuff because Yapf is very slow and
+        CPU-bound.
 
-                return output, error
+        Not using a multiprocessing because not sure how its "magic" (pickling,
+        __main__ import) really works. Worker processes are reused between
+        batches, so formatters are imported once per worker.
+        """
+        # Batches run one at a time if a formatter can not run in parallel
+        workers = 1 if self.in_process else cpu_count()
+        for spec in REGISTRY.specs([MULTI_FORMATTER]):
+            if spec.name in self.check and not spec.parallel_safe:
+                workers = 1
+
+        # Files are sent to workers in batches of similar expected cost, to
+        # reduce the communication overhead without stalling on large files
+        batches = make_batches(paths, workers, FORMAT_COSTS)
+        if self.in_process:
+            # Avoid a circular import, format_task imports this module
+            from ciocheck.format_task import format_file
+
+            line_ranges = line_ranges or {}
+            for batch in batches:
+                results = []
+                with TRACER.span('format batch', 'formatter',
+                                 files=len(batch)):
+                    for path in batch:
+                        start = time.time()
+                        results.append(
+                            format_file(path, self.cmd_root, self.check,
+                                        line_ranges.get(path)))
+                        add_costs(path, time.time() - start)
+                yield batch, [r for r in results if r]
+            return
+
+        pool = self._get_pool(workers)
+        for batch, output in pool.iter_run(batches, line_ranges):
+            if output is None:
+                # Killed when stopping early, the batch was not formatted
+                continue
+            yield batch, [o for o in output if o]
+
+    def _get_pool(self, workers):
+        """Return the worker pool formatting files with `workers` workers."""
+        # Workers started for another project, other formatters or memory
+        # limit can not be reused
+        key = (self.cmd_root, tuple(self.check), self.format_memory)
+        pool = self.pools.get(key) if self.pools is not None else None
+        if pool is None:
+            pool = FormatterPool(
+                self.cmd_root,
+                self.check,
+                memory_limit=self.format_memory,
+                name=self.name,
+                keep_workers=self.pools is not None)
+            if self.pools is not None:
+                self.pools[key] = pool
+
+        pool.workers = max(1, workers)
+        pool.max_tasks = self.worker_tasks
+        pool.max_memory = self.worker_memory
+        pool.timeout = self.format_timeout
+        return pool
 
-        def await_all_processes():
-            """Wait for all processes."""
-            results = []
-            while processes:
-                output, error = await_one_process()
-                output = [o for o in output if o]
-                if output:
-                    results += output
-                if error:
-                    print(error)
-            return results
-
-        def take_n(items, amount):
-            """Take n items to pass to the processes."""
-            result = []
-            while amount > 0 and items:
-                result.append(items.pop(0))  # Keep order
-                amount = amount - 1
-            return list(sorted(result))
-
-        while paths:
-            # We send a few files to each process to try to reduce per-process
-            # setup time
-            some_files = take_n(paths, 3)
-            processes.append(self._format_files(some_files))
-
-            # Don't run too many at once, this is a goofy algorithm
-            if len(processes) > (cpu_count() * 3):
-                while len(processes) > cpu_count():
-                    await_one_process()
-
-        assert [] == paths
-        results = await_all_processes()
-        results = self._format_results(results)
-        assert [] == processes
-        return results
+    def run(self, paths):
+        """Run formatters and wait for all of them to finish."""
+        results = []
+        for batch, batch_results in self.iter_run(paths):
+            results += batch_results
+        return self.format_results(results)
 
 
 class PythonFormatter(Formatter):
@@ -281,6 +533,7 @@ class PythonFormatter(Formatter):
 
     language = 'python'
     name = 'pyformat'
+    module = 'ciocheck'
     extensions = ('py', )
 
     COPYRIGHT_RE = re.compile('# *Copyright ')
@@ -419,19 +672,6 @@ class PythonFormatter(Formatter):
         return results
 
 
-MULTI_FORMATTERS = [
-    IsortFormatter,
-    YapfFormatter,
-    Autopep8Formatter,
-]
-FORMATTERS = [
-    PythonFormatter,
-    IsortFormatter,
-    YapfFormatter,
-    Autopep8Formatter,
-]
-
-
 def test():
     """Main local test."""
     pass
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""Record of recent failures, used to check likely failures first."""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+import json
+import os
+import time
+
+# Local imports
+from ciocheck.config import HISTORY_FILE
+from ciocheck.utils import atomic_replace
+
+# Failures older than this many seconds are forgotten
+MAX_AGE = 7 * 24 * 60 * 60
+
+
+class FailureHistory(object):
+    """Time of the last failure of tools and files."""
+
+    def __init__(self, cmd_root, file_name=HISTORY_FILE):
+        """Time of the last failure of tools and files.
+
+        Paths are stored relative to `cmd_root`, so the history file can be
+        shared between checkouts.
+        """
+        self.cmd_root = cmd_root
+        self.path = os.path.join(cmd_root, file_name)
+        self.tools = {}
+        self.files = {}
+        self.load()
+
+    def load(self):
+        """Load the history file, a missing or broken file is ignored."""
+        try:
+            with open(self.path, 'r') as file_obj:
+                data = json.load(file_obj)
+            self.tools = dict(data.get('tools', {}))
+            self.files = dict(data.get('files', {}))
+        except (IOError, OSError, ValueError, AttributeError):
+            self.tools = {}
+            self.files = {}
+
+    def save(self):
+        """Write the history file."""
+        data = {'tools': self.tools, 'files': self.files}
+        try:
+            atomic_replace(self.path, json.dumps(data, sort_keys=True),
+                           'utf-8')
+        except (IOError, OSError):
+            pass
+
+    def record(self, tool_names, paths, timestamp=None):
+        """Record a failure of `tool_names` and `paths` now."""
+        if timestamp is None:
+            timestamp = time.time()
+
+        for tool_name in tool_names:
+            self.tools[tool_name] = timestamp
+        for path in paths:
+            self.files[os.path.relpath(path, self.cmd_root)] = timestamp
+
+        for entries in [self.tools, self.files]:
+            for key, last_failure in list(entries.items()):
+                if timestamp - last_failure > MAX_AGE:
+                    entries.pop(key)
+
+    def tool_priority(self, tool_name):
+        """Return a priority for `tool_name`, higher if it failed recently."""
+        return self.tools.get(tool_name, 0)
+
+    def file_priority(self, path):
+        """Return a priority for `path`, higher if it failed recently."""
+        return self.files.get(os.path.relpath(path, self.cmd_root), 0)
+
+    def sort_paths(self, paths):
+        """Return `paths` with recently failing files first."""
+        return sorted(paths, key=lambda path: -self.file_priority(path))
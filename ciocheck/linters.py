@@ -11,9 +11,12 @@
 import json
 import os
 import re
+import time
 
 # Local imports
+from ciocheck.shard import COSTS
 from ciocheck.tools import Tool
+from ciocheck.trace import TRACER
 from ciocheck.utils import run_command
 
 
@@ -74,7 +77,10 @@ class Linter(Tool):
         if self.paths:
             args = list(self.command)
             args += self.paths
-            out, err = run_command(args)
+            start = time.time()
+            with TRACER.span(self.name, 'linter', files=len(self.paths)):
+                out, err = run_command(args)
+            COSTS.add(self.paths, time.time() - start)
             if self.output_on_stderr:
                 string = err
             else:
@@ -172,14 +178,6 @@ class PylintLinter(Linter):
         return results
 
 
-LINTERS = [
-    Pep8Linter,
-    PydocstyleLinter,
-    Flake8Linter,
-    PylintLinter,
-]
-
-
 def test():
     """Main local test."""
     here = os.path.dirname(os.path.realpath(__file__))
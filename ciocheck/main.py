@@ -9,47 +9,169 @@
 
 # Standard library imports
 from collections import OrderedDict
+from functools import partial
 import argparse
 import os
 import shutil
 import sys
+import threading
 
 # Local imports
-from ciocheck.config import ALL_FILES, load_config
+from ciocheck.cache import (FORMATTED_INDEX_FILE, FormattedIndex, ResultCache,
+                            get_cache_dir, run_cached)
+from ciocheck.config import (ALL_FILES, FORMAT_COSTS_FILE, JSONL_OUTPUT,
+                             TEXT_OUTPUT, load_config)
 from ciocheck.files import FileManager
-from ciocheck.formatters import FORMATTERS, MULTI_FORMATTERS, MultiFormatter
-from ciocheck.linters import LINTERS
-from ciocheck.tools import TOOLS
+from ciocheck.formatters import MultiFormatter
+from ciocheck.history import FailureHistory
+from ciocheck.linters import Linter
+from ciocheck.output import (JsonLinesWriter, coverage_record, result_records,
+                             summary_record, tests_record)
+from ciocheck.pipeline import StreamPipeline
+from ciocheck.registry import (FORMATTER, LINTER, MULTI_FORMATTER, REGISTRY,
+                               TESTER)
+from ciocheck.scheduler import Scheduler
+from ciocheck.shard import COSTS, FileCosts, parse_shard
+from ciocheck.trace import TRACER
+from ciocheck.utils import (allow_processes, cpu_count, filter_paths,
+                            kill_processes, make_sorted_dict)
+from ciocheck.watch import FileWatcher
+from ciocheck.workers import FORMAT_COSTS
+
+# Line information used for files without diff information, in the same
+# (added, deleted) form produced by the diff tools.
+ALL_LINES = ([-1], range(100000))
+
+# Number of files linted at once in fail fast mode, after recently failing
+# files
+FAIL_FAST_BATCH_SIZE = 50
 
 
 class Runner(object):
     """Main tool runner."""
 
-    def __init__(self, cmd_root, cli_args, folders=None, files=None):
-        """Main tool runner."""
+    def __init__(self,
+                 cmd_root,
+                 cli_args,
+                 folders=None,
+                 files=None,
+                 file_manager=None,
+                 in_process=False,
+                 formatter_pools=None):
+        """Main tool runner.
+
+        A `file_manager` can be given to reuse its version control state
+        between runs. If `in_process` is True, multi formatters run in the
+        current process instead of in helper subprocesses. A
+        `formatter_pools` dict keeps multi formatter worker processes
+        running between runs.
+        """
         # Run options
         self.cmd_root = cmd_root  # Folder on which the command was executed
-        self.config = load_config(cmd_root, cli_args)
-        self.file_manager = FileManager(folders=folders, files=files)
+        with TRACER.span('load config', 'config'):
+            self.config = load_config(cmd_root, cli_args)
+        if file_manager is None:
+            file_manager = FileManager(folders=folders, files=files)
+        self.file_manager = file_manager
+        self.in_process = in_process
+        self.formatter_pools = formatter_pools
         self.folders = folders
         self.files = files
         self.all_results = OrderedDict()
         self.all_tools = {}
         self.test_results = None
         self.failed_checks = set()
+        self.failed_paths = set()
+        self._line_filters = {}
+        self.path_filter = None  # Files checked again in watch mode
+        self.history = FailureHistory(cmd_root)
+        self.stopped_by = None  # Enforced tool that stopped a fail fast run
+        self._stop_lock = threading.Lock()
+        self._scheduler = None
+        self._pipeline = None
+        self._stream_files = {}
 
         self.check = self.config.get_value('check')
         self.enforce = self.config.get_value('enforce')
         self.diff_mode = self.config.get_value('diff_mode')
         self.file_mode = self.config.get_value('file_mode')
         self.branch = self.config.get_value('branch')
+        self.jobs = self.config.get_value('jobs') or cpu_count()
+        self.stream = self.config.get_value('stream')
+        self.fail_fast = self.config.get_value('fail_fast')
+        self.output_format = self.config.get_value('output_format')
+        self.writer = None  # Writes json records in jsonl output format
+        self.cache = None
+        if self.config.get_value('cache'):
+            cache_dir = get_cache_dir(cmd_root,
+                                      self.config.get_value('cache_dir'))
+            self.cache = ResultCache(
+                cache_dir, max_size=self.config.get_value('cache_size'))
+        self.format_index = None
+        if self.config.get_value('format_index'):
+            cache_dir = get_cache_dir(cmd_root,
+                                      self.config.get_value('cache_dir'))
+            self.format_index = FormattedIndex(
+                os.path.join(cache_dir, FORMATTED_INDEX_FILE))
         self.disable_formatters = cli_args.disable_formatters
         self.disable_linters = cli_args.disable_linters
         self.disable_tests = cli_args.disable_tests
 
-    def run(self):
-        """Run tools."""
+        # Only files of the shard are checked, so the exit status only
+        # depends on them. Every node has to split files the same way, so
+        # costs are only read from the given shared file and shard runs do
+        # not record new ones.
+        self.shard = None
+        shard_costs = None
+        if cli_args.shard:
+            self.shard = parse_shard(cli_args.shard)
+            if cli_args.shard_costs:
+                shard_costs = FileCosts()
+                shard_costs.read(cmd_root, cli_args.shard_costs)
+            # Costs recorded by a shard would only cover its own files
+            COSTS.read(cmd_root)
+        else:
+            COSTS.enable(cmd_root)
+        self.file_manager.set_shard(self.shard, costs=shard_costs)
+        # Formatter time per file balances formatter batches of every run
+        FORMAT_COSTS.enable(cmd_root, FORMAT_COSTS_FILE)
+
+    def run(self, paths=None, exit_on_failure=True):
+        """
+        Run tools.
+
+        If `paths` is given, only those files are checked again and their
+        results replace the ones from previous runs.
+        """
+        if self.output_format != JSONL_OUTPUT:
+            return self._run(paths=paths, exit_on_failure=exit_on_failure)
+
+        # Records are written to stdout as results are produced, any other
+        # output goes to stderr
+        stdout = sys.stdout
+        self.writer = JsonLinesWriter(stdout)
+        sys.stdout = sys.stderr
+        try:
+            return self._run(paths=paths, exit_on_failure=exit_on_failure)
+        finally:
+            sys.stdout = stdout
+            self.writer = None
+
+    def _run(self, paths=None, exit_on_failure=True):
+        """Run tools, see `run`."""
+        self.failed_checks = set()
+        self.failed_paths = set()
+        self._line_filters = {}
+        self.stopped_by = None
+        self._pipeline = None
+        allow_processes()
+        if paths is not None:
+            self.file_manager.refresh(paths)
+            self.path_filter = set(paths)
+
         msg = 'Running ciocheck'
+        if self.shard is not None:
+            msg += ' (shard {0}/{1})'.format(*self.shard)
         print('')
         print('=' * len(msg))
         print(msg)
@@ -57,109 +179,622 @@ class Runner(object):
         print('')
         self.clean()
 
-        check_linters = [l for l in LINTERS if l.name in self.check]
-        check_formatters = [f for f in FORMATTERS if f.name in self.check]
-        check_testers = [t for t in TOOLS if t.name in self.check]
-        run_multi = any(f for f in MULTI_FORMATTERS if f.name in self.check)
+        # Only the selected tools are imported
+        check_linters = REGISTRY.load([LINTER], self.check)
+        check_formatters = REGISTRY.load([FORMATTER, MULTI_FORMATTER],
+                                         self.check)
+        check_testers = REGISTRY.load([TESTER], self.check)
+        run_multi = any(
+            name in self.check for name in REGISTRY.names([MULTI_FORMATTER]))
 
-        # Format before lint, linters may complain about bad formatting
+        # Format before lint, linters may complain about bad formatting.
+        # Formatters change files in place so they run one after the other,
+        # linters wait for all of them and tests only wait for the formatters
+        # that change their input files.
+        scheduler = Scheduler(jobs=self.jobs)
+        self._scheduler = scheduler
+        formatter_tasks = []
+        linter_tasks = []
+        stream_tasks = []
+        stream = (self.stream and not self.disable_formatters and
+                  not self.disable_linters)
+        if stream:
+            # Formatters and linters run as a single streaming stage, linters
+            # that can not lint batches at the same time run after it
+            stream_linters = [
+                linter for linter in check_linters
+                if REGISTRY.get(linter.name).parallel_safe
+            ]
+            stream_tasks = self.add_stream_stage(
+                scheduler, check_formatters, run_multi, stream_linters)
+            other_linters = [
+                linter for linter in check_linters
+                if linter not in stream_linters
+            ]
+            linter_tasks = self.add_linter_stages(
+                scheduler,
+                other_linters,
+                depends=[stage.name for (_, files, stage) in stream_tasks])
+        else:
+            if not self.disable_formatters:
+                formatter_tasks = self.add_formatter_stages(
+                    scheduler, check_formatters, run_multi)
 
-        # Formatters
-        if not self.disable_formatters:
-            for formatter in check_formatters:
-                print('Running "{}" ...'.format(formatter.name))
-                tool = formatter(self.cmd_root)
-                files = self.file_manager.get_files(
-                    branch=self.branch,
-                    diff_mode=self.diff_mode,
-                    file_mode=self.file_mode,
-                    extensions=tool.extensions)
-                tool.create_config(self.config)
-                self.all_tools[tool.name] = tool
-                results = tool.run(files)
-                # Pyformat might include files in results that are not in files
-                # like when an init is created
-                if results:
-                    self.all_results[tool.name] = {
-                        'files': files,
-                        'results': results,
-                    }
-
-            # The result of the the multi formatter is special!
-            if run_multi:
-                print('Running "Multi formatter"')
-                tool = MultiFormatter(self.cmd_root, self.check)
-                files = self.file_manager.get_files(
-                    branch=self.branch,
-                    diff_mode=self.diff_mode,
-                    file_mode=self.file_mode,
-                    extensions=tool.extensions)
-                multi_results = tool.run(files)
-                for key, values in multi_results.items():
-                    self.all_results[key] = {
-                        'files': files,
-                        'results': values,
-                    }
-
-        # Linters
-        if not self.disable_linters:
-            for linter in check_linters:
-                print('Running "{}" ...'.format(linter.name))
-                tool = linter(self.cmd_root)
-                files = self.file_manager.get_files(
-                    branch=self.branch,
-                    diff_mode=self.diff_mode,
-                    file_mode=self.file_mode,
-                    extensions=tool.extensions)
-                self.all_tools[tool.name] = tool
-                tool.create_config(self.config)
-                self.all_results[tool.name] = {
-                    'files': files,
-                    'results': tool.run(files),
-                }
-
-        # Tests
+            if not self.disable_linters:
+                depends = [stage.name for (_, files, stage) in formatter_tasks]
+                linter_tasks = self.add_linter_stages(
+                    scheduler, check_linters, depends=depends)
+
+        tester_tasks = []
         if not self.disable_tests:
-            for tester in check_testers:
-                print('Running "{}" ...'.format(tester.name))
-                tool = tester(self.cmd_root)
-                tool.create_config(self.config)
-                self.all_tools[tool.name] = tool
-
-                if tool.name == 'pytest':
-                    tool.setup_pytest_coverage_args(self.folders)
-
-                files = self.file_manager.get_files(
-                    branch=self.branch,
-                    diff_mode=self.diff_mode,
-                    file_mode=ALL_FILES,
-                    extensions=tool.extensions)
-                results = tool.run(files)
-                if results:
-                    results['files'] = files
-                    self.test_results = results
-
-        for tool in LINTERS + FORMATTERS + TOOLS:
-            tool.remove_config(self.cmd_root)
-        self.clean()
+            tester_tasks = self.add_tester_stages(
+                scheduler,
+                check_testers,
+                formatter_tasks=formatter_tasks + stream_tasks)
+
+        try:
+            scheduler.run()
+        finally:
+            for tool in check_linters + check_formatters + check_testers:
+                tool.remove_config(self.cmd_root)
+            self.clean()
+
+        critical_path = scheduler.format_critical_path()
+        if critical_path:
+            print('')
+            print(critical_path)
+
+        if self.cache is not None:
+            print(self.cache.format_stats())
+            TRACER.add_counter('cache hits', self.cache.hits, 'cache')
+            TRACER.add_counter('cache misses', self.cache.misses, 'cache')
+            self.cache.evict()
+
+        if self.format_index is not None:
+            TRACER.add_counter('formatted index', {
+                'hits': self.format_index.hits,
+                'misses': self.format_index.misses,
+            }, 'cache')
+            self.format_index.save()
 
-        self.process_results(self.all_results)
-        if self.enforce_checks():
+        # Tool time per file, shards of the next runs can be balanced with it
+        COSTS.save()
+        FORMAT_COSTS.save()
+
+        # Results are stored in a fixed order, whatever the finishing order
+        for tool, files, stage in formatter_tasks:
+            if isinstance(tool, MultiFormatter):
+                # The result of the the multi formatter is special!
+                results = stage.result or {}
+                for key, values in results.items():
+                    self._store_results(key, files, values)
+                self._clear_results(
+                    REGISTRY.names([MULTI_FORMATTER]), files, results)
+            else:
+                # Pyformat might include files in results that are not in
+                # files like when an init is created
+                self._store_results(tool.name, files, stage.result)
+
+        for pipeline, files, stage in stream_tasks:
+            results = stage.result or {}
+            for key, data in results.items():
+                self._store_results(key, data['files'], data['results'])
+            for key, tool_files in self._stream_files.items():
+                self._clear_results([key], tool_files, results)
+
+        for tool, files, stage in linter_tasks:
+            self._store_results(tool.name, files, stage.result)
+
+        for tool, files, stage in tester_tasks:
+            if stage.result:
+                self.test_results = stage.result
+
+        self.path_filter = None
+        if self.writer is None:
+            with TRACER.span('process results', 'report'):
+                self.process_results(self.all_results)
+        else:
+            # Results were written as they were produced
+            self._check_coverage()
+            self.writer.write(
+                summary_record(self._failed_tools(), self.enforce,
+                               self._shard_summary()))
+
+        if self.fail_fast:
+            self.history.record(self._failed_tools(), self.failed_paths)
+            self.history.save()
+
+        if self.enforce_checks(exit_on_failure=exit_on_failure):
             msg = 'Ciocheck successful run'
             print('\n\n' + '=' * len(msg))
             print(msg)
             print('=' * len(msg))
             print('')
 
+    def watch(self, interval=0.5, debounce=0.5):
+        """Run all tools, then check changed files again until interrupted."""
+        # Stages abandoned when stopping early would overlap with next checks
+        self.fail_fast = False
+        watcher = FileWatcher(
+            self.file_manager.paths, interval=interval, debounce=debounce)
+        self.run(exit_on_failure=False)
+        # Files changed by formatters should not trigger a new check
+        watcher.snapshot()
+        try:
+            while True:
+                print('Watching for changes, press Ctrl+C to stop ...')
+                changed = watcher.wait_for_changes()
+                self.run(paths=changed, exit_on_failure=False)
+                watcher.snapshot()
+        except KeyboardInterrupt:
+            pass
+
+    def _store_results(self, name, files, results):
+        """
+        Store results of tool `name`.
+
+        When checking files again, results for those files replace the
+        previous ones and results for other files are kept.
+        """
+        if self.writer is not None:
+            # Results were written as they were produced
+            return
+
+        if self.path_filter is not None and name in self.all_results:
+            previous = self.all_results[name]
+            results = [
+                r for r in previous['results']
+                if r['path'] not in self.path_filter
+            ] + list(results or [])
+            results = sorted(results, key=lambda r: r['path'])
+            files = self._merge_files(previous['files'], files)
+
+        if results or self.path_filter is not None:
+            self.all_results[name] = {
+                'files': files,
+                'results': results or [],
+            }
+
+    def _clear_results(self, names, files, results):
+        """
+        Store no results for the selected tools of `names` not in `results`.
+
+        Tools report nothing for files they did not change, previous results
+        of files checked again must still be replaced.
+        """
+        if self.path_filter is None:
+            return
+
+        for name in names:
+            if name in self.check and name not in results:
+                self._store_results(name, files, [])
+
+    def _merge_files(self, old_files, new_files):
+        """Replace entries of checked paths in `old_files` by `new_files`."""
+        if isinstance(old_files, dict):
+            files = OrderedDict(
+                (p, lines) for (p, lines) in old_files.items()
+                if p not in self.path_filter)
+            files.update(new_files)
+            return make_sorted_dict(files)
+        files = [p for p in old_files if p not in self.path_filter]
+        return list(sorted(files + list(new_files)))
+
+    def _get_tool_files(self, tool, file_mode=None, filtered=True):
+        """
+        Return the files `tool` should process.
+
+        If `filtered` is True, only the files checked again are returned.
+        """
+        files = self.file_manager.get_files(
+            branch=self.branch,
+            diff_mode=self.diff_mode,
+            file_mode=file_mode or self.file_mode,
+            extensions=tool.extensions)
+        if filtered and self.path_filter is not None:
+            files = filter_paths(files, sorted(self.path_filter))
+        return files
+
+    def _run_tool(self, tool, files):
+        """Run `tool` on `files`, used as a scheduler stage."""
+        print('Running "{}" ...'.format(tool.name))
+        with TRACER.span(tool.name, 'stage', files=len(files)):
+            results = self._run_tool_files(tool, files)
+
+        if self.writer is not None:
+            # Do not keep results that were already written
+            return None
+        return results
+
+    def _run_tool_files(self, tool, files):
+        """Run `tool` on `files`, handling results as they are produced."""
+        if isinstance(tool, Linter):
+            if self.fail_fast:
+                return self._run_linter_batches(tool, files)
+            results = run_cached(self.cache, tool, files)
+        elif isinstance(tool, MultiFormatter) and (self.fail_fast or
+                                                   self.writer is not None):
+            return self._run_multi_formatter(tool, files)
+        else:
+            results = tool.run(files)
+
+        self._handle_results(tool.name, tool.name, files, results)
+        return results
+
+    def _fail_fast_batches(self, files):
+        """Split `files` in batches, recently failing files come first."""
+        paths = self.history.sort_paths(list(files))
+        recent = [p for p in paths if self.history.file_priority(p)]
+        batches = [recent] if recent else []
+        paths = paths[len(recent):]
+        batches += [
+            paths[i:i + FAIL_FAST_BATCH_SIZE]
+            for i in range(0, len(paths), FAIL_FAST_BATCH_SIZE)
+        ]
+        return [filter_paths(files, batch) for batch in batches]
+
+    def _run_linter_batches(self, tool, files):
+        """
+        Run linter `tool` on batches of `files` until a failure.
+
+        Results written in jsonl output format are not kept.
+        """
+        results = []
+        for batch in self._fail_fast_batches(files):
+            if self.stopped_by is not None:
+                break
+
+            # Linters keep per run state, use a fresh instance per batch
+            linter = type(tool)(tool.cmd_root)
+            batch_results = run_cached(self.cache, linter, batch)
+            if self.writer is None:
+                results += batch_results
+            self._handle_results(tool.name, tool.name, files, batch_results)
+        return sorted(results, key=lambda r: r['path'])
+
+    def _run_multi_formatter(self, tool, files):
+        """
+        Run multi formatter `tool` on `files`, handling each batch.
+
+        Results written in jsonl output format are not kept.
+        """
+        results = []
+        paths = self.history.sort_paths(list(files))
+        if isinstance(files, dict):
+            # Keep the changed lines, only those are formatted
+            paths = OrderedDict((path, files[path]) for path in paths)
+        for batch, batch_results in tool.iter_run(paths):
+            if self.writer is None:
+                results += batch_results
+            for item in batch_results:
+                for name, result in item.items():
+                    self._handle_results(tool.name, name, files, [result])
+
+            if self.stopped_by is not None:
+                break
+        return tool.format_results(results)
+
+    def _handle_results(self, stage_name, tool_name, files, results):
+        """Write results in jsonl output format and check for failures."""
+        if self.writer is not None:
+            self._write_results(tool_name, files, results)
+        self._check_fail_fast(stage_name, tool_name, files, results)
+
+    def _write_results(self, tool_name, files, results):
+        """Write the records of relevant `results` of `tool_name`."""
+        for result in results or []:
+            path = result['path']
+            added_lines = self._line_filter(files, path)
+            records = result_records(tool_name,
+                                     os.path.relpath(path, self.cmd_root),
+                                     result, added_lines)
+            if records:
+                self.failed_checks.add(tool_name)
+                self.failed_paths.add(path)
+            for record in records:
+                self.writer.write(record)
+
+    def _write_test_results(self, tool_name, results):
+        """Write the test summary and coverage records of a tester."""
+        if 'pytest' in results:
+            summary = results['pytest']['report']['summary']
+            self.writer.write(tests_record(tool_name, summary))
+
+        test_files = results.get('files')
+        test_coverage = results.get('coverage')
+        if isinstance(test_files, dict) and test_coverage:
+            for path in sorted(test_files):
+                lines, coverage = self._uncovered_lines(
+                    test_files, test_coverage, path)
+                if lines:
+                    changed = test_files[path][-1] if test_files[path] else []
+                    self.writer.write(
+                        coverage_record(
+                            os.path.relpath(path, self.cmd_root), lines,
+                            coverage, len(changed)))
+
+    def _check_fail_fast(self, stage_name, tool_name, files, results):
+        """Stop the run if enforced `tool_name` reported a relevant result."""
+        if not self.fail_fast or tool_name not in self.enforce:
+            return
+
+        for result in results or []:
+            added_lines = self._line_filter(files, result['path'])
+            if self._result_messages(result, added_lines):
+                self._stop(stage_name, tool_name)
+                return
+
+    def _stop(self, stage_name, tool_name):
+        """Stop starting tools and kill running subprocesses."""
+        with self._stop_lock:
+            if self.stopped_by is not None:
+                return
+            self.stopped_by = tool_name
+
+        print('Failure in "{0}", stopping ...'.format(tool_name))
+        if self._pipeline is not None:
+            self._pipeline.stop()
+
+        # Cancel first, so errors of stages whose processes are killed are
+        # not raised
+        self._scheduler.cancel(after=stage_name)
+        kill_processes()
+
+    def _run_tester(self, tool):
+        """Run tester `tool`, used as a scheduler stage."""
+        print('Running "{}" ...'.format(tool.name))
+        # Files are looked up when the stage starts, so that files created by
+        # formatters (like __init__.py files) are included. Tests of other
+        # files may cover the files checked again, all of them run.
+        files = self._get_tool_files(tool, file_mode=ALL_FILES, filtered=False)
+        with TRACER.span(tool.name, 'tester', files=len(files)):
+            results = tool.run(files)
+        if results:
+            results['files'] = files
+            if self.writer is not None:
+                self._write_test_results(tool.name, results)
+            if (self.fail_fast and tool.name in self.enforce and
+                    self._tests_failed(results)):
+                self._stop(tool.name, tool.name)
+        return results
+
+    def _create_formatters(self, formatters, run_multi):
+        """
+        Create formatters and their config files.
+
+        Return a list of `(tool, files)` for regular formatters and a
+        `(tool, files)` tuple for the multi formatter (or None).
+        """
+        tasks = []
+        for formatter in formatters:
+            tool = formatter(self.cmd_root)
+            tool.create_config(self.config)
+            self.all_tools[tool.name] = tool
+
+            # Multi formatters only do work through the multi formatter, they
+            # only need their config files in place.
+            if REGISTRY.get(formatter.name).kind != MULTI_FORMATTER:
+                tasks.append((tool, self._get_tool_files(tool)))
+
+        multi_task = None
+        if run_multi:
+            tool = MultiFormatter(
+                self.cmd_root,
+                self.check,
+                in_process=self.in_process,
+                cache=self.cache,
+                index=self.format_index,
+                worker_tasks=self.config.get_value('worker_tasks'),
+                worker_memory=self.config.get_value('worker_memory'),
+                format_timeout=self.config.get_value('format_timeout'),
+                format_memory=self.config.get_value('format_memory'),
+                pools=self.formatter_pools)
+            multi_task = (tool, self._get_tool_files(tool))
+
+        return tasks, multi_task
+
+    def _create_linters(self, linters):
+        """Create linters and their config files, return `(tool, files)`."""
+        tasks = []
+        for linter in linters:
+            tool = linter(self.cmd_root)
+            files = self._get_tool_files(tool)
+            self.all_tools[tool.name] = tool
+            # Config files are written before any stage starts, some linters
+            # share the same config file.
+            tool.create_config(self.config)
+            tasks.append((tool, files))
+        return tasks
+
+    def add_formatter_stages(self, scheduler, formatters, run_multi):
+        """Add formatter stages, chained as they modify the same files."""
+        formatter_tasks, multi_task = self._create_formatters(
+            formatters, run_multi)
+        if multi_task:
+            formatter_tasks.append(multi_task)
+
+        tasks = []
+        depends = []
+        for tool, files in formatter_tasks:
+            stage = scheduler.add_stage(
+                tool.name, partial(self._run_tool, tool, files), depends)
+            depends = [stage.name]
+            tasks.append((tool, files, stage))
+        return tasks
+
+    def add_linter_stages(self, scheduler, linters, depends=()):
+        """Add one independent stage per linter, recently failing first."""
+        tasks = []
+        for tool, files in self._create_linters(linters):
+            stage = scheduler.add_stage(
+                tool.name,
+                partial(self._run_tool, tool, files),
+                depends,
+                priority=self.history.tool_priority(tool.name))
+            tasks.append((tool, files, stage))
+        return tasks
+
+    def add_stream_stage(self, scheduler, formatters, run_multi, linters):
+        """Add a single stage formatting and linting files as they are ready.
+
+        Return a list with one `(pipeline, files, stage)` tuple where files
+        are all the files formatters will process.
+        """
+        formatter_tasks, multi_task = self._create_formatters(
+            formatters, run_multi)
+        linter_tasks = self._create_linters(linters)
+        pipeline = StreamPipeline(
+            formatter_tasks,
+            multi_task,
+            linter_tasks,
+            jobs=self.jobs,
+            callback=self._stream_results,
+            cache=self.cache,
+            keep_results=self.writer is None)
+        self._pipeline = pipeline
+
+        files = []
+        self._stream_files = {}
+        for tool, tool_files in formatter_tasks + linter_tasks:
+            self._stream_files[tool.name] = tool_files
+        for tool, tool_files in formatter_tasks:
+            files += list(tool_files)
+        if multi_task:
+            files += list(multi_task[1])
+            for name in REGISTRY.names([MULTI_FORMATTER]):
+                self._stream_files[name] = multi_task[1]
+
+        def run_pipeline():
+            """Run the pipeline, used as a scheduler stage."""
+            with TRACER.span('stream', 'stage', files=len(files)):
+                return pipeline.run()
+
+        stage = scheduler.add_stage('stream', run_pipeline)
+        return [(pipeline, files, stage)]
+
+    def _stream_results(self, tool_name, results):
+        """Handle results of the streaming pipeline as they arrive."""
+        self._print_stream_results(tool_name, results)
+        self._handle_results('stream', tool_name,
+                             self._stream_files[tool_name], results)
+
+    def _print_stream_results(self, tool_name, results):
+        """Print how many results a tool found per file as they arrive."""
+        counts = OrderedDict()
+        for result in results:
+            path = result['path']
+            counts[path] = counts.get(path, 0) + 1
+
+        for path, count in counts.items():
+            print('  {0}: {1} ({2})'.format(
+                tool_name, path.replace(self.cmd_root, '...'), count))
+
+    def add_tester_stages(self, scheduler, testers, formatter_tasks=()):
+        """
+        Add one stage per tester.
+
+        Testers only wait for the stages of `formatter_tasks` changing the
+        files they test, a list of `(tool, files, stage)`.
+        """
+        tasks = []
+        for tester in testers:
+            tool = tester(self.cmd_root)
+            tool.create_config(self.config)
+            self.all_tools[tool.name] = tool
+
+            if tool.name == 'pytest':
+                tool.setup_pytest_coverage_args(self.folders)
+                if self.fail_fast:
+                    tool.pytest_args.append('--exitfirst')
+
+            test_files = set(
+                self._get_tool_files(
+                    tool, file_mode=ALL_FILES, filtered=False))
+            depends = [
+                stage.name for (_, files, stage) in formatter_tasks
+                if test_files.intersection(files)
+            ]
+            stage = scheduler.add_stage(
+                tool.name,
+                partial(self._run_tester, tool),
+                depends,
+                priority=self.history.tool_priority(tool.name))
+            tasks.append((tool, None, stage))
+        return tasks
+
+    @staticmethod
+    def _index_results(results):
+        """Return an ordered dict of path: results, in output order."""
+        results_by_path = OrderedDict()
+        for result in results:
+            path = result['path']
+            if path not in results_by_path:
+                results_by_path[path] = []
+            results_by_path[path].append(result)
+        return results_by_path
+
+    def _line_filter(self, files, path):
+        """
+        Return a container of the relevant lines of `path`.
+
+        Lists are turned into sets once per (files, path) pair so that lookups
+        are constant time. Ranges are kept as they are since membership tests
+        on them are already constant time.
+        """
+        cache_key = (id(files), path)
+        if cache_key not in self._line_filters:
+            if isinstance(files, dict):
+                lines = files.get(path, ALL_LINES)[-1]
+            else:
+                lines = ALL_LINES[-1]
+
+            if isinstance(lines, (list, tuple)):
+                lines = frozenset(lines)
+            self._line_filters[cache_key] = lines
+        return self._line_filters[cache_key]
+
+    def _result_messages(self, result, added_lines):
+        """Return the report messages for a single tool result."""
+        messages = []
+
+        # LINTERS
+        line = int(result.get('line', -1))
+        if line and line in added_lines:
+            spaces = (8 - len(str(line))) * ' '
+            args = result.copy()
+            args['spaces'] = spaces
+            msg = ('    {line}:{spaces}'
+                   '{type}: {message}').format(**args)
+            messages.append(msg)
+
+        # Formatters
+        if result.get('created'):
+            messages.append('    __init__ file created.')
+        if result.get('added-copy'):
+            messages.append('    added copyright.')
+        if result.get('added-header'):
+            messages.append('    added header.')
+        diff = result.get('diff')
+        if diff:
+            messages.append(self.format_diff(diff))
+        if result.get('skipped'):
+            messages.append('    skipped, {0}.'.format(result['skipped']))
+
+        return messages
+
     def process_results(self, all_results):
         """Group all results by file path."""
-        all_changed_paths = []
+        # Index results by tool and path once, so rendering is linear on the
+        # number of results
+        indexed_results = OrderedDict()
+        all_changed_paths = set()
         for tool_name, data in all_results.items():
             if data:
-                files, results = data['files'], data['results']
-                all_changed_paths += [result['path'] for result in results]
+                results_by_path = self._index_results(data['results'])
+                indexed_results[tool_name] = (data['files'], results_by_path)
+                all_changed_paths.update(results_by_path)
 
-        all_changed_paths = list(sorted(set(all_changed_paths)))
+        all_changed_paths = list(sorted(all_changed_paths))
 
         if self.test_results:
             test_files = self.test_results.get('files')
@@ -173,95 +808,96 @@ class Runner(object):
             print('')
             print(short_path)
             print('-' * len(short_path))
-            for tool_name, data in all_results.items():
-                if data:
-                    files, results = data['files'], data['results']
-                    lines = [[-1], range(100000)]
-
-                    if isinstance(files, dict):
-                        added_lines = files.get(path, lines)[-1]
-                    else:
-                        added_lines = lines[-1]
-
-                    messages = []
-                    for result in results:
-                        res_path = result['path']
-                        if path == res_path:
-                            # LINTERS
-                            line = int(result.get('line', -1))
-                            created = result.get('created')
-                            added_copy = result.get('added-copy')
-                            added_header = result.get('added-header')
-                            diff = result.get('diff')
-                            if line and line in list(added_lines):
-                                spaces = (8 - len(str(line))) * ' '
-                                args = result.copy()
-                                args['spaces'] = spaces
-                                msg = ('    {line}:{spaces}'
-                                       '{type}: {message}').format(**args)
-                                messages.append(msg)
-
-                            # Formatters
-                            if created:
-                                msg = '    __init__ file created.'
-                                messages.append(msg)
-                            if added_copy:
-                                msg = '    added copyright.'
-                                messages.append(msg)
-                            if added_header:
-                                msg = '    added header.'
-                                messages.append(msg)
-                            if diff:
-                                msg = self.format_diff(diff)
-                                messages.append(msg)
-
-                            # TESTERS / COVERAGE
-
-                    test = [r['path'] for r in results if path == r['path']]
-                    if test and messages:
-                        print('\n  ' + tool_name)
-                        print('  ' + '-' * len(tool_name))
-                        self.failed_checks.add(tool_name)
-                        for message in messages:
-                            print(message)
+            for tool_name, (files, results_by_path) in indexed_results.items():
+                results = results_by_path.get(path)
+                if not results:
+                    continue
+
+                added_lines = self._line_filter(files, path)
+                messages = []
+                for result in results:
+                    messages += self._result_messages(result, added_lines)
+
+                if messages:
+                    print('\n  ' + tool_name)
+                    print('  ' + '-' * len(tool_name))
+                    self.failed_checks.add(tool_name)
+                    self.failed_paths.add(path)
+                    for message in messages:
+                        print(message)
 
             if isinstance(test_files, dict) and test_files:
                 # Asked for lines changed
                 if test_coverage:
-                    lines_changed_not_covered = []
-                    lines = test_files.get(path)
-                    lines_added = lines[-1] if lines else []
-                    lines_covered = test_coverage.get(path)
-                    for line in lines_added:
-                        if line not in lines_covered:
-                            lines_changed_not_covered.append(str(line))
-
+                    lines_changed_not_covered, cov_perc = (
+                        self._uncovered_lines(test_files, test_coverage, path))
                     if lines_changed_not_covered:
-                        uncov_perc = ((1.0 * len(lines_changed_not_covered)) /
-                                      (1.0 * len(lines_added)))
-                        cov_perc = (1 - uncov_perc) * 100
                         tool_name = 'coverage'
                         print('\n  ' + tool_name)
                         print('  ' + '-' * len(tool_name))
                         print('    The following lines changed and are not '
                               'covered by tests ({0}%):'.format(cov_perc))
-                        print('    ' + ', '.join(lines_changed_not_covered))
+                        print('    ' + ', '.join(
+                            str(line) for line in lines_changed_not_covered))
 
         print('')
+        self._check_coverage()
+
+    @staticmethod
+    def _uncovered_lines(test_files, test_coverage, path):
+        """Return the changed lines of `path` not covered, and the coverage."""
+        lines_changed_not_covered = []
+        lines = test_files.get(path)
+        lines_added = lines[-1] if lines else []
+        lines_covered = set(test_coverage.get(path) or [])
+        for line in lines_added:
+            if line not in lines_covered:
+                lines_changed_not_covered.append(line)
+
+        cov_perc = None
+        if lines_changed_not_covered:
+            uncov_perc = ((1.0 * len(lines_changed_not_covered)) /
+                          (1.0 * len(lines_added)))
+            cov_perc = (1 - uncov_perc) * 100
+        return lines_changed_not_covered, cov_perc
+
+    def _check_coverage(self):
+        """Add coverage to the failed checks if coverage was too low."""
         pytest_tool = self.all_tools.get('pytest')
         if pytest_tool:
             if pytest_tool.coverage_fail:
                 self.failed_checks.add('coverage')
 
-    def enforce_checks(self):
+    def _shard_summary(self):
+        """Return the shard, its files and the file count of all shards."""
+        if self.shard is None:
+            return None
+
+        paths, all_paths = self.file_manager.get_shard(
+            self.branch, self.diff_mode, self.file_mode)
+        files = [os.path.relpath(path, self.cmd_root) for path in paths]
+        index, count = self.shard
+        return index, count, files, len(all_paths)
+
+    def _failed_tools(self):
+        """Return the failed tools, including failed tests."""
+        failed_tools = set(self.failed_checks)
+        if self.test_results and self._tests_failed(self.test_results):
+            failed_tools.add('pytest')
+        return failed_tools
+
+    @staticmethod
+    def _tests_failed(test_results):
+        """Return True if the tester `test_results` contain failures."""
+        if 'pytest' in test_results:
+            test_summary = test_results['pytest']['report']['summary']
+            return bool(test_summary.get('failed'))
+        return True
+
+    def enforce_checks(self, exit_on_failure=True):
         """Check that enforced checks did not generate reports."""
-        if self.test_results:
-            if 'pytest' in self.test_results:
-                test_summary = self.test_results['pytest']['report']['summary']
-                if test_summary.get('failed'):
-                    self.failed_checks.add('pytest')
-            else:
-                self.failed_checks.add('pytest')
+        if self.test_results and self._tests_failed(self.test_results):
+            self.failed_checks.add('pytest')
 
         for enforce_tool in self.enforce:
             if enforce_tool in self.failed_checks:
@@ -271,8 +907,9 @@ class Runner(object):
                 print(msg)
                 print('=' * len(msg))
                 print('')
-                sys.exit(1)
-                break
+                if exit_on_failure:
+                    sys.exit(1)
+                return False
 
         return True
 
@@ -295,10 +932,11 @@ class Runner(object):
                 pass
 
 
-def main():
-    """CLI `Parser for ciocheck`."""
+def create_parser():
+    """Create the CLI parser for ciocheck."""
     description = 'Run Continuum IO test suite.'
     parser = argparse.ArgumentParser(description=description)
+    tools = REGISTRY.choices()
     parser.add_argument(
         'folders', help='Folders to analyze. Use from repo root.', nargs='+')
     parser.add_argument(
@@ -347,25 +985,91 @@ def main():
         '-c',
         dest='check',
         nargs='+',
-        choices=[
-            'pep8', 'pydocstyle', 'flake8', 'pylint', 'pyformat', 'isort',
-            'yapf', 'autopep8', 'coverage', 'pytest'
-        ],
+        choices=tools,
         default=None,
         help='Select tools to run. Default is "pep8"')
     parser.add_argument(
         '--enforce',
         '-e',
         dest='enforce',
-        choices=[
-            'pep8', 'pydocstyle', 'flake8', 'pylint', 'pyformat', 'isort',
-            'yapf', 'autopep8', 'coverage', 'pytest'
-        ],
+        choices=tools,
         default=None,
         nargs='+',
         help=('Select tools to enforce. Enforced tools will '
               'fail if a result is obtained. Default is '
               'none.'))
+    parser.add_argument(
+        '--watch',
+        '-w',
+        dest='watch',
+        action='store_true',
+        default=False,
+        help=('Keep running and check files again as they change'))
+    parser.add_argument(
+        '--stream',
+        '-s',
+        dest='stream',
+        action='store_true',
+        default=False,
+        help=('Lint each file as soon as it is formatted instead of waiting '
+              'for all formatters to finish'))
+    parser.add_argument(
+        '--fail-fast',
+        '-ff',
+        dest='fail_fast',
+        action='store_true',
+        default=False,
+        help=('Stop at the first result of an enforced tool, checking tools '
+              'and files that failed recently first'))
+    parser.add_argument(
+        '--cache',
+        dest='cache',
+        action='store_true',
+        default=False,
+        help=('Reuse results of previous runs for files that did not '
+              'change'))
+    parser.add_argument(
+        '--cache-dir',
+        dest='cache_dir',
+        default=None,
+        help=('Folder where cached results are stored. Default is '
+              '".ciocheck_cache"'))
+    parser.add_argument(
+        '--jobs',
+        '-j',
+        dest='jobs',
+        type=int,
+        default=None,
+        help=('Maximum number of tools to run at the same time. Default is '
+              'the number of cpus.'))
+    parser.add_argument(
+        '--format',
+        dest='output_format',
+        choices=[TEXT_OUTPUT, JSONL_OUTPUT],
+        default=None,
+        help=('Output format. "jsonl" writes one json record per result to '
+              'stdout as soon as it is produced, other output goes to '
+              'stderr. Default is "text".'))
+    parser.add_argument(
+        '--shard',
+        dest='shard',
+        default=None,
+        help=('Only check the files of shard I out of N, given as I/N with I '
+              'starting at 1. Files are split by their size, or by the costs '
+              'of --shard-costs.'))
+    parser.add_argument(
+        '--shard-costs',
+        dest='shard_costs',
+        default=None,
+        help=('Split shards by the time tools spent on files, read from this '
+              'file recorded by a previous run without --shard. All shards '
+              'must use the same file, shard runs do not change it.'))
+    parser.add_argument(
+        '--trace',
+        dest='trace',
+        default=None,
+        help=('Write a timing trace of the run to this file, in the Chrome '
+              'trace event format.'))
     parser.add_argument(
         '--config',
         '-cf',
@@ -373,20 +1077,64 @@ def main():
         default=None,
         help=('Select a config file to use. Default is none.'))
 
-    cli_args = parser.parse_args()
-    root = os.getcwd()
+    return parser
+
+
+def get_paths(folders_or_files, root):
+    """Split paths relative to `root` into existing folders and files."""
     folders = []
     files = []
-    for folder_or_file in cli_args.folders:
-        folder_or_file = os.path.abspath(folder_or_file)
+    for folder_or_file in folders_or_files:
+        folder_or_file = os.path.abspath(os.path.join(root, folder_or_file))
         if os.path.isfile(folder_or_file):
             files.append(folder_or_file)
         elif os.path.isdir(folder_or_file):
             folders.append(folder_or_file)
+    return folders, files
+
+
+def run_checks(root, cli_args, folders, files, **kwargs):
+    """
+    Run the checks of `cli_args` on `folders` and `files` of `root`.
+
+    A trace of the run is written if asked. Keyword arguments are passed to
+    the Runner.
+    """
+    if cli_args.trace:
+        TRACER.enable()
+
+    # Only records are written to stdout in jsonl output format
+    stream = sys.stdout
+    try:
+        test = Runner(root, cli_args, folders=folders, files=files, **kwargs)
+        if test.output_format == JSONL_OUTPUT:
+            stream = sys.stderr
+        if cli_args.watch:
+            test.watch()
+        else:
+            test.run()
+    finally:
+        if cli_args.trace:
+            TRACER.save(os.path.join(root, cli_args.trace))
+            TRACER.disable()
+            stream.write('Trace written to "{0}"\n'.format(cli_args.trace))
+
+
+def main():
+    """CLI `Parser for ciocheck`."""
+    parser = create_parser()
+    cli_args = parser.parse_args()
+    if cli_args.shard:
+        try:
+            parse_shard(cli_args.shard)
+        except ValueError as error:
+            parser.error(str(error))
+
+    root = os.getcwd()
+    folders, files = get_paths(cli_args.folders, root)
 
     if folders or files:
-        test = Runner(root, cli_args, folders=folders, files=files)
-        test.run()
+        run_checks(root, cli_args, folders, files)
     elif not folders and not files:
         print('Invalid folders or files!')
 
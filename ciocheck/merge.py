@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""
+Merge the results of ciocheck shards into a single report and verdict.
+
+Shards are run with `--shard I/N --format jsonl` and their standard output
+saved to a file. Result files are read one record at a time, so memory does
+not grow with the number of findings. The summary record of each shard lists
+the files it checked, the merged run fails unless every shard is given once
+and every file was checked by a single shard.
+"""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+from collections import OrderedDict
+import argparse
+import json
+import os
+import sys
+
+# Local imports
+from ciocheck.config import JSONL_OUTPUT, TEXT_OUTPUT
+from ciocheck.output import JsonLinesWriter, TextWriter
+from ciocheck.utils import read_coverage, write_coverage
+
+
+def iter_records(path):
+    """Yield the records of the json lines file `path`, one at a time."""
+    with open(path, 'r') as file_obj:
+        for number, line in enumerate(file_obj, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                raise ValueError('{0}:{1}: invalid json record'.format(
+                    path, number))
+
+
+def merge_coverage(paths):
+    """Return the union of the covered lines of coverage data `paths`."""
+    covered_lines = {}
+    for path in paths:
+        for file_path, lines in read_coverage(path).items():
+            covered_lines.setdefault(file_path, set()).update(lines)
+
+    return OrderedDict((file_path, list(sorted(covered_lines[file_path])))
+                       for file_path in sorted(covered_lines))
+
+
+class CoverageIndex(object):
+    """Find covered lines of relative paths in merged coverage data."""
+
+    def __init__(self, covered_lines):
+        """Find covered lines of relative paths in merged coverage data.
+
+        Coverage data stores absolute paths, which differ between machines,
+        while records store paths relative to the checkout. Paths are matched
+        on their trailing components.
+        """
+        self._by_name = {}
+        for path, lines in covered_lines.items():
+            name = os.path.basename(path)
+            self._by_name.setdefault(name, []).append((path, set(lines)))
+
+    def covered(self, relative_path):
+        """Return the set of covered lines of `relative_path`."""
+        suffix = os.sep + os.path.normpath(relative_path)
+        covered = set()
+        for path, lines in self._by_name.get(
+                os.path.basename(relative_path), []):
+            if path.endswith(suffix) or path == relative_path:
+                covered.update(lines)
+        return covered
+
+
+class ShardMerger(object):
+    """Write the records of shard result files and merge their verdicts."""
+
+    def __init__(self, writer, coverage=None):
+        """Write the records of shard result files and merge their verdicts.
+
+        Parameters
+        ----------
+        writer : JsonLinesWriter or TextWriter
+            Where merged records are written.
+        coverage : CoverageIndex
+            Merged coverage, coverage records are checked again against it
+            since tests of other shards may cover the lines. The coverage
+            verdict of shards is kept, it compares the total coverage of the
+            shard with the required one.
+        """
+        self.writer = writer
+        self.coverage = coverage
+        self.failed = set()
+        self.enforced = set()
+        self.tests = OrderedDict()
+        self.shards = 0
+        self.incomplete = []
+        self.errors = []
+        # Shard index: result file, and the shard count and files of all
+        # shards given by shard summaries
+        self._shard_paths = {}
+        self._counts = set()
+        self._total_files = set()
+        self._files = set()
+
+    def _merge_coverage(self, record):
+        """Return `record` without lines covered by any shard, or None."""
+        covered = self.coverage.covered(record['path'])
+        lines = [line for line in record['lines'] if line not in covered]
+        if not lines:
+            return None
+
+        record = dict(record, lines=lines)
+        changed = record.get('changed')
+        if changed:
+            record['coverage'] = (1 - (1.0 * len(lines)) / changed) * 100
+        return record
+
+    def add_file(self, path):
+        """Write the records of the result file `path`."""
+        complete = False
+        for record in iter_records(path):
+            kind = record.get('kind')
+            if kind == 'summary':
+                self.failed.update(record['failed'])
+                self.enforced.update(record['enforced'])
+                self._add_shard(path, record.get('shard'))
+                complete = True
+                continue
+
+            if kind == 'coverage' and self.coverage is not None:
+                record = self._merge_coverage(record)
+                if record is None:
+                    continue
+            elif kind == 'tests':
+                for key, value in record['summary'].items():
+                    if isinstance(value, (int, float)):
+                        self.tests[key] = self.tests.get(key, 0) + value
+
+            self.writer.write(record)
+
+        self.shards += 1
+        if not complete:
+            # The shard did not finish, its verdict is unknown
+            self.incomplete.append(path)
+
+    def _add_shard(self, path, shard):
+        """Check the `shard` of the summary of result file `path`."""
+        if not shard:
+            self.errors.append('{0}: no shard in summary'.format(path))
+            return
+
+        index = shard['index']
+        if index in self._shard_paths:
+            self.errors.append('{0}: shard {1} already given by {2}'.format(
+                path, index, self._shard_paths[index]))
+            return
+
+        self._shard_paths[index] = path
+        self._counts.add(shard['count'])
+        self._total_files.add(shard['total_files'])
+        files = set(shard['files'])
+        checked = files & self._files
+        if checked:
+            self.errors.append('{0}: {1} files checked by other shards, '
+                               'like {2}'.format(path, len(checked),
+                                                 min(checked)))
+        self._files.update(files)
+
+    def _check_shards(self):
+        """Return the errors of shards that are missing or disagree."""
+        if not self._shard_paths:
+            return []
+
+        errors = []
+        if len(self._counts) > 1:
+            errors.append('Shards have different shard counts: {0}'.format(
+                ', '.join(str(c) for c in sorted(self._counts))))
+            return errors
+
+        count, = self._counts
+        missing = [i for i in range(1, count + 1)
+                   if i not in self._shard_paths]
+        if missing:
+            errors.append('Missing shards: {0}'.format(', '.join(
+                '{0}/{1}'.format(i, count) for i in missing)))
+        elif len(self._total_files) > 1:
+            errors.append('Shards split different files, found {0} '
+                          'files'.format(' or '.join(
+                              str(n) for n in sorted(self._total_files))))
+        else:
+            total_files, = self._total_files
+            if len(self._files) != total_files:
+                errors.append('Shards checked {0} files out of {1}'.format(
+                    len(self._files), total_files))
+        return errors
+
+    def summary(self):
+        """Return the merged summary record."""
+        enforced = list(sorted(self.enforced))
+        errors = self.errors + self._check_shards()
+        return {
+            'kind': 'summary',
+            'failed': list(sorted(self.failed)),
+            'enforced': enforced,
+            'success': not enforced and not self.incomplete and not errors,
+            'shards': self.shards,
+            'incomplete': self.incomplete,
+            'errors': errors,
+            'tests': self.tests,
+        }
+
+
+def main():
+    """CLI parser for merging ciocheck shard results."""
+    description = 'Merge the json lines results of ciocheck shards.'
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        'results',
+        nargs='+',
+        help='Result files written by ciocheck --format jsonl')
+    parser.add_argument(
+        '--coverage',
+        dest='coverage',
+        nargs='+',
+        default=[],
+        help=('Coverage data files of the shards. Lines covered by any shard '
+              'are not reported.'))
+    parser.add_argument(
+        '--coverage-output',
+        dest='coverage_output',
+        default=None,
+        help='Write the merged coverage data to this file.')
+    parser.add_argument(
+        '--format',
+        dest='output_format',
+        choices=[TEXT_OUTPUT, JSONL_OUTPUT],
+        default=TEXT_OUTPUT,
+        help='Output format. Default is "text".')
+    cli_args = parser.parse_args()
+
+    coverage = None
+    if cli_args.coverage:
+        covered_lines = merge_coverage(cli_args.coverage)
+        if cli_args.coverage_output:
+            write_coverage(cli_args.coverage_output, covered_lines)
+        coverage = CoverageIndex(covered_lines)
+
+    if cli_args.output_format == JSONL_OUTPUT:
+        writer = JsonLinesWriter(sys.stdout)
+    else:
+        writer = TextWriter(sys.stdout)
+
+    merger = ShardMerger(writer, coverage=coverage)
+    for path in cli_args.results:
+        merger.add_file(path)
+
+    summary = merger.summary()
+    if cli_args.output_format == JSONL_OUTPUT:
+        writer.write(summary)
+    else:
+        if merger.incomplete:
+            print('\nIncomplete results in: {0}'.format(
+                ', '.join(merger.incomplete)))
+        for error in summary['errors']:
+            print('\n' + error)
+        if summary['success']:
+            msg = 'Ciocheck successful run'
+        else:
+            msg = 'Ciocheck failures in: {0}'.format(
+                repr(set(summary['failed'])))
+        print('\n\n' + '=' * len(msg))
+        print(msg)
+        print('=' * len(msg))
+        print('')
+
+    sys.exit(0 if summary['success'] else 1)
+
+
+if __name__ == '__main__':
+    main()
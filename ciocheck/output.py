@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""
+JSON Lines output of results.
+
+Every line written is a json object with a `kind` key:
+
+- finding: a linter result on a relevant line.
+- format: a file changed by a formatter, with the diff.
+- skipped: a file not formatted, over the time or memory limits.
+- coverage: changed lines not covered by tests.
+- tests: the summary of a test run.
+- summary: the failed tools, always the last record.
+"""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+import json
+import threading
+
+
+class JsonLinesWriter(object):
+    """Write one json record per line, safe to use from many threads."""
+
+    def __init__(self, stream):
+        """Write one json record per line, safe to use from many threads."""
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        """Write `record` and flush, so consumers get it right away."""
+        line = json.dumps(record, sort_keys=True)
+        with self._lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+
+class TextWriter(object):
+    """Write records in the layout of the text report."""
+
+    def __init__(self, stream):
+        """Write records in the layout of the text report."""
+        self.stream = stream
+        self._path = None
+        self._tool = None
+        self._lock = threading.Lock()
+
+    def _lines(self, record):
+        """Return the report lines of a result record."""
+        kind = record['kind']
+        lines = []
+        if kind == 'finding':
+            line = str(record['line'])
+            spaces = (8 - len(line)) * ' '
+            lines.append('    {0}:{1}{2}: {3}'.format(
+                line, spaces, record['type'], record['message']))
+        elif kind == 'format':
+            if record['created']:
+                lines.append('    __init__ file created.')
+            if record['added_copyright']:
+                lines.append('    added copyright.')
+            if record['added_header']:
+                lines.append('    added header.')
+            if record['diff']:
+                lines += ['    ' + line for line in record['diff'].split('\n')]
+        elif kind == 'skipped':
+            lines.append('    skipped, {0}.'.format(record['reason']))
+        elif kind == 'coverage':
+            lines.append('    The following lines changed and are not covered '
+                         'by tests ({0}%):'.format(record['coverage']))
+            lines.append('    ' + ', '.join(str(n) for n in record['lines']))
+        return lines
+
+    def write(self, record):
+        """Write `record`, grouping consecutive records by path and tool."""
+        output = []
+        with self._lock:
+            if record['kind'] == 'tests':
+                summary = ', '.join(
+                    '{0} {1}'.format(key, value)
+                    for (key, value) in sorted(record['summary'].items()))
+                output.append('')
+                output.append('{0}: {1}'.format(record['tool'], summary))
+                self._path = None
+            elif record['kind'] != 'summary':
+                path = record['path']
+                if path != self._path:
+                    output += ['', path, '-' * len(path)]
+                    self._path = path
+                    self._tool = None
+
+                tool_name = record['tool']
+                if tool_name != self._tool:
+                    output += ['', '  ' + tool_name,
+                               '  ' + '-' * len(tool_name)]
+                    self._tool = tool_name
+                output += self._lines(record)
+
+            for line in output:
+                self.stream.write(line + '\n')
+            self.stream.flush()
+
+
+def result_records(tool_name, path, result, added_lines):
+    """
+    Return the records for a single tool result.
+
+    Only results on `added_lines` are reported for linters, like in the text
+    report.
+    """
+    records = []
+    line = int(result.get('line', -1))
+    if line and line in added_lines:
+        column = result.get('column')
+        records.append({
+            'kind': 'finding',
+            'tool': tool_name,
+            'path': path,
+            'line': line,
+            'column': int(column) if column is not None else None,
+            'type': result.get('type'),
+            'message': result.get('message'),
+        })
+
+    created = bool(result.get('created'))
+    added_copyright = bool(result.get('added-copy'))
+    added_header = bool(result.get('added-header'))
+    if result.get('skipped'):
+        records.append({
+            'kind': 'skipped',
+            'tool': tool_name,
+            'path': path,
+            'reason': result['skipped'],
+        })
+
+    diff = result.get('diff')
+    if created or added_copyright or added_header or diff:
+        records.append({
+            'kind': 'format',
+            'tool': tool_name,
+            'path': path,
+            'diff': diff or '',
+            'created': created,
+            'added_copyright': added_copyright,
+            'added_header': added_header,
+        })
+    return records
+
+
+def coverage_record(path, lines, coverage, changed):
+    """
+    Return the record for `lines` of `path` not covered by tests.
+
+    `changed` is the number of changed lines of `path` and `coverage` the
+    percentage of them that is covered.
+    """
+    return {
+        'kind': 'coverage',
+        'tool': 'coverage',
+        'path': path,
+        'lines': lines,
+        'coverage': coverage,
+        'changed': changed,
+    }
+
+
+def tests_record(tool_name, summary):
+    """Return the record for the `summary` of a test run."""
+    return {'kind': 'tests', 'tool': tool_name, 'summary': summary}
+
+
+def summary_record(failed, enforce, shard=None):
+    """
+    Return the final record, with failed and enforced failed tools.
+
+    For sharded runs, `shard` is a `(index, count, files, total_files)`
+    tuple with the files checked by the shard and the number of files of all
+    shards, so merging can verify every file was checked once.
+    """
+    failed = list(sorted(failed))
+    enforced = [name for name in failed if name in enforce]
+    record = {
+        'kind': 'summary',
+        'failed': failed,
+        'enforced': enforced,
+        'success': not enforced,
+    }
+    if shard is not None:
+        index, count, files, total_files = shard
+        record['shard'] = {
+            'index': index,
+            'count': count,
+            'files': list(files),
+            'total_files': total_files,
+        }
+    return record
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""Streaming pipeline, lint files as soon as they are formatted."""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+# Local imports
+from ciocheck.cache import run_cached
+from ciocheck.utils import filter_paths
+
+
+class StreamPipeline(object):
+    """Format and lint files, linting each file as soon as it is ready."""
+
+    # Maximum number of ready files to wait for before starting linters when
+    # all the workers are busy
+    BATCH_SIZE = 20
+
+    def __init__(self, formatters, multi_formatter, linters, jobs=1,
+                 callback=None, cache=None, keep_results=True):
+        """Format and lint files, linting each file as soon as it is ready.
+
+        Parameters
+        ----------
+        formatters : list of (tool, files)
+            Formatters that run over all their files before anything else.
+        multi_formatter : (tool, files) or None
+            Multi formatter, files are linted as each of its batches finishes.
+        linters : list of (tool, files)
+            Linters to run over batches of ready files.
+        jobs : int
+            Maximum number of linter batches running at the same time.
+        callback : callable
+            Called with `(tool_name, results)` as results are produced.
+        cache : ResultCache
+            Cache used to skip linting files with cached results.
+        keep_results : bool
+            If False, results are only given to the callback and not
+            returned, so memory does not grow with the number of results.
+        """
+        self.formatters = formatters
+        self.multi_formatter = multi_formatter
+        self.linters = linters
+        self.jobs = max(1, jobs)
+        self.callback = callback
+        self.cache = cache
+        self.keep_results = keep_results
+        self.stopped = False
+
+    def stop(self):
+        """Stop starting new work, running linter batches still finish."""
+        self.stopped = True
+
+    def _notify(self, tool_name, results):
+        """Call the callback if any results were produced."""
+        if self.callback and results:
+            self.callback(tool_name, results)
+
+    def _run_linter(self, tool, paths):
+        """Run a fresh copy of the linter `tool` on `paths`."""
+        # Linters keep per run state, so batches running at the same time
+        # can not share the same instance.
+        linter = type(tool)(tool.cmd_root)
+        results = run_cached(self.cache, linter, paths)
+        self._notify(tool.name, results)
+        return results if self.keep_results else []
+
+    def run(self):
+        """
+        Run the pipeline and return results grouped by tool name.
+
+        Linter results are sorted by path so the final report does not depend
+        on the order in which files were ready.
+        """
+        all_results = OrderedDict()
+        for tool, files in self.formatters:
+            if self.stopped:
+                break
+            print('Running "{}" ...'.format(tool.name))
+            results = tool.run(files)
+            self._notify(tool.name, results)
+            if results and self.keep_results:
+                all_results[tool.name] = {'files': files, 'results': results}
+
+        all_linter_files = set()
+        for tool, files in self.linters:
+            all_linter_files.update(files)
+
+        if self.multi_formatter:
+            multi_tool, multi_files = self.multi_formatter
+            formatted = set(multi_files)
+        else:
+            formatted = set()
+
+        # Files not handled by the multi formatter are ready from the start
+        ready = list(sorted(all_linter_files - formatted))
+        batches = []
+        pool = ThreadPool(self.jobs)
+
+        def busy():
+            """Return the number of linter batches still running."""
+            return len([b for b in batches if not b[1].ready()])
+
+        def flush():
+            """Start all linters on the files ready so far."""
+            paths = list(ready)
+            del ready[:]
+            if self.stopped:
+                return
+            for tool, files in self.linters:
+                subset = filter_paths(files, paths)
+                if subset:
+                    async_result = pool.apply_async(self._run_linter,
+                                                    (tool, subset))
+                    batches.append((tool.name, async_result))
+
+        try:
+            if ready:
+                flush()
+
+            if self.multi_formatter and not self.stopped:
+                print('Running "{}" ...'.format(multi_tool.name))
+                multi_results = []
+                for paths, results in multi_tool.iter_run(multi_files):
+                    if self.keep_results:
+                        multi_results += results
+                    for item in results:
+                        for tool_name, result in item.items():
+                            self._notify(tool_name, [result])
+
+                    ready += [p for p in paths if p in all_linter_files]
+                    if len(ready) >= self.BATCH_SIZE or busy() < self.jobs:
+                        flush()
+
+                    if self.stopped:
+                        break
+
+                multi_results = multi_tool.format_results(multi_results)
+                for tool_name, results in multi_results.items():
+                    all_results[tool_name] = {
+                        'files': multi_files,
+                        'results': results,
+                    }
+
+            if ready:
+                flush()
+
+            linter_results = OrderedDict(
+                (tool.name, []) for (tool, files) in self.linters)
+            for tool_name, async_result in batches:
+                linter_results[tool_name] += async_result.get()
+        finally:
+            pool.close()
+            pool.join()
+
+        for tool, files in self.linters:
+            results = linter_results[tool.name]
+            all_results[tool.name] = {
+                'files': files,
+                'results': sorted(results, key=lambda r: r['path']),
+            }
+        return all_results
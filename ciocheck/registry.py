@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""
+Registry of the tools ciocheck can run.
+
+The registry only keeps lightweight metadata of each tool, the module with
+the implementation is imported when the tool is used.
+
+Other packages can add tools with an entry point in the `ciocheck.tools`
+group pointing to a `ToolSpec`, defined in a module that is cheap to import:
+
+    # mypackage/ciocheck_tools.py
+    from ciocheck.registry import LINTER, ToolSpec
+
+    SPEC = ToolSpec('mylinter', LINTER, 'mypackage.linter:MyLinter',
+                    config_sections=[('mylinter', 'mylinter')])
+
+    # setup.py
+    entry_points={
+        'ciocheck.tools': ['mylinter = mypackage.ciocheck_tools:SPEC'],
+    }
+"""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+from collections import OrderedDict
+import importlib
+import sys
+
+ENTRY_POINT_GROUP = 'ciocheck.tools'
+
+# Kinds of tools
+LINTER = 'linter'
+FORMATTER = 'formatter'
+# Formatters run file by file by the multi formatter
+MULTI_FORMATTER = 'multiformatter'
+TESTER = 'tester'
+KINDS = [LINTER, FORMATTER, MULTI_FORMATTER, TESTER]
+
+
+class ToolSpec(object):
+    """Metadata of a tool and where to find its implementation."""
+
+    def __init__(self,
+                 name,
+                 kind,
+                 target,
+                 extensions=('py', ),
+                 config_sections=(),
+                 parallel_safe=True):
+        """Metadata of a tool and where to find its implementation.
+
+        Parameters
+        ----------
+        name : str
+            Name used to select the tool with `check` and `enforce`.
+        kind : str
+            One of `LINTER`, `FORMATTER`, `MULTI_FORMATTER` or `TESTER`.
+        target : str
+            The tool class, given as "module:ClassName".
+        extensions : tuple of str
+            Extensions of the files the tool processes.
+        config_sections : list of (str, str)
+            Sections of the ciocheck config file used by the tool, and the
+            section names in the config file of the tool.
+        parallel_safe : bool
+            If False, the tool is not run on several batches of files at the
+            same time.
+        """
+        if kind not in KINDS:
+            raise ValueError('Unknown kind of tool "{0}"'.format(kind))
+        self.name = name
+        self.kind = kind
+        self.target = target
+        self.extensions = tuple(extensions)
+        self.config_sections = list(config_sections)
+        self.parallel_safe = parallel_safe
+        self._tool = None
+
+    def __repr__(self):
+        """Return the representation of the spec."""
+        return 'ToolSpec({0!r}, {1!r}, {2!r})'.format(self.name, self.kind,
+                                                      self.target)
+
+    def load(self):
+        """Import and return the tool class."""
+        if self._tool is None:
+            module_name, class_name = self.target.split(':')
+            module = importlib.import_module(module_name)
+            self._tool = getattr(module, class_name)
+        return self._tool
+
+
+BUILTIN_TOOLS = [
+    ToolSpec(
+        'pep8',
+        LINTER,
+        'ciocheck.linters:Pep8Linter',
+        config_sections=[('pep8', 'pep8')]),
+    ToolSpec(
+        'pydocstyle',
+        LINTER,
+        'ciocheck.linters:PydocstyleLinter',
+        config_sections=[('pydocstyle', 'pydocstyle')]),
+    ToolSpec(
+        'flake8',
+        LINTER,
+        'ciocheck.linters:Flake8Linter',
+        config_sections=[('flake8', 'flake8')]),
+    # Pylint already uses all cpus
+    ToolSpec(
+        'pylint',
+        LINTER,
+        'ciocheck.linters:PylintLinter',
+        config_sections=[('pydocstyle', 'pydocstyle')],
+        parallel_safe=False),
+    ToolSpec(
+        'pyformat',
+        FORMATTER,
+        'ciocheck.formatters:PythonFormatter'),
+    ToolSpec(
+        'isort',
+        MULTI_FORMATTER,
+        'ciocheck.formatters:IsortFormatter',
+        config_sections=[('isort', 'settings')]),
+    ToolSpec(
+        'yapf',
+        MULTI_FORMATTER,
+        'ciocheck.formatters:YapfFormatter',
+        config_sections=[('yapf:style', 'style')]),
+    ToolSpec(
+        'autopep8',
+        MULTI_FORMATTER,
+        'ciocheck.formatters:Autopep8Formatter',
+        config_sections=[('autopep8', 'pep8')]),
+    ToolSpec(
+        'coverage',
+        TESTER,
+        'ciocheck.tools:CoverageTool',
+        config_sections=[
+            ('coverage:run', 'run'),
+            ('coverage:report', 'report'),
+            ('coverage:html', 'html'),
+            ('coverage:xml', 'xml'),
+        ]),
+    ToolSpec(
+        'pytest',
+        TESTER,
+        'ciocheck.tools:PytestTool',
+        config_sections=[('pytest', 'pytest')]),
+]
+
+
+def iter_entry_points(group):
+    """Yield the entry points of installed packages in `group`."""
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        try:
+            import pkg_resources
+        except ImportError:
+            return
+        for entry_point in pkg_resources.iter_entry_points(group):
+            yield entry_point
+        return
+
+    all_entry_points = entry_points()
+    if hasattr(all_entry_points, 'select'):
+        selected = all_entry_points.select(group=group)
+    else:
+        selected = all_entry_points.get(group, [])
+    for entry_point in selected:
+        yield entry_point
+
+
+class ToolRegistry(object):
+    """Tools by name, in the order they run."""
+
+    def __init__(self, specs=(), group=ENTRY_POINT_GROUP):
+        """Tools by name, in the order they run.
+
+        Tools of installed packages in the entry point `group` are added
+        after `specs` the first time all tools, or a tool not in `specs`,
+        are asked for.
+        """
+        self.group = group
+        self._specs = OrderedDict()
+        self._discovered = group is None
+        for spec in specs:
+            self.add(spec)
+
+    def add(self, spec):
+        """Add the tool `spec`, a name can only be registered once."""
+        if spec.name in self._specs:
+            raise ValueError('Tool "{0}" is already registered'.format(
+                spec.name))
+        self._specs[spec.name] = spec
+
+    def discover(self):
+        """Add the tools of installed packages, only done once."""
+        if self._discovered:
+            return
+        self._discovered = True
+
+        for entry_point in iter_entry_points(self.group):
+            try:
+                spec = entry_point.load()
+                if not isinstance(spec, ToolSpec):
+                    raise TypeError('not a ToolSpec')
+                self.add(spec)
+            except Exception as error:
+                # A broken plugin should not prevent running other tools
+                print('Could not add tool "{0}": {1}'.format(
+                    entry_point.name, error), file=sys.stderr)
+
+    def specs(self, kinds=None):
+        """Return the specs of tools of `kinds`, or of all tools."""
+        self.discover()
+        return [
+            spec for spec in self._specs.values()
+            if kinds is None or spec.kind in kinds
+        ]
+
+    def names(self, kinds=None):
+        """Return the names of tools of `kinds`, or of all tools."""
+        return [spec.name for spec in self.specs(kinds)]
+
+    def registered_names(self):
+        """Return the names of tools registered so far, without discovery."""
+        return list(self._specs)
+
+    def get(self, name):
+        """Return the spec of tool `name`, or None if it is not registered."""
+        if name not in self._specs:
+            self.discover()
+        return self._specs.get(name)
+
+    def load(self, kinds, names):
+        """Return the classes of tools of `kinds` in `names`, imported."""
+        if any(name not in self._specs for name in names):
+            self.discover()
+        return [
+            spec.load() for spec in self._specs.values()
+            if spec.kind in kinds and spec.name in names
+        ]
+
+    def choices(self):
+        """Return the tool names accepted by a command line option."""
+        return ToolChoices(self)
+
+
+class ToolChoices(object):
+    """Tool names of a registry, discovering plugins only when needed.
+
+    Built-in names are listed in help texts and accepted right away, the
+    tools of installed packages are only discovered for other names.
+    """
+
+    def __init__(self, registry):
+        """Tool names of a registry, discovering plugins only when needed."""
+        self.registry = registry
+
+    def __contains__(self, name):
+        """Return True if tool `name` is registered."""
+        return self.registry.get(name) is not None
+
+    def __iter__(self):
+        """Iterate over the names of tools registered so far."""
+        return iter(self.registry.registered_names())
+
+
+# Shared by all modules, plugins are discovered when first needed
+REGISTRY = ToolRegistry(BUILTIN_TOOLS)
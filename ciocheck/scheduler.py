@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""Dependency aware scheduler for running tool stages concurrently."""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+from collections import OrderedDict
+import sys
+import threading
+import time
+
+# Third party imports
+import six
+
+
+class Stage(object):
+    """A unit of work that can only start when its dependencies finished."""
+
+    def __init__(self, name, func, depends=(), priority=0):
+        """A unit of work that can only start when its dependencies finished.
+
+        Parameters
+        ----------
+        name : str
+            Unique name of the stage.
+        func : callable
+            Callable without arguments, its return value is stored on result.
+        depends : list of str
+            Names of the stages that need to finish before this one starts.
+        priority : number
+            Stages ready at the same time start by decreasing priority.
+        """
+        self.name = name
+        self.func = func
+        self.depends = list(depends)
+        self.priority = priority
+        self.result = None
+        self.exc_info = None
+        self.start = None
+        self.end = None
+
+    @property
+    def duration(self):
+        """Return the wall time in seconds spent running the stage."""
+        if self.start is None or self.end is None:
+            return 0.0
+        return self.end - self.start
+
+    def run(self):
+        """Run the stage and store the result or the raised exception."""
+        self.start = time.time()
+        try:
+            self.result = self.func()
+        except Exception:
+            self.exc_info = sys.exc_info()
+        finally:
+            self.end = time.time()
+
+
+class Scheduler(object):
+    """Run stages as soon as their dependencies are done, `jobs` at a time."""
+
+    def __init__(self, jobs=1):
+        """Run stages as soon as their dependencies are done, `jobs` at a time.
+
+        Stages have to be added after the stages they depend on, so the graph
+        is always acyclic.
+        """
+        self.jobs = max(1, jobs)
+        self.stages = OrderedDict()
+        self.cancelled = False
+        self._cancel_after = None
+        self._condition = threading.Condition()
+
+    def add_stage(self, name, func, depends=(), priority=0):
+        """Add a stage named `name` running `func` after `depends` finish."""
+        if name in self.stages:
+            raise ValueError('Stage "{0}" already defined'.format(name))
+
+        for dependency in depends:
+            if dependency not in self.stages:
+                raise ValueError('Stage "{0}" depends on unknown stage '
+                                 '"{1}"'.format(name, dependency))
+
+        stage = Stage(name, func, depends=depends, priority=priority)
+        self.stages[name] = stage
+        return stage
+
+    def cancel(self, after=None):
+        """
+        Stop starting new stages.
+
+        `run` returns as soon as the stage named `after` finishes, or right
+        away if `after` is None, without waiting for other running stages.
+        Their threads are left to finish on their own.
+        """
+        with self._condition:
+            self.cancelled = True
+            self._cancel_after = after
+            self._condition.notify_all()
+
+    def run(self):
+        """
+        Run all stages and wait for them to finish.
+
+        If a stage fails, stages depending on it are not started and the
+        first exception is raised once running stages are done.
+        """
+        condition = self._condition
+        pending = sorted(self.stages.values(), key=lambda s: -s.priority)
+        running = set()
+        done = set()
+
+        def run_stage(stage):
+            """Run stage in a thread and wake up the scheduling loop."""
+            stage.run()
+            with condition:
+                running.discard(stage.name)
+                done.add(stage.name)
+                condition.notify_all()
+
+        with condition:
+            while pending or running:
+                if self.cancelled:
+                    pending = []
+                    if (self._cancel_after is None or
+                            self._cancel_after in done):
+                        break
+                    condition.wait()
+                    continue
+
+                failed = [s for s in self.stages.values() if s.exc_info]
+                if failed:
+                    # Do not start anything new, wait for running stages
+                    pending = []
+                    if running:
+                        condition.wait()
+                    continue
+
+                for stage in list(pending):
+                    if len(running) >= self.jobs:
+                        break
+
+                    if all(dep in done for dep in stage.depends):
+                        pending.remove(stage)
+                        running.add(stage.name)
+                        thread = threading.Thread(
+                            target=run_stage, args=(stage, ))
+                        thread.daemon = True
+                        thread.start()
+
+                if running:
+                    condition.wait()
+
+        for stage in self.stages.values():
+            if self.cancelled and stage.name != self._cancel_after:
+                # Errors of abandoned stages are expected, their processes
+                # are usually killed
+                continue
+            if stage.exc_info:
+                six.reraise(*stage.exc_info)
+
+    def critical_path(self):
+        """
+        Return the list of stages that bounded the total run time.
+
+        Starting from the stage that finished last, walk back through the
+        dependency that finished last until reaching a stage without
+        dependencies.
+        """
+        finished = [s for s in self.stages.values() if s.end is not None]
+        if not finished:
+            return []
+
+        stage = max(finished, key=lambda s: s.end)
+        path = [stage]
+        while stage.depends:
+            depends = [self.stages[name] for name in stage.depends]
+            depends = [s for s in depends if s.end is not None]
+            if not depends:
+                break
+            stage = max(depends, key=lambda s: s.end)
+            path.insert(0, stage)
+        return path
+
+    def format_critical_path(self):
+        """Return a one line description of the critical path."""
+        path = self.critical_path()
+        if not path:
+            return ''
+
+        total = path[-1].end - path[0].start
+        steps = ' -> '.join('{0} ({1:.2f}s)'.format(s.name, s.duration)
+                            for s in path)
+        return 'Critical path ({0:.2f}s): {1}'.format(total, steps)
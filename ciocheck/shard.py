@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""
+Split files between shards running on different CI nodes.
+
+Files are partitioned by their expected cost, the time tools spent on them
+in previous runs. Files without a recorded cost are estimated from their
+size. The partition only depends on the file list, the costs file and the
+file sizes, so all nodes agree on it as long as they read the same costs
+file. Runs without shards record costs, shard runs only read them.
+"""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+import heapq
+import json
+import os
+import threading
+
+# Local imports
+from ciocheck.config import COSTS_FILE
+from ciocheck.utils import atomic_replace
+
+# Weight of the newest measurement when updating a recorded cost
+COST_SMOOTHING = 0.5
+# Formatters work line by line, a line costs about as much as this many bytes
+LINE_WEIGHT = 40
+
+
+def parse_shard(value):
+    """
+    Parse a shard given as "I/N" and return `(index, count)`.
+
+    Shards are numbered from 1 to N. Raise ValueError for invalid values.
+    """
+    try:
+        index, count = [int(part) for part in value.split('/')]
+    except (AttributeError, ValueError):
+        raise ValueError('Shard must be given as I/N, got "{0}"'.format(value))
+
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError('Shard index must be between 1 and {0}, got '
+                         '"{1}"'.format(count, value))
+    return index, count
+
+
+def _file_size(path):
+    """Return the size of `path` or 0 if it does not exist."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def file_weight(path):
+    """Return the size of `path` with its lines weighted, 0 if missing."""
+    try:
+        with open(path, 'rb') as file_obj:
+            contents = file_obj.read()
+    except (IOError, OSError):
+        return 0
+    return len(contents) + LINE_WEIGHT * contents.count(b'\n')
+
+
+class FileCosts(object):
+    """Time spent by tools on each file, recorded across runs."""
+
+    def __init__(self):
+        """Time spent by tools on each file, recorded across runs."""
+        self.enabled = False
+        self.cmd_root = None
+        self.path = None
+        self.costs = {}
+        self._new_costs = {}
+        self._lock = threading.Lock()
+
+    def enable(self, cmd_root, file_name=COSTS_FILE):
+        """Load recorded costs and start recording new ones."""
+        self.read(cmd_root, file_name)
+        self.enabled = True
+
+    def read(self, cmd_root, file_name=COSTS_FILE):
+        """Load recorded costs without recording new ones."""
+        self.enabled = False
+        self.cmd_root = cmd_root
+        self.path = os.path.join(cmd_root, file_name)
+        self.costs = self._load()
+        self._new_costs = {}
+
+    def _load(self):
+        """Return the recorded costs, a missing or broken file is ignored."""
+        try:
+            with open(self.path, 'r') as file_obj:
+                return dict(json.load(file_obj))
+        except (IOError, OSError, ValueError, TypeError):
+            return {}
+
+    def _key(self, path):
+        """Return the key of `path` in the costs file."""
+        return os.path.relpath(path, self.cmd_root)
+
+    def add(self, paths, seconds):
+        """
+        Record that a tool spent `seconds` on `paths`.
+
+        Tools process files in batches, the time is split between the files
+        of the batch proportionally to their size.
+        """
+        if not self.enabled or not paths:
+            return
+
+        sizes = [_file_size(path) + 1 for path in paths]
+        total_size = float(sum(sizes))
+        with self._lock:
+            for path, size in zip(paths, sizes):
+                key = self._key(path)
+                cost = self._new_costs.get(key, 0)
+                self._new_costs[key] = cost + seconds * size / total_size
+
+    def cost(self, path):
+        """Return the recorded cost of `path` or None."""
+        return self.costs.get(self._key(path))
+
+    def save(self):
+        """Merge costs of this run into the costs file."""
+        if not self.enabled or not self._new_costs:
+            return
+
+        # Reload to keep costs written by other shards in the meantime
+        costs = self._load()
+        with self._lock:
+            for key, new_cost in self._new_costs.items():
+                old_cost = costs.get(key)
+                if old_cost is None:
+                    costs[key] = new_cost
+                else:
+                    costs[key] = (COST_SMOOTHING * new_cost +
+                                  (1 - COST_SMOOTHING) * old_cost)
+            self._new_costs = {}
+
+        try:
+            atomic_replace(self.path, json.dumps(costs, sort_keys=True),
+                           'utf-8')
+        except (IOError, OSError):
+            pass
+        self.costs = costs
+
+
+def estimate_costs(paths, costs, weight=_file_size):
+    """
+    Return a dict of path: expected cost.
+
+    Files without a recorded cost get a cost from their `weight`, by default
+    their size, using the average cost per unit of weight of files with a
+    recorded cost.
+    """
+    recorded = {}
+    sizes = {}
+    for path in paths:
+        sizes[path] = weight(path) + 1
+        cost = costs.cost(path) if costs is not None else None
+        if cost is not None:
+            recorded[path] = cost
+
+    if recorded:
+        total_size = sum(sizes[path] for path in recorded)
+        cost_per_byte = sum(recorded.values()) / float(total_size)
+    else:
+        cost_per_byte = 1.0
+
+    return dict((path, recorded.get(path, sizes[path] * cost_per_byte))
+                for path in paths)
+
+
+def partition(paths, count, costs=None):
+    """
+    Split `paths` in `count` lists with balanced expected costs.
+
+    The most expensive files are assigned first, each to the shard with the
+    lowest total cost so far (longest processing time first). Ties are
+    broken by path and shard number so the result is stable.
+    """
+    estimated = estimate_costs(paths, costs)
+    shards = [[] for i in range(count)]
+    heap = [(0.0, i) for i in range(count)]
+    for path in sorted(paths, key=lambda p: (-estimated[p], p)):
+        total, index = heapq.heappop(heap)
+        shards[index].append(path)
+        heapq.heappush(heap, (total + estimated[path], index))
+    return [list(sorted(shard)) for shard in shards]
+
+
+# Shared by all tools, only records costs once enabled
+COSTS = FileCosts()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test the synthetic benchmark."""
+
+# Standard library imports
+import os
+import subprocess
+
+# Local imports
+from ciocheck.bench import ReplayBenchmark, SyntheticBenchmark, make_repo
+from ciocheck.vcs import GitDiffTool
+
+
+def test_make_repo(tmpdir):
+    """The last commit changes the requested lines of the requested files."""
+    root = os.path.realpath(str(tmpdir))
+    make_repo(root, files=5, lines=60, changed_files=2, changed_lines=3)
+    changed = GitDiffTool(root).commited_file_lines()
+    assert len(changed) == 2
+    for added_lines, deleted_lines in changed.values():
+        assert len(added_lines) == 3
+
+
+def test_synthetic_benchmark(tmpdir):
+    """Stages are timed, even without tools."""
+    root = os.path.realpath(str(tmpdir))
+    make_repo(root, files=5, lines=60, changed_files=2, changed_lines=3)
+    results = SyntheticBenchmark(root, check=[], repeat=2).run()
+    assert list(results) == ['diff parse', 'get files', 'process results']
+    assert results['get files']['items'] == 2
+    assert len(results['diff parse']['times']) == 2
+
+
+def test_replay_benchmark(tmpdir):
+    """Each commit with a parent is checked in a scratch worktree."""
+    root = os.path.realpath(str(tmpdir))
+    make_repo(root, files=3, lines=30, changed_files=1, changed_lines=1)
+    benchmark = ReplayBenchmark(
+        root,
+        'HEAD~1..HEAD',
+        folders=['pkg'],
+        args=['--disable-formatters', '--disable-linters', '--disable-tests'])
+    records = benchmark.run()
+    assert len(records) == 1
+    assert records[0]['returncode'] == 0
+    assert not records[0]['failed']
+    assert benchmark.results()['total']['items'] == 1
+    assert benchmark.cache_stats()['total']['hit_rate'] is None
+
+
+def test_replay_benchmark_without_trace(tmpdir):
+    """Runs exiting before writing their trace are failed replays."""
+    root = os.path.realpath(str(tmpdir))
+    make_repo(root, files=3, lines=30, changed_files=1, changed_lines=1)
+    git_commit = ['git', '-c', 'user.name=a', '-c', 'user.email=a@b',
+                  'commit', '-q', '--allow-empty', '-m', 'empty']
+    subprocess.check_call(git_commit, cwd=root)
+    benchmark = ReplayBenchmark(
+        root, 'HEAD~2..HEAD', folders=['pkg'], args=['--unknown-option'])
+    records = benchmark.run()
+    assert len(records) == 2
+    assert all(record['failed'] for record in records)
+    assert benchmark.failed() == [r['commit'] for r in records]
+    assert benchmark.results() == {}
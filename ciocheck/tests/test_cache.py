@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test result cache."""
+
+# Standard library imports
+import os
+
+# Local imports
+from ciocheck.cache import FormattedIndex, ResultCache, run_cached
+from ciocheck.formatters import MultiFormatter
+from ciocheck.tools import Tool
+
+
+class CountingTool(Tool):
+    """Tool reporting one result per file and counting processed files."""
+
+    name = 'counting'
+
+    def __init__(self, cmd_root):
+        """Tool reporting one result per file."""
+        super(CountingTool, self).__init__(cmd_root)
+        self.processed = []
+
+    def run(self, paths):
+        """Return one result per path."""
+        self.processed += list(paths)
+        return [{'path': path, 'line': 1, 'message': 'found'}
+                for path in paths]
+
+
+def test_run_cached(tmpdir):
+    """Only files with new contents are processed again."""
+    cache = ResultCache(str(tmpdir.join('cache')))
+    paths = []
+    for name in ['a.py', 'b.py']:
+        path = tmpdir.join(name)
+        path.write('x = 1\n')
+        paths.append(str(path))
+
+    tool = CountingTool(str(tmpdir))
+    results = run_cached(cache, tool, paths)
+    assert [r['path'] for r in results] == paths
+    assert cache.misses == {'counting': 2}
+
+    tmpdir.join('b.py').write('x = 2\n')
+    tool = CountingTool(str(tmpdir))
+    assert run_cached(cache, tool, paths) == results
+    assert tool.processed == [paths[1]]
+    assert cache.hits == {'counting': 1}
+
+
+def test_hash_file_rewritten(tmpdir):
+    """Files replaced with the same size and mtime are hashed again."""
+    cache = ResultCache(str(tmpdir.join('cache')))
+    path = tmpdir.join('a.py')
+    path.write('import b\nimport a\n')
+    stat = os.stat(str(path))
+    old_hash = cache.hash_file(str(path))
+
+    # Like a formatter replacing the file right after reading it
+    new_path = tmpdir.join('a.py.tmp')
+    new_path.write('import a\nimport b\n')
+    os.utime(str(new_path), (stat.st_atime, stat.st_mtime))
+    os.rename(str(new_path), str(path))
+    assert cache.hash_file(str(path)) != old_hash
+
+
+def test_evict(tmpdir):
+    """Least recently used entries are removed first."""
+    cache = ResultCache(str(tmpdir), max_size=0)
+    cache.set('aa', ['old'])
+    cache.set('bb', ['new'])
+    os.utime(os.path.join(str(tmpdir), 'aa', 'aa.json'), (0, 0))
+    cache.max_size = os.path.getsize(
+        os.path.join(str(tmpdir), 'bb', 'bb.json'))
+    cache.evict()
+    assert cache.get('tool', 'aa') is None
+    assert cache.get('tool', 'bb') == ['new']
+
+
+def test_compact(tmpdir):
+    """Leftover temporary files and unreadable entries are removed."""
+    cache = ResultCache(str(tmpdir))
+    cache.set('aa', ['ok'])
+    tmpdir.join('bb').ensure(dir=True).join('bb.json').write('{"trunc')
+    stale = tmpdir.join('cc').ensure(dir=True).join('cc.jsontmp-1')
+    stale.write('')
+    os.utime(str(stale), (0, 0))
+    fresh = tmpdir.join('aa', 'dd.jsontmp-2')
+    fresh.write('')
+
+    assert cache.get('tool', 'bb') is None
+    assert cache.compact() == 2
+    assert cache.get('tool', 'aa') == ['ok']
+    assert fresh.check()
+    assert not tmpdir.join('bb').check()
+    assert not tmpdir.join('cc').check()
+
+
+def test_formatted_index(tmpdir):
+    """Files left unchanged are skipped by the next runs."""
+    index_path = str(tmpdir.join('cache', 'formatted.json'))
+    clean_path = tmpdir.join('clean.py')
+    clean_path.write('x = 1\n')
+    dirty_path = tmpdir.join('dirty.py')
+    dirty_path.write('y=2\n')
+    paths = [str(clean_path), str(dirty_path)]
+
+    index = FormattedIndex(index_path)
+    formatter = MultiFormatter(
+        str(tmpdir), ['autopep8'], in_process=True, index=index)
+    formatter.run(paths)
+    assert dirty_path.read() == 'y = 2\n'
+    index.save()
+
+    index = FormattedIndex(index_path)
+    formatter = MultiFormatter(
+        str(tmpdir), ['autopep8'], in_process=True, index=index)
+    batches = list(formatter.iter_run(paths))
+    # The formatted file is only known to be formatted after this run
+    assert batches == [([str(clean_path)], []), ([str(dirty_path)], [])]
+    assert (index.hits, index.misses) == (1, 1)
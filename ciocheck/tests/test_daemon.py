@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test the ciocheck server and client."""
+
+# Standard library imports
+import json
+import os
+import threading
+
+# Local imports
+from ciocheck.daemon import CiocheckServer, send_request
+from ciocheck.tests.test_main import make_repo, tools_path
+
+
+def test_server_check(tmpdir, monkeypatch):
+    """Checks run on the server, reusing formatter workers."""
+    monkeypatch.setenv('PATH', tools_path())
+    root = make_repo(tmpdir.mkdir('repo'), modules=2)
+    socket_path = str(tmpdir.join('ciocheck.sock'))
+    server = CiocheckServer(socket_path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    request = {
+        'command': 'check',
+        'cwd': root,
+        'argv': ['pkg', '-fm', 'all', '-c', 'flake8', '-e', 'flake8'],
+    }
+    try:
+        response = send_request(socket_path, request)
+        assert response['status'] == 1
+        assert "'os' imported but unused" in response['output']
+        assert 'Ciocheck failures in' in response['output']
+
+        request['argv'] = ['pkg', '-fm', 'all', '-c', 'yapf', '-e', 'yapf']
+        response = send_request(socket_path, request)
+        assert response['status'] == 0
+        assert 'Ciocheck successful run' in response['output']
+        pool, = server.formatter_pools.values()
+        pids = set(worker.process.pid for worker in pool._idle)
+        assert pids
+
+        # The next check is formatted by the same workers
+        response = send_request(socket_path, request)
+        assert response['status'] == 0
+        assert set(worker.process.pid for worker in pool._idle) == pids
+
+        # Only records are written to stdout, the trace is written by the
+        # server
+        request['argv'] = [
+            'pkg', '-fm', 'all', '-c', 'flake8', '-e', 'flake8', '--format',
+            'jsonl', '--trace', 'trace.json'
+        ]
+        response = send_request(socket_path, request)
+        assert response['status'] == 1
+        records = [
+            json.loads(line) for line in response['output'].splitlines()
+        ]
+        assert records[-1]['kind'] == 'summary'
+        assert 'Trace written to "trace.json"' in response['error_output']
+        with open(os.path.join(root, 'trace.json')) as file_obj:
+            assert json.load(file_obj)['traceEvents']
+
+        response = send_request(socket_path, {'command': 'stop'})
+        assert response['output'] == 'Server stopped\n'
+        thread.join(10)
+        assert not thread.is_alive()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert not pool._idle
+    assert not os.path.exists(socket_path)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test formatting files with the chain of multi formatters."""
+
+# Standard library imports
+import json
+import os
+
+# Third party imports
+from six import StringIO
+
+# Local imports
+from ciocheck.format_task import format_file, format_paths
+from ciocheck.formatters import YapfFormatter
+from ciocheck.utils import diff
+
+
+def test_format_file_chain(tmpdir):
+    """Each formatter gets the output of the previous one and its own diff."""
+    path = tmpdir.join('module.py')
+    path.write('import sys\nimport os\nx=1\n')
+
+    results = format_file(str(path), str(tmpdir), ['isort', 'autopep8'])
+    assert path.read() == 'import os\nimport sys\n\nx = 1\n'
+    assert results['isort']['diff'] == diff(
+        'import sys\nimport os\nx=1\n', 'import os\nimport sys\n\nx=1\n')
+    assert results['autopep8']['diff'] == diff(
+        'import os\nimport sys\n\nx=1\n', 'import os\nimport sys\n\nx = 1\n')
+
+
+def test_format_file_line_ranges(tmpdir):
+    """Only the given lines are formatted, following moves by formatters."""
+    tmpdir.join('.style.yapf').write('[style]\nbased_on_style = pep8\n')
+    path = tmpdir.join('module.py')
+    path.write('import sys\nimport os\nx=1\ny=2\n')
+
+    format_file(str(path), str(tmpdir), ['isort', 'yapf'], [(4, 4)])
+    assert path.read() == 'import os\nimport sys\n\nx=1\ny = 2\n'
+
+
+def test_format_paths_unreadable_file(tmpdir, monkeypatch):
+    """A file that can not be decoded is skipped, the others are formatted."""
+    monkeypatch.setenv('CIOCHECK_PROJECT_ROOT', str(tmpdir))
+    monkeypatch.setenv('CIOCHECK_CHECK', "['isort']")
+    bad_path = tmpdir.join('bad.py')
+    bad_path.write_binary(b'import sys\nimport os\nx = "\xe9"\n')
+    good_path = tmpdir.join('good.py')
+    good_path.write('import sys\nimport os\n')
+
+    output = StringIO()
+    tasks = [(str(bad_path), None), (str(good_path), None)]
+    assert format_paths(tasks, output)
+    bad_record, good_record = [
+        json.loads(line) for line in output.getvalue().splitlines()
+    ]
+    assert bad_record['path'] == str(bad_path)
+    skipped = bad_record['results']['multiformatter']['skipped']
+    assert skipped.startswith('could not read the file')
+    assert bad_path.read_binary() == b'import sys\nimport os\nx = "\xe9"\n'
+    assert good_record['results']['isort']['diff']
+    assert good_path.read() == 'import os\nimport sys\n'
+
+
+def test_yapf_style_reloaded(tmpdir):
+    """The parsed style is reused until the style file changes."""
+    style_path = tmpdir.join('.style.yapf')
+    style_path.write('[style]\nbased_on_style = pep8\n')
+    YapfFormatter.cmd_root = str(tmpdir)
+    contents = 'def f():\n    return 1\n'
+    assert YapfFormatter.format_string(contents)[1] == contents
+
+    style_path.write('[style]\nbased_on_style = pep8\nindent_width = 2\n')
+    assert YapfFormatter.format_string(contents)[1] == (
+        'def f():\n  return 1\n')
+    assert YapfFormatter.format_string(contents)[1] == (
+        'def f():\n  return 1\n')
+
+    # Rewritten with the same size and modification time
+    stat = os.stat(str(style_path))
+    style_path.write('[style]\nbased_on_style = pep8\nindent_width = 3\n')
+    os.utime(str(style_path), (stat.st_atime, stat.st_mtime))
+    assert YapfFormatter.format_string(contents)[1] == (
+        'def f():\n   return 1\n')
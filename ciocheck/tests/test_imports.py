@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test the startup time of the command line interface."""
+
+# Standard library imports
+import subprocess
+import sys
+
+# Third party imports
+import pytest
+
+# Modules only imported when their tool runs
+HEAVY_MODULES = ['autopep8', 'isort', 'pytest', 'pytest_cov', 'yapf']
+
+# Cumulative import time of ciocheck.main, in seconds
+IMPORT_TIME_BUDGET = 0.5
+
+
+def import_times():
+    """Return a dict of module: cumulative import time of `-m ciocheck`."""
+    cmd = [sys.executable, '-X', 'importtime', '-m', 'ciocheck', '--help']
+    process = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, err = process.communicate()
+    times = {}
+    for line in err.decode('utf-8').splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line.split('|')
+        try:
+            cumulative = int(parts[1]) / 1e6
+        except ValueError:
+            continue
+        times[parts[2].strip()] = cumulative
+    return times
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason='Needs -X importtime')
+def test_import_time():
+    """Heavy tool modules are not imported to start the cli."""
+    times = import_times()
+    assert 'ciocheck.main' in times
+    for name in HEAVY_MODULES:
+        assert name not in times
+    assert times['ciocheck.main'] < IMPORT_TIME_BUDGET
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test the tool runner."""
+
+# Standard library imports
+from io import StringIO
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Third party imports
+import pytest
+
+# Local imports
+from ciocheck.formatters import Formatter
+from ciocheck.linters import Flake8Linter, Pep8Linter
+from ciocheck.main import Runner, create_parser, get_paths
+from ciocheck.output import JsonLinesWriter
+from ciocheck.registry import (FORMATTER, MULTI_FORMATTER, REGISTRY,
+                               TESTER, ToolSpec)
+from ciocheck.scheduler import Scheduler
+from ciocheck.utils import allow_processes
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+
+
+def make_repo(tmpdir, modules=10):
+    """Create a git repository with a package failing flake8 and a test."""
+    tmpdir.join('.ciocheck').write(
+        '[ciocheck]\n\n[yapf:style]\nbased_on_style = pep8\n')
+    pkg = tmpdir.mkdir('pkg')
+    pkg.join('__init__.py').write('"""Package."""\n')
+    for i in range(modules):
+        pkg.join('mod_{0}.py'.format(i)).write(
+            '"""Module."""\nimport os\nimport sys\n\n\ndef f(a):\n'
+            '    """Return a."""\n    return a\n')
+    pkg.mkdir('tests').join('test_mod.py').write(
+        '"""Test."""\nfrom pkg.mod_0 import f\n\n\ndef test_f():\n'
+        '    """Test f."""\n    print("output")\n    assert f(1) == 1\n')
+
+    root = str(tmpdir)
+    env = dict(os.environ, GIT_AUTHOR_NAME='a', GIT_AUTHOR_EMAIL='a@b',
+               GIT_COMMITTER_NAME='a', GIT_COMMITTER_EMAIL='a@b')
+    for command in [['git', 'init', '-q'], ['git', 'add', '.'],
+                    ['git', 'commit', '-qm', 'init'],
+                    ['git', 'update-ref', 'refs/remotes/origin/master',
+                     'HEAD']]:
+        subprocess.check_call(command, cwd=root, env=env)
+    return root
+
+
+def tools_path():
+    """Return the PATH where tools are found next to the running python."""
+    return os.pathsep.join(
+        [os.path.dirname(sys.executable), os.environ.get('PATH', '')])
+
+
+def run_ciocheck(root, args):
+    """Run ciocheck in a subprocess, return its jsonl records and trace."""
+    env = dict(os.environ, PYTHONPATH=ROOT, PATH=tools_path())
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'ciocheck.main', 'pkg', '--format', 'jsonl',
+         '-fm', 'all', '--trace', 'trace.json'] + args,
+        cwd=root, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, _ = process.communicate()
+    records = [json.loads(line) for line in output.decode().splitlines()]
+    with open(os.path.join(root, 'trace.json')) as file_obj:
+        spans = dict((event['name'], event)
+                     for event in json.load(file_obj)['traceEvents']
+                     if event['ph'] == 'X')
+    return records, spans
+
+
+def test_jsonl_records_with_tests(tmpdir):
+    """Records of linters are all written when tests run in the same run."""
+    root = make_repo(tmpdir)
+    expected, _ = run_ciocheck(root, ['-c', 'flake8'])
+    records, spans = run_ciocheck(root, ['-c', 'flake8', 'pytest'])
+
+    findings = [r for r in records if r['kind'] == 'finding']
+    assert findings == [r for r in expected if r['kind'] == 'finding']
+    assert len(findings) == 20
+    assert [r['kind'] for r in records].count('tests') == 1
+    assert records[-1]['kind'] == 'summary'
+    assert 'pytest' in spans
+
+
+def test_shards_read_shared_costs(tmpdir):
+    """Shards split files by the shared costs, without changing them."""
+    root = make_repo(tmpdir, modules=4)
+    costs = {'pkg/mod_0.py': 10.0, 'pkg/mod_1.py': 9.0}
+    for name in ['__init__', 'mod_2', 'mod_3', 'tests/test_mod']:
+        costs['pkg/{0}.py'.format(name)] = 0.1
+    costs_path = tmpdir.join('costs.json')
+    costs_path.write(json.dumps(costs))
+
+    summaries = []
+    for index in [1, 2]:
+        shard = '{0}/2'.format(index)
+        records, _ = run_ciocheck(root, ['-c', 'flake8', '--shard', shard,
+                                         '--shard-costs', str(costs_path)])
+        summaries.append(records[-1]['shard'])
+
+    files = [summary['files'] for summary in summaries]
+    assert [s['index'] for s in summaries] == [1, 2]
+    assert all(s['count'] == 2 and s['total_files'] == 6 for s in summaries)
+    assert sorted(files[0] + files[1]) == [
+        'pkg/__init__.py', 'pkg/mod_0.py', 'pkg/mod_1.py', 'pkg/mod_2.py',
+        'pkg/mod_3.py', 'pkg/tests/test_mod.py'
+    ]
+    # Expensive files are in different shards
+    assert 'pkg/mod_0.py' in files[0]
+    assert 'pkg/mod_1.py' in files[1]
+    assert not tmpdir.join('.ciocheck_costs').check()
+    assert json.loads(costs_path.read()) == costs
+
+
+@pytest.fixture
+def tools(monkeypatch):
+    """Find tools next to the running python, let processes run after."""
+    monkeypatch.setenv('PATH', tools_path())
+    yield
+    # Stopped runs kill any subprocess started afterwards
+    allow_processes()
+
+
+def make_runner(root, args):
+    """Create a runner checking the package of `root` in this process."""
+    cli_args = create_parser().parse_args(['pkg', '-fm', 'all'] + args)
+    folders, files = get_paths(cli_args.folders, root)
+    return Runner(
+        root, cli_args, folders=folders, files=files, in_process=True)
+
+
+class SlowTextFormatter(Formatter):
+    """Formatter of text files, slower than the tests of the package."""
+
+    name = 'slowtext'
+    extensions = ('txt', )
+
+    def run(self, paths):
+        """Format nothing, slowly."""
+        time.sleep(3)
+        return []
+
+
+@pytest.fixture
+def text_formatter():
+    """Register a formatter of text files while the test runs."""
+    REGISTRY.add(
+        ToolSpec(
+            SlowTextFormatter.name,
+            FORMATTER,
+            'ciocheck.tests.test_main:SlowTextFormatter',
+            extensions=SlowTextFormatter.extensions))
+    yield
+    REGISTRY._specs.pop(SlowTextFormatter.name)
+
+
+def test_tests_overlap_unrelated_formatters(tmpdir, tools, text_formatter):
+    """Tests do not wait for formatters of files they do not test."""
+    root = make_repo(tmpdir, modules=1)
+    tmpdir.join('pkg', 'notes.txt').write('Notes.\n')
+    runner = make_runner(root, ['-c', 'slowtext', 'pytest', '-j', '2'])
+    runner.run(exit_on_failure=False)
+
+    stages = runner._scheduler.stages
+    assert stages['pytest'].depends == []
+    assert stages['pytest'].start < stages['slowtext'].end
+    assert runner.test_results['pytest']['report']['summary']['passed'] == 1
+
+    # Formatters of python files change the tested files
+    runner = make_runner(root, ['-c', 'slowtext', 'yapf', 'pytest'])
+    scheduler = Scheduler()
+    formatter_tasks = runner.add_formatter_stages(
+        scheduler, REGISTRY.load([FORMATTER, MULTI_FORMATTER], runner.check),
+        True)
+    testers = REGISTRY.load([TESTER], ['pytest'])
+    runner.add_tester_stages(scheduler, testers, formatter_tasks)
+    assert scheduler.stages['pytest'].depends == ['multiformatter']
+
+
+def test_jsonl_results_not_kept(tmpdir, tools):
+    """Results written in jsonl output format are not kept in memory."""
+    root = make_repo(tmpdir, modules=2)
+    tmpdir.join('pkg', 'mod_1.py').write('"""Module."""\nx = [1,2]\n')
+    runner = make_runner(root, ['-c', 'yapf', 'flake8'])
+    output = StringIO()
+    runner.writer = JsonLinesWriter(output)
+
+    _, (formatter, files) = runner._create_formatters(
+        REGISTRY.load([MULTI_FORMATTER], runner.check), True)
+    assert runner._run_multi_formatter(formatter, files) == {}
+    (linter, files), = runner._create_linters([Flake8Linter])
+    assert runner._run_linter_batches(linter, files) == []
+
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [r['tool'] for r in records] == ['yapf', 'flake8', 'flake8']
+
+
+def test_watch_drops_fixed_results(tmpdir, tools):
+    """Results of files fixed since the previous check are dropped."""
+    root = make_repo(tmpdir, modules=1)
+    path = os.path.join(root, 'pkg', 'mod_0.py')
+    with open(path, 'w') as file_obj:
+        file_obj.write('"""Module."""\nx = [1,2]\n')
+
+    runner = make_runner(root, ['-c', 'yapf'])
+    runner.run(exit_on_failure=False)
+    assert [r['path'] for r in runner.all_results['yapf']['results']] == [
+        path
+    ]
+
+    runner.run(paths=[path], exit_on_failure=False)
+    assert runner.all_results['yapf']['results'] == []
+
+
+def test_fail_fast_kills_running_linters(tmpdir, monkeypatch, tools):
+    """An enforced failure stops the run and kills other linters."""
+    root = make_repo(tmpdir, modules=2)
+    monkeypatch.setattr(Pep8Linter, 'command',
+                        (sys.executable, '-c', 'import time; time.sleep(60)'))
+    runner = make_runner(
+        root, ['-c', 'pep8', 'flake8', '-e', 'flake8', '-ff', '-j', '2',
+               '--cache'])
+    start = time.time()
+    runner.run(exit_on_failure=False)
+
+    # The pep8 stage is abandoned, it ends once its process is killed
+    stage = runner._scheduler.stages['pep8']
+    while stage.end is None and time.time() - start < 30:
+        time.sleep(0.1)
+
+    assert runner.stopped_by == 'flake8'
+    assert stage.end is not None and stage.end - start < 30
+    assert not stage.result
+
+    # Only flake8 results are cached, killed results are incomplete
+    entries = list(tmpdir.join('.ciocheck_cache').visit('*.json'))
+    assert len(entries) == 4
+
+
+def test_fail_fast_history(tmpdir, tools):
+    """Recently failing tools and files are checked first."""
+    root = make_repo(tmpdir, modules=2)
+    path = os.path.join(root, 'pkg', 'mod_1.py')
+    # Only the second module fails
+    tmpdir.join('pkg', 'mod_0.py').write(
+        '"""Module."""\n\n\ndef f(a):\n    """Return a."""\n    return a\n')
+    args = ['-c', 'pep8', 'flake8', '-e', 'flake8', '-ff', '-j', '1']
+
+    runner = make_runner(root, args)
+    runner.run(exit_on_failure=False)
+    stages = runner._scheduler.stages
+    assert runner.stopped_by == 'flake8'
+    assert stages['pep8'].end <= stages['flake8'].start
+    assert runner.failed_paths == set([path])
+
+    # Not enforced results do not stop the run
+    runner = make_runner(root, ['-c', 'flake8', '-ff'])
+    runner.run(exit_on_failure=False)
+    assert runner.stopped_by is None
+    assert 'flake8' in runner.all_results
+
+    runner = make_runner(root, args)
+    files = runner.file_manager.get_files(file_mode='all', extensions=('py',))
+    assert runner._fail_fast_batches(files)[0] == [path]
+    runner.run(exit_on_failure=False)
+    stages = runner._scheduler.stages
+    assert runner.stopped_by == 'flake8'
+    assert stages['pep8'].start is None
+
+
+def test_stream_matches_stages(tmpdir, tools):
+    """Streamed results are the results of formatter and linter stages."""
+    args = ['-c', 'pyformat', 'isort', 'yapf', 'pep8', 'flake8', '-dt']
+    all_results = []
+    contents = []
+    for name, extra_args in [('stages', []), ('stream', ['-s'])]:
+        root = make_repo(tmpdir.mkdir(name), modules=3)
+        tmpdir.join(name, 'pkg', 'mod_1.py').write('import sys,os\nx=[1,2]\n')
+        runner = make_runner(root, args + extra_args)
+        runner.run(exit_on_failure=False)
+        assert (runner._pipeline is not None) == bool(extra_args)
+
+        results = []
+        for tool_name, data in runner.all_results.items():
+            for result in data['results']:
+                result = dict(result, path=os.path.relpath(result['path'],
+                                                           root))
+                results.append((tool_name, result))
+        all_results.append(results)
+        contents.append(tmpdir.join(name, 'pkg', 'mod_1.py').read())
+
+    assert all_results[0] == all_results[1]
+    assert contents[0] == contents[1]
+    assert [tool for (tool, result) in all_results[0]] == (
+        ['pyformat'] * 6 + ['isort', 'yapf'] + ['flake8'] * 6)
+
+    # Pyformat runs first, other tools see the header it adds
+    assert contents[0].startswith('# -*- coding: utf-8 -*-\n')
+    assert [(r['path'], r['line']) for (tool, r) in all_results[0]
+            if tool == 'flake8' and 'mod_1' in r['path']] == [
+                ('pkg/mod_1.py', '8'), ('pkg/mod_1.py', '9')
+            ]
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test merging shard results."""
+
+# Standard library imports
+import json
+
+# Local imports
+from ciocheck.merge import CoverageIndex, ShardMerger
+
+
+class ListWriter(object):
+    """Writer keeping records in a list."""
+
+    def __init__(self):
+        """Writer keeping records in a list."""
+        self.records = []
+
+    def write(self, record):
+        """Keep record."""
+        self.records.append(record)
+
+
+def shard_summary(index, count=2, files=(), total_files=2, **kwargs):
+    """Return the summary record of a shard checking `files`."""
+    record = {'kind': 'summary', 'failed': [], 'enforced': []}
+    record.update(kwargs)
+    record['shard'] = {
+        'index': index,
+        'count': count,
+        'files': list(files),
+        'total_files': total_files,
+    }
+    return record
+
+
+def write_records(path, records):
+    """Write `records` in json lines file `path`."""
+    path.write('\n'.join(json.dumps(r) for r in records))
+    return str(path)
+
+
+def test_merge(tmpdir):
+    """Verdicts are merged and lines covered by other shards are dropped."""
+    shard_1 = write_records(tmpdir.join('1.jsonl'), [
+        {'kind': 'coverage', 'tool': 'coverage', 'path': 'pkg/a.py',
+         'lines': [1, 2], 'coverage': 50.0, 'changed': 4},
+        shard_summary(1, files=['pkg/a.py'], failed=['pep8']),
+    ])
+    shard_2 = write_records(tmpdir.join('2.jsonl'), [
+        shard_summary(2, files=['pkg/b.py'], failed=['flake8'],
+                      enforced=['flake8']),
+    ])
+    shard_3 = write_records(tmpdir.join('3.jsonl'), [])
+
+    writer = ListWriter()
+    coverage = CoverageIndex({'/other/root/pkg/a.py': [2]})
+    merger = ShardMerger(writer, coverage=coverage)
+    for shard in [shard_1, shard_2]:
+        merger.add_file(shard)
+
+    assert writer.records[0]['lines'] == [1]
+    assert writer.records[0]['coverage'] == 75.0
+    summary = merger.summary()
+    assert summary['failed'] == ['flake8', 'pep8']
+    assert summary['errors'] == []
+    assert not summary['success']
+
+    merger = ShardMerger(writer)
+    merger.add_file(shard_3)
+    assert merger.summary()['incomplete'] == [shard_3]
+
+
+def test_merge_shards(tmpdir):
+    """Every shard must be given once and check its own files."""
+    shard_1 = write_records(
+        tmpdir.join('1.jsonl'), [shard_summary(1, files=['pkg/a.py'])])
+    shard_2 = write_records(
+        tmpdir.join('2.jsonl'), [shard_summary(2, files=['pkg/b.py'])])
+
+    merger = ShardMerger(ListWriter())
+    merger.add_file(shard_1)
+    assert merger.summary()['errors'] == ['Missing shards: 2/2']
+    merger.add_file(shard_1)
+    summary = merger.summary()
+    assert summary['errors'][0].endswith('shard 1 already given by ' +
+                                         shard_1)
+    assert not summary['success']
+
+    merger = ShardMerger(ListWriter())
+    for shard in [shard_1, shard_2]:
+        merger.add_file(shard)
+    assert merger.summary()['success']
+
+    # Shards split files differently, like with different costs
+    other_2 = write_records(
+        tmpdir.join('other-2.jsonl'), [shard_summary(2, files=['pkg/a.py'])])
+    merger = ShardMerger(ListWriter())
+    for shard in [shard_1, other_2]:
+        merger.add_file(shard)
+    assert merger.summary()['errors'] == [
+        other_2 + ': 1 files checked by other shards, like pkg/a.py',
+        'Shards checked 1 files out of 2',
+    ]
+
+    unsharded = write_records(tmpdir.join('all.jsonl'), [
+        {'kind': 'summary', 'failed': [], 'enforced': []},
+    ])
+    merger = ShardMerger(ListWriter())
+    merger.add_file(unsharded)
+    assert merger.summary()['errors'] == [unsharded + ': no shard in summary']
+
+
+def test_merge_coverage_verdict(tmpdir):
+    """Coverage failures of shards are kept once coverage is merged."""
+    shards = []
+    for i, line in enumerate([1, 2]):
+        shards.append(write_records(tmpdir.join('{0}.jsonl'.format(i)), [
+            {'kind': 'coverage', 'tool': 'coverage', 'path': 'pkg/a.py',
+             'lines': [line], 'coverage': 50.0, 'changed': 2},
+            shard_summary(i + 1, files=['pkg/{0}.py'.format(i)],
+                          failed=['coverage', 'pep8'],
+                          enforced=['coverage']),
+        ]))
+
+    # Changed lines are covered by the other shard, but the total coverage
+    # of a shard was below the required one
+    writer = ListWriter()
+    coverage = CoverageIndex({'/root/pkg/a.py': [1, 2]})
+    merger = ShardMerger(writer, coverage=coverage)
+    for shard in shards:
+        merger.add_file(shard)
+    summary = merger.summary()
+    assert writer.records == []
+    assert summary['failed'] == ['coverage', 'pep8']
+    assert summary['enforced'] == ['coverage']
+    assert not summary['success']
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test the tool registry."""
+
+# Third party imports
+import pytest
+
+# Local imports
+from ciocheck.registry import (BUILTIN_TOOLS, FORMATTER, LINTER,
+                               MULTI_FORMATTER, ToolRegistry, ToolSpec)
+
+
+def test_builtin_tools():
+    """Specs match the metadata of the tool classes."""
+    for spec in BUILTIN_TOOLS:
+        tool = spec.load()
+        assert tool.name == spec.name
+        assert tuple(tool.extensions) == spec.extensions
+        assert list(tool.config_sections or []) == spec.config_sections
+
+
+def test_registry():
+    """Tools are selected by kind and name, in registration order."""
+    registry = ToolRegistry(BUILTIN_TOOLS, group=None)
+    assert registry.names([LINTER]) == ['pep8', 'pydocstyle', 'flake8',
+                                        'pylint']
+    assert registry.names([MULTI_FORMATTER]) == ['isort', 'yapf', 'autopep8']
+    tools = registry.load([FORMATTER, MULTI_FORMATTER], ['yapf', 'pyformat'])
+    assert [tool.name for tool in tools] == ['pyformat', 'yapf']
+
+    spec = ToolSpec('custom', LINTER, 'ciocheck.linters:Flake8Linter')
+    registry.add(spec)
+    assert registry.get('custom') is spec
+    with pytest.raises(ValueError):
+        registry.add(spec)
+    with pytest.raises(ValueError):
+        ToolSpec('custom', 'other', 'ciocheck.linters:Flake8Linter')
+
+
+def test_choices_discover_unknown_names():
+    """Plugins are only discovered for names that are not built-in."""
+    registry = ToolRegistry(BUILTIN_TOOLS, group='ciocheck.tests.no_tools')
+    choices = registry.choices()
+    assert 'flake8' in choices
+    assert 'pytest' in list(choices)
+    assert not registry._discovered
+    registry.load([LINTER], ['flake8'])
+    assert not registry._discovered
+
+    assert 'unknown' not in choices
+    assert registry._discovered
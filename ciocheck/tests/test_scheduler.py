@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test stage scheduler."""
+
+# Standard library imports
+import time
+
+# Third party imports
+import pytest
+
+# Local imports
+from ciocheck.scheduler import Scheduler
+
+
+def test_scheduler_dependencies():
+    """Stages start after their dependencies and keep their results."""
+    order = []
+
+    def make_stage(name, delay=0):
+        def stage():
+            time.sleep(delay)
+            order.append(name)
+            return name
+        return stage
+
+    scheduler = Scheduler(jobs=4)
+    scheduler.add_stage('format', make_stage('format', 0.05))
+    scheduler.add_stage('lint', make_stage('lint'), depends=['format'])
+    scheduler.add_stage('test', make_stage('test', 0.1))
+    scheduler.run()
+
+    assert order.index('format') < order.index('lint')
+    assert scheduler.stages['lint'].result == 'lint'
+    path = [stage.name for stage in scheduler.critical_path()]
+    assert path == ['test']
+
+
+def test_scheduler_errors():
+    """Errors are raised and dependent stages are not started."""
+    def fail():
+        raise ValueError('boom')
+
+    scheduler = Scheduler(jobs=2)
+    scheduler.add_stage('format', fail)
+    scheduler.add_stage('lint', lambda: 'lint', depends=['format'])
+    with pytest.raises(ValueError):
+        scheduler.run()
+    assert scheduler.stages['lint'].start is None
+
+    with pytest.raises(ValueError):
+        scheduler.add_stage('test', lambda: None, depends=['unknown'])
+
+
+def test_scheduler_cancel():
+    """Cancelling returns once the cancelling stage is done."""
+    order = []
+    scheduler = Scheduler(jobs=1)
+
+    def fail_fast():
+        order.append('lint')
+        scheduler.cancel(after='lint')
+
+    scheduler.add_stage('test', lambda: order.append('test'))
+    scheduler.add_stage('lint', fail_fast, priority=1)
+    scheduler.run()
+
+    assert order == ['lint']
+    assert scheduler.stages['test'].start is None
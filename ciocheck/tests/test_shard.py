@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test file sharding."""
+
+# Third party imports
+import pytest
+
+# Local imports
+from ciocheck.shard import FileCosts, parse_shard, partition
+
+
+def test_parse_shard():
+    """Shards are numbered from 1."""
+    assert parse_shard('2/3') == (2, 3)
+    for value in ['0/3', '4/3', '3', 'a/b']:
+        with pytest.raises(ValueError):
+            parse_shard(value)
+
+
+def test_partition(tmpdir):
+    """Expensive files are spread and every file is in a single shard."""
+    paths = []
+    for name in 'abcdef':
+        path = tmpdir.join(name + '.py')
+        path.write('x = 1\n')
+        paths.append(str(path))
+
+    costs = FileCosts()
+    costs.enable(str(tmpdir))
+    costs.add(paths[:2], 10.0)
+    costs.save()
+
+    shards = partition(paths, 2, costs=costs)
+    assert sorted(shards[0] + shards[1]) == paths
+    assert paths[0] in shards[0]
+    assert paths[1] in shards[1]
+    assert partition(list(reversed(paths)), 2, costs=costs) == shards
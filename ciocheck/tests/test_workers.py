@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# May be copied and distributed freely only as part of an Anaconda or
+# Miniconda installation.
+# -----------------------------------------------------------------------------
+"""Test the formatter worker pool."""
+
+# Standard library imports
+import json
+import os
+
+# Local imports
+from ciocheck import workers
+from ciocheck.config import FORMAT_COSTS_FILE
+from ciocheck.workers import (FORMAT_COSTS, FormatterPool, FormatterWorker,
+                              make_batches)
+
+
+def test_pool_recycles_workers(tmpdir):
+    """All batches are formatted when workers are replaced after each one."""
+    root = str(tmpdir)
+    paths = []
+    for index in range(4):
+        path = os.path.join(root, 'module_{0}.py'.format(index))
+        with open(path, 'w') as file_obj:
+            file_obj.write('x = 1\n')
+        paths.append(path)
+
+    batches = [paths[:2], paths[2:3], paths[3:]]
+    pool = FormatterPool(root, [], workers=2, max_tasks=1)
+    done = list(pool.iter_run(batches))
+    assert sorted(paths for (paths, results) in done) == [[p] for p in paths]
+    assert all(results == [{}] for (paths, results) in done)
+    assert not pool._running
+
+
+def test_make_batches(tmpdir):
+    """Large files are formatted alone and first, small ones are grouped."""
+    root = str(tmpdir)
+    paths = []
+    for index in range(8):
+        path = os.path.join(root, 'module_{0}.py'.format(index))
+        with open(path, 'w') as file_obj:
+            file_obj.write('x = 1\n')
+        paths.append(path)
+    large_path = os.path.join(root, 'large.py')
+    with open(large_path, 'w') as file_obj:
+        file_obj.write('x = 1\n' * 1000)
+
+    batches = make_batches(paths + [large_path], workers=2)
+    assert batches[0] == [large_path]
+    assert sorted(sum(batches, [])) == sorted(paths + [large_path])
+    assert len(batches) < len(paths)
+
+
+def test_pool_skips_slow_files(tmpdir):
+    """Files over the timeout are skipped, the rest of the batch is kept."""
+    root = str(tmpdir)
+    paths = []
+    for index in range(3):
+        path = os.path.join(root, 'module_{0}.py'.format(index))
+        with open(path, 'w') as file_obj:
+            file_obj.write('x = [1,2]\n' * 2000)
+        paths.append(path)
+
+    # Formatting thousands of lines takes longer, so every file times out
+    pool = FormatterPool(root, ['autopep8'], workers=1, timeout=0.001)
+    done = list(pool.iter_run([paths]))
+    assert sorted(paths for (paths, results) in done) == [[p] for p in paths]
+    for (batch, results) in done:
+        result = results[0]['multiformatter']
+        assert result['path'] == batch[0]
+        assert result['skipped'] == 'timed out after 0.001 seconds'
+    assert not pool._running
+
+
+CRASHING_TASK = """
+import os
+import sys
+
+sys.path.insert(0, {root!r})
+from ciocheck import format_task
+
+format_file = format_task.format_file
+
+
+def crashing_format_file(path, *args, **kwargs):
+    if os.path.basename(path).startswith('crash'):
+        os._exit(3)
+    return format_file(path, *args, **kwargs)
+
+
+format_task.format_file = crashing_format_file
+format_task.main()
+"""
+
+
+def test_pool_skips_crashing_files(tmpdir, monkeypatch):
+    """A file crashing its worker is skipped, the rest of the batch is kept."""
+    task_path = tmpdir.join('crashing_task.py')
+    package_root = os.path.dirname(os.path.dirname(workers.__file__))
+    task_path.write(CRASHING_TASK.format(root=package_root))
+    monkeypatch.setattr(workers, 'FORMAT_TASK', str(task_path))
+
+    root = str(tmpdir)
+    paths = []
+    for name in ['module_0.py', 'crash.py', 'module_1.py']:
+        path = os.path.join(root, name)
+        with open(path, 'w') as file_obj:
+            file_obj.write('import sys\nimport os\n')
+        paths.append(path)
+
+    pool = FormatterPool(root, ['isort'], workers=1)
+    done = list(pool.iter_run([paths]))
+    results = dict((batch[0], results[0]) for (batch, results) in done)
+    assert sorted(results) == sorted(paths)
+    skipped = results[paths[1]]['multiformatter']['skipped']
+    assert skipped == ('crashed the formatter worker (Formatter worker '
+                       'exited with code 3)')
+    for path in [paths[0], paths[2]]:
+        assert results[path]['isort']['diff']
+        with open(path) as file_obj:
+            assert file_obj.read() == 'import os\nimport sys\n'
+    assert not pool._running
+
+
+FAILING_START_TASK = """
+import os
+import sys
+
+sys.path.insert(0, {root!r})
+from ciocheck import format_task
+
+# Only the first worker fails to start
+marker_path = {marker!r}
+if not os.path.exists(marker_path):
+    open(marker_path, 'w').close()
+    sys.exit(2)
+format_task.main()
+"""
+
+
+def test_pool_reports_failed_batches(tmpdir, monkeypatch):
+    """A batch whose worker can not start fails alone, others are kept."""
+    task_path = tmpdir.join('failing_start_task.py')
+    package_root = os.path.dirname(os.path.dirname(workers.__file__))
+    task_path.write(FAILING_START_TASK.format(
+        root=package_root, marker=str(tmpdir.join('started'))))
+    monkeypatch.setattr(workers, 'FORMAT_TASK', str(task_path))
+
+    root = str(tmpdir)
+    paths = []
+    for index in range(2):
+        path = os.path.join(root, 'module_{0}.py'.format(index))
+        with open(path, 'w') as file_obj:
+            file_obj.write('import sys\nimport os\n')
+        paths.append(path)
+
+    pool = FormatterPool(root, ['isort'], workers=1)
+    done = list(pool.iter_run([paths[:1], paths[1:]]))
+    results = dict((batch[0], results[0]) for (batch, results) in done)
+    skipped = results[paths[0]]['multiformatter']['skipped']
+    assert skipped == ('formatter worker failed to start (Formatter worker '
+                       'exited with code 2)')
+    assert results[paths[1]]['isort']['diff']
+    assert not pool._running
+
+
+def test_pool_records_format_costs(tmpdir):
+    """Formatting time of each file is recorded once workers are ready."""
+    root = str(tmpdir)
+    worker = FormatterWorker(root, [])
+    worker.wait_ready()
+    assert worker.ready
+    worker.close()
+
+    paths = []
+    for index in range(2):
+        path = os.path.join(root, 'module_{0}.py'.format(index))
+        with open(path, 'w') as file_obj:
+            file_obj.write('x = 1\n')
+        paths.append(path)
+
+    FORMAT_COSTS.enable(root, FORMAT_COSTS_FILE)
+    try:
+        list(FormatterPool(root, ['autopep8']).iter_run([paths]))
+        FORMAT_COSTS.save()
+    finally:
+        FORMAT_COSTS.read(root, FORMAT_COSTS_FILE)
+
+    with open(os.path.join(root, FORMAT_COSTS_FILE)) as file_obj:
+        costs = json.load(file_obj)
+    assert sorted(costs) == ['module_0.py', 'module_1.py']
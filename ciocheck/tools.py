@@ -10,18 +10,47 @@
 # Standard library imports
 from collections import OrderedDict
 import ast
+import hashlib
+import importlib
 import json
 import os
+import subprocess
+import sys
 
 # Third party imports
-from pytest_cov.plugin import CoverageError
 from six import PY2
 from six.moves import configparser
-import pytest
 
 # Local imports
 from ciocheck.config import COVERAGE_CONFIGURATION_FILE
-from ciocheck.utils import ShortOutput, cpu_count
+from ciocheck.utils import (cpu_count, end_process, read_coverage,
+                            start_process)
+
+# Versions of tool modules, found once per process
+_VERSIONS = {}
+
+
+def _installed_version(module_name):
+    """
+    Return the version of `module_name`, or '' if it is not installed.
+
+    The version is read from the package metadata when the distribution has
+    the name of the module, to avoid importing slow to import tools.
+    """
+    try:
+        from importlib.metadata import PackageNotFoundError, version
+        try:
+            return version(module_name)
+        except PackageNotFoundError:
+            pass
+    except ImportError:
+        pass
+
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError:
+        return ''
+    return str(getattr(module, '__version__', ''))
 
 
 class Tool(object):
@@ -33,6 +62,10 @@ class Tool(object):
 
     command = None
 
+    # Python module providing the tool, used to find its version. Defaults to
+    # the tool name.
+    module = None
+
     # Config
     config_file = None  # '.validconfigfilename'
     config_sections = None  # (('ciocheck:section', 'section'))
@@ -93,6 +126,25 @@ class Tool(object):
 
         return config_options
 
+    @classmethod
+    def get_version(cls):
+        """Return the version of the python module providing the tool."""
+        module_name = cls.module or cls.name
+        if module_name not in _VERSIONS:
+            _VERSIONS[module_name] = _installed_version(module_name)
+        return _VERSIONS[module_name]
+
+    @classmethod
+    def get_config_hash(cls, cmd_root):
+        """Return a hash of the config file created by `create_config`."""
+        config_hash = hashlib.sha1()
+        if cls.config_file:
+            config_path = os.path.join(cmd_root, cls.config_file)
+            if os.path.isfile(config_path):
+                with open(config_path, 'rb') as file_obj:
+                    config_hash.update(file_obj.read())
+        return config_hash.hexdigest()
+
     @classmethod
     def remove_config(cls, path):
         """Remove config file."""
@@ -203,24 +255,42 @@ class PytestTool(Tool):
         self.pytest_args = self.pytest_args + coverage_args
 
     def run(self, paths):
-        """Run pytest test suite."""
+        """
+        Run pytest test suite.
+
+        Pytest runs in a subprocess, so capturing the test output does not
+        capture the output of other stages running at the same time.
+        """
         cmd = paths + self.pytest_args
         print(cmd)
 
+        process = start_process(
+            [sys.executable, '-m', 'pytest'] + cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=self.cmd_root)
         try:
-            with ShortOutput(self.cmd_root) as so:
-                errno = pytest.main(cmd)
-            output_lines = ''.join(so.output).lower()
-
-            if 'FAIL Required test coverage'.lower() in output_lines:
-                self.coverage_fail = True
-
-            if errno != 0:
-                print("pytest failed, code {errno}".format(errno=errno))
-        except CoverageError as e:
-            print("Test coverage failure: " + str(e))
+            output, error = process.communicate()
+        finally:
+            end_process(process)
+        if isinstance(output, bytes):
+            output = output.decode('utf-8', 'replace')
+            error = error.decode('utf-8', 'replace')
+        # Printed like the output of pytest running in this process
+        for line in output.splitlines() + error.splitlines():
+            print(line)
+        output += error
+
+        # Older pytest-cov versions raise a CoverageError instead
+        output_lines = output.lower()
+        if ('FAIL Required test coverage'.lower() in output_lines or
+                'CoverageError'.lower() in output_lines):
             self.coverage_fail = True
 
+        errno = process.returncode
+        if errno != 0:
+            print("pytest failed, code {errno}".format(errno=errno))
+
         covered_lines = self.parse_coverage()
         pytest_report = self.parse_pytest_report()
 
@@ -240,22 +310,8 @@ class PytestTool(Tool):
 
     def parse_coverage(self):
         """Parse .coverage json report generated by coverage."""
-        coverage_string = ("!coverage.py: This is a private format, don't "
-                           "read it directly!")
         coverage_path = os.path.join(self.cmd_root, '.coverage')
-
-        covered_lines = {}
-        if os.path.isfile(coverage_path):
-            with open(coverage_path, 'r') as file_obj:
-                data = file_obj.read()
-                data = data.replace(coverage_string, '')
-
-            cov = json.loads(data)
-            covered_lines = OrderedDict()
-            lines = cov['lines']
-            for path in sorted(lines):
-                covered_lines[path] = lines[path]
-        return covered_lines
+        return read_coverage(coverage_path)
 
     @classmethod
     def remove_config(cls, path):
@@ -266,12 +322,6 @@ class PytestTool(Tool):
             os.remove(remove_file)
 
 
-TOOLS = [
-    CoverageTool,
-    PytestTool,
-]
-
-
 def test():
     """Main local test."""
     pass
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""
+Timing trace of a ciocheck run in the Chrome trace event format.
+
+Traces can be opened with chrome://tracing or https://ui.perfetto.dev.
+"""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+import json
+import os
+import threading
+import time
+
+
+def cpu_time():
+    """Return the cpu time of this process and its finished children."""
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+
+class Span(object):
+    """Context manager recording a complete trace event."""
+
+    def __init__(self, tracer, name, category, args):
+        """Context manager recording a complete trace event.
+
+        Values added to `args` before the span ends, like file counts, are
+        stored with the event.
+        """
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self._start = None
+        self._cpu_start = None
+
+    def __enter__(self):
+        """Start timing."""
+        self._start = time.time()
+        self._cpu_start = cpu_time()
+        return self
+
+    def __exit__(self, *args):
+        """Stop timing and record the event."""
+        self.args['cpu'] = round(cpu_time() - self._cpu_start, 6)
+        self.tracer.add_event(self.name, self.category, self._start,
+                              time.time(), self.args)
+
+
+class Tracer(object):
+    """Collect trace events from all threads of a run."""
+
+    def __init__(self):
+        """Collect trace events from all threads of a run."""
+        self.enabled = False
+        self.events = []
+        self._thread_ids = {}
+        self._lock = threading.Lock()
+
+    def enable(self):
+        """Start collecting events."""
+        self.enabled = True
+        self.events = []
+        self._thread_ids = {}
+
+    def disable(self):
+        """Stop collecting events, once saved."""
+        self.enabled = False
+        self.events = []
+        self._thread_ids = {}
+
+    def _thread_id(self):
+        """Return a small id for the current thread, naming it on first use."""
+        thread = threading.current_thread()
+        # Idents of finished threads are reused, names are unique
+        key = (thread.ident, thread.name)
+        if key not in self._thread_ids:
+            tid = len(self._thread_ids) + 1
+            self._thread_ids[key] = tid
+            self.events.append({
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': os.getpid(),
+                'tid': tid,
+                'args': {'name': thread.name},
+            })
+        return self._thread_ids[key]
+
+    def span(self, name, category='ciocheck', **args):
+        """
+        Return a context manager recording `name` when enabled.
+
+        Keyword arguments are stored as event arguments. CPU time is measured
+        for the whole process, including subprocesses that finished during
+        the span, so it is shared by spans running at the same time.
+        """
+        return Span(self, name, category, args)
+
+    def add_event(self, name, category, start, end, args=None):
+        """Record a complete event from `start` to `end` in seconds."""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self.events.append({
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': int(start * 1e6),
+                'dur': int((end - start) * 1e6),
+                'pid': os.getpid(),
+                'tid': self._thread_id(),
+                'args': args or {},
+            })
+
+    def add_counter(self, name, values, category='ciocheck'):
+        """Record the counter `name` with a dict of numeric `values` now."""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self.events.append({
+                'name': name,
+                'cat': category,
+                'ph': 'C',
+                'ts': int(time.time() * 1e6),
+                'pid': os.getpid(),
+                'args': dict(values),
+            })
+
+    def save(self, path):
+        """Write collected events to `path`."""
+        with self._lock:
+            data = {'traceEvents': self.events, 'displayTimeUnit': 'ms'}
+        with open(path, 'w') as file_obj:
+            json.dump(data, file_obj, indent=1)
+
+
+# Shared by all modules, only records events once enabled
+TRACER = Tracer()
@@ -16,18 +16,22 @@ import codecs
 import cProfile
 import difflib
 import errno
+import json
 import os
 import pstats
 import subprocess
 import sys
+import threading
 import uuid
 
-# Third party imports
-from six.moves import cStringIO as StringIO
-
 # Local imports
 from ciocheck.config import DEFAULT_IGNORE_EXTENSIONS, DEFAULT_IGNORE_FOLDERS
 
+# Running subprocesses, tracked so they can be killed when stopping early
+_PROCESSES = set()
+_PROCESSES_LOCK = threading.Lock()
+_PROCESSES_STATE = {'killed': False}
+
 
 class Profiler(object):
     """Context manager profiler."""
@@ -48,53 +52,71 @@ class Profiler(object):
         profile_stat.print_stats()
 
 
-class ShortOutput(object):
-    """Context manager for capturing and formating stdout and stderr."""
+def _kill_process(process):
+    """Kill `process` if it is still running."""
+    try:
+        process.kill()
+    except OSError:
+        # Already finished
+        pass
+
 
-    def __init__(self, root):
-        """Context manager for capturing and formating stdout and stderr.
+def start_process(args, **kwargs):
+    """
+    Start a subprocess that is killed by `kill_processes`.
 
-        Parameter
-        ---------
-        root : str
-            Path where ciocheck script was called (root directory).
-        """
-        self._root = root
-        self._stdout = None
-        self._stderr = None
-        self._stringio_output = None
-        self._stringio_error = None
+    Keyword arguments are passed to `subprocess.Popen`. Call `end_process`
+    once the process finished.
+    """
+    process = subprocess.Popen(args, **kwargs)
+    with _PROCESSES_LOCK:
+        _PROCESSES.add(process)
+        killed = _PROCESSES_STATE['killed']
 
-    def __enter__(self):
-        """Capture stdout and stderr in a StringIO."""
-        self._stdout = sys.stdout
-        self._stderr = sys.stderr
-        sys.stdout = self._stringio_output = StringIO()
-        sys.stderr = self._stringio_error = StringIO()
-        return self
-
-    def __exit__(self, *args):
-        """Restore stdout and stderr and format found values."""
-        out = self._stringio_output.getvalue().splitlines()
-        err = self._stringio_error.getvalue().splitlines()
-        sys.stdout = self._stdout
-        sys.stderr = self._stderr
-
-        self.output = out
-        self.error = err
-        for output in [out, err]:
-            for line in output:
-                print(line)
+    if killed:
+        _kill_process(process)
+    return process
+
+
+def end_process(process):
+    """Stop tracking a process started with `start_process`."""
+    with _PROCESSES_LOCK:
+        _PROCESSES.discard(process)
+
+
+def kill_processes():
+    """Kill running subprocesses and any subprocess started afterwards."""
+    with _PROCESSES_LOCK:
+        _PROCESSES_STATE['killed'] = True
+        processes = list(_PROCESSES)
+
+    for process in processes:
+        _kill_process(process)
+
+
+def processes_killed():
+    """Return True if subprocesses were killed by `kill_processes`."""
+    with _PROCESSES_LOCK:
+        return _PROCESSES_STATE['killed']
+
+
+def allow_processes():
+    """Let subprocesses run again after a call to `kill_processes`."""
+    with _PROCESSES_LOCK:
+        _PROCESSES_STATE['killed'] = False
 
 
 def run_command(args, cwd=None):
     """Run command."""
-    process = subprocess.Popen(
+    process = start_process(
         args,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
         cwd=cwd, )
-    output, error = process.communicate()
+    try:
+        output, error = process.communicate()
+    finally:
+        end_process(process)
 
     if isinstance(output, bytes):
         output = output.decode()
@@ -161,6 +183,14 @@ def filter_files(files, extensions):
     return copy_of_files
 
 
+def filter_paths(files, paths):
+    """Return the part of `files` (list or dict) found in `paths`."""
+    if isinstance(files, dict):
+        return OrderedDict((p, files[p]) for p in paths if p in files)
+    files = set(files)
+    return [p for p in paths if p in files]
+
+
 def _rename_over_existing(src, dest):
     try:
         # On Windows, this will throw EEXIST, on Linux it won't.
@@ -209,6 +239,47 @@ def diff(string_a, string_b):
     return ''.join(result)
 
 
+def to_line_ranges(lines):
+    """Return sorted line numbers as a list of `(start, end)` ranges."""
+    ranges = []
+    for line in sorted(set(lines)):
+        if ranges and ranges[-1][1] == line - 1:
+            ranges[-1] = (ranges[-1][0], line)
+        else:
+            ranges.append((line, line))
+    return ranges
+
+
+def remap_line_ranges(old_contents, new_contents, line_ranges):
+    """
+    Return `line_ranges` of `old_contents` moved to `new_contents`.
+
+    Lines replaced or inserted next to lines in the ranges are part of the
+    new ranges, so formatting a range does not leave its changes out.
+    """
+    selected = set()
+    for start, end in line_ranges:
+        selected.update(range(start - 1, end))
+
+    matcher = difflib.SequenceMatcher(
+        None,
+        old_contents.splitlines(True),
+        new_contents.splitlines(True),
+        autojunk=False)
+    new_lines = set()
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            new_lines.update(j1 + i - i1 for i in range(i1, i2)
+                             if i in selected)
+            continue
+
+        # Insertions touch the lines around them
+        touched = range(i1, i2) if tag != 'insert' else range(i1 - 1, i1 + 1)
+        if selected.intersection(touched):
+            new_lines.update(range(j1, j2))
+    return to_line_ranges(line + 1 for line in new_lines)
+
+
 def cpu_count():
     """Return the cpu count."""
     try:
@@ -220,6 +291,48 @@ def cpu_count():
     return count
 
 
+def max_rss():
+    """Return the peak memory of this process in megabytes, or None."""
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # Bytes on macOS, kilobytes elsewhere
+        return max_rss / (1024.0 * 1024)
+    return max_rss / 1024.0
+
+
+# Prefix of the json coverage data files written by coverage.py
+COVERAGE_DATA_HEADER = ("!coverage.py: This is a private format, don't read "
+                        "it directly!")
+
+
+def read_coverage(path):
+    """Return an ordered dict of path: covered lines from coverage data."""
+    covered_lines = {}
+    if os.path.isfile(path):
+        with open(path, 'r') as file_obj:
+            data = file_obj.read()
+            data = data.replace(COVERAGE_DATA_HEADER, '')
+
+        cov = json.loads(data)
+        covered_lines = OrderedDict()
+        lines = cov['lines']
+        for file_path in sorted(lines):
+            covered_lines[file_path] = lines[file_path]
+    return covered_lines
+
+
+def write_coverage(path, covered_lines):
+    """Write `covered_lines` in the coverage data format read above."""
+    data = json.dumps({'lines': covered_lines}, sort_keys=True)
+    atomic_replace(path, COVERAGE_DATA_HEADER + data, 'utf-8')
+
+
 def make_sorted_dict(dic):
     """Turn a dict into an ordered dict by sorting the keys."""
     ordered_results = OrderedDict()
@@ -31,27 +31,27 @@ class DiffToolBase(object):
         """Return if it is a repo of the type."""
         raise NotImplementedError
 
-    def commited_files(self, branch=DEFAULT_BRANCH):
+    def commited_files(self, branch=DEFAULT_BRANCH, paths=None):
         """Return list of committed files."""
         raise NotImplementedError
 
-    def staged_files(self):
+    def staged_files(self, paths=None):
         """Return list of staged files."""
         raise NotImplementedError
 
-    def unstaged_files(self):
+    def unstaged_files(self, paths=None):
         """Return list of unstaged files."""
         raise NotImplementedError
 
-    def commited_file_lines(self, branch=DEFAULT_BRANCH):
+    def commited_file_lines(self, branch=DEFAULT_BRANCH, paths=None):
         """Return committed files and lines modified."""
         raise NotImplementedError
 
-    def staged_file_lines(self):
+    def staged_file_lines(self, paths=None):
         """Return unstaged files and lines modified."""
         raise NotImplementedError
 
-    def unstaged_file_lines(self):
+    def unstaged_file_lines(self, paths=None):
         """Return staged files and lines modified."""
         raise NotImplementedError
 
@@ -73,27 +73,27 @@ class HgDiffTool(DiffToolBase):
         """Return if it is a repo of the type."""
         return False
 
-    def commited_files(self, branch=DEFAULT_BRANCH):
+    def commited_files(self, branch=DEFAULT_BRANCH, paths=None):
         """Return list of committed files."""
         return []
 
-    def staged_files(self):
+    def staged_files(self, paths=None):
         """Return list of staged files."""
         return []
 
-    def unstaged_files(self):
+    def unstaged_files(self, paths=None):
         """Return list of unstaged files."""
         return []
 
-    def commited_file_lines(self, branch=DEFAULT_BRANCH):
+    def commited_file_lines(self, branch=DEFAULT_BRANCH, paths=None):
         """Return committed files and lines modified."""
         return {}
 
-    def staged_file_lines(self):
+    def staged_file_lines(self, paths=None):
         """Return unstaged files and lines modified."""
         return {}
 
-    def unstaged_file_lines(self):
+    def unstaged_file_lines(self, paths=None):
         """Return staged files and lines modified."""
         return {}
 
@@ -115,8 +115,13 @@ class GitDiffTool(DiffToolBase):
     def _git_run_helper(self,
                         branch=DEFAULT_BRANCH,
                         files_only=False,
-                        mode=None):
-        """Build git diff command to generate different types of diffs."""
+                        mode=None,
+                        paths=None):
+        """
+        Build git diff command to generate different types of diffs.
+
+        If `paths` is given, the diff is limited to those paths.
+        """
         command = [
             'git',
             '-c',
@@ -141,6 +146,10 @@ class GitDiffTool(DiffToolBase):
                 '-z',  # Means nul-separated names
             ]
 
+        if paths is not None:
+            command += ['--'] + list(paths)
+
+        if files_only:
             output, error = run_command(command, cwd=self.path)
             print(error)
             result = set(output.split('\x00'))
@@ -358,20 +367,22 @@ class GitDiffTool(DiffToolBase):
             msg = "Could not parse hunk in line '{0}'".format(line)
             raise Exception(msg)
 
-    def _diff_committed(self, branch='origin/master'):
+    def _diff_committed(self, branch='origin/master', paths=None):
         """Return changes for committed files."""
         result = self._git_run_helper(
-            branch=branch, files_only=False, mode=COMMITED_MODE)
+            branch=branch, files_only=False, mode=COMMITED_MODE, paths=paths)
         return result
 
-    def _diff_staged(self):
+    def _diff_staged(self, paths=None):
         """Return diff for staged changes."""
-        result = self._git_run_helper(files_only=False, mode=STAGED_MODE)
+        result = self._git_run_helper(
+            files_only=False, mode=STAGED_MODE, paths=paths)
         return result
 
-    def _diff_unstaged(self):
+    def _diff_unstaged(self, paths=None):
         """Return diff for unstaged changes."""
-        result = self._git_run_helper(files_only=False, mode=UNSTAGED_MODE)
+        result = self._git_run_helper(
+            files_only=False, mode=UNSTAGED_MODE, paths=paths)
         return result
 
     # --- Public API
@@ -402,35 +413,38 @@ class GitDiffTool(DiffToolBase):
                 self._top_level = output.split('\n')[0]
         return self._top_level
 
-    def commited_files(self, branch=DEFAULT_BRANCH):
+    def commited_files(self, branch=DEFAULT_BRANCH, paths=None):
         """Return list of committed files."""
         result = self._git_run_helper(
-            branch=branch, files_only=True, mode=COMMITED_MODE)
+            branch=branch, files_only=True, mode=COMMITED_MODE, paths=paths)
         return result
 
-    def staged_files(self):
+    def staged_files(self, paths=None):
         """Return list of staged files."""
-        result = self._git_run_helper(files_only=True, mode=STAGED_MODE)
+        result = self._git_run_helper(
+            files_only=True, mode=STAGED_MODE, paths=paths)
         return result
 
-    def unstaged_files(self):
+    def unstaged_files(self, paths=None):
         """Return list of unstaged files."""
-        result = self._git_run_helper(files_only=True, mode=UNSTAGED_MODE)
+        result = self._git_run_helper(
+            files_only=True, mode=UNSTAGED_MODE, paths=paths)
         return result
 
-    def commited_file_lines(self, branch=DEFAULT_BRANCH):
+    def commited_file_lines(self, branch=DEFAULT_BRANCH, paths=None):
         """Return committed files and lines modified."""
-        result = self._parse_diff_str(self._diff_committed(branch=branch))
+        result = self._parse_diff_str(
+            self._diff_committed(branch=branch, paths=paths))
         return result
 
-    def staged_file_lines(self):
+    def staged_file_lines(self, paths=None):
         """Return unstaged files and lines modified."""
-        result = self._parse_diff_str(self._diff_staged())
+        result = self._parse_diff_str(self._diff_staged(paths=paths))
         return result
 
-    def unstaged_file_lines(self):
+    def unstaged_file_lines(self, paths=None):
         """Return staged files and lines modified."""
-        result = self._parse_diff_str(self._diff_unstaged())
+        result = self._parse_diff_str(self._diff_unstaged(paths=paths))
         return result
 
 
@@ -441,8 +455,15 @@ class NoDiffTool(DiffToolBase):
         """Thin wrapper for a folder not under version control."""
         self.path = path
 
-    def _get_files_helper(self, lines=False):
-        paths = get_files(paths=[self.path])
+    def _get_files_helper(self, lines=False, paths=None):
+        if paths is None:
+            paths = [self.path]
+        else:
+            paths = [
+                p for p in paths
+                if p.startswith(self.path) and os.path.isfile(p)
+            ]
+        paths = get_files(paths=paths)
         if lines:
             paths_dic = {}
             for path in paths:
@@ -465,29 +486,29 @@ class NoDiffTool(DiffToolBase):
         """Return always True as this handles folders not under VC."""
         return True
 
-    def commited_files(self, branch=DEFAULT_BRANCH):
+    def commited_files(self, branch=DEFAULT_BRANCH, paths=None):
         """Return list of committed files."""
-        return self._get_files_helper()
+        return self._get_files_helper(paths=paths)
 
-    def staged_files(self):
+    def staged_files(self, paths=None):
         """Return list of staged files."""
-        return self._get_files_helper()
+        return self._get_files_helper(paths=paths)
 
-    def unstaged_files(self):
+    def unstaged_files(self, paths=None):
         """Return list of unstaged files."""
-        return self._get_files_helper()
+        return self._get_files_helper(paths=paths)
 
-    def commited_file_lines(self, branch=DEFAULT_BRANCH):
+    def commited_file_lines(self, branch=DEFAULT_BRANCH, paths=None):
         """Return committed files and lines modified."""
-        return self._get_files_helper(lines=True)
+        return self._get_files_helper(lines=True, paths=paths)
 
-    def staged_file_lines(self):
+    def staged_file_lines(self, paths=None):
         """Return unstaged files and lines modified."""
-        return self._get_files_helper(lines=True)
+        return self._get_files_helper(lines=True, paths=paths)
 
-    def unstaged_file_lines(self):
+    def unstaged_file_lines(self, paths=None):
         """Return staged files and lines modified."""
-        return self._get_files_helper(lines=True)
+        return self._get_files_helper(lines=True, paths=paths)
 
 
 class DiffTool(object):
@@ -512,48 +533,66 @@ class DiffTool(object):
                         self.diff_tools[tool.top_level] = tool
                     break
 
+    @staticmethod
+    def _tool_paths(diff_tool, paths):
+        """Return the subset of `paths` handled by `diff_tool`."""
+        if paths is None:
+            return None
+        top_level = diff_tool.top_level
+        return [p for p in paths if p.startswith(top_level)]
+
+    def _iter_tools(self, paths):
+        """Yield `(diff_tool, tool_paths)` for tools with paths to check."""
+        for diff_tool in self.diff_tools.values():
+            tool_paths = self._tool_paths(diff_tool, paths)
+            # An empty list of paths would mean the whole repository
+            if tool_paths is None or tool_paths:
+                yield diff_tool, tool_paths
+
     # --- Public API
     # -------------------------------------------------------------------------
-    def commited_files(self, branch=DEFAULT_BRANCH):
+    def commited_files(self, branch=DEFAULT_BRANCH, paths=None):
         """Return list of committed files."""
         results = []
-        for diff_tool in self.diff_tools.values():
-            results += diff_tool.commited_files(branch=branch)
+        for diff_tool, tool_paths in self._iter_tools(paths):
+            results += diff_tool.commited_files(
+                branch=branch, paths=tool_paths)
         return list(sorted(results))
 
-    def staged_files(self):
+    def staged_files(self, paths=None):
         """Return list of staged files."""
         results = []
-        for diff_tool in self.diff_tools.values():
-            results += diff_tool.staged_files()
+        for diff_tool, tool_paths in self._iter_tools(paths):
+            results += diff_tool.staged_files(paths=tool_paths)
         return list(sorted(results))
 
-    def unstaged_files(self):
+    def unstaged_files(self, paths=None):
         """Return list of unstaged files."""
         results = []
-        for diff_tool in self.diff_tools.values():
-            results += diff_tool.unstaged_files()
+        for diff_tool, tool_paths in self._iter_tools(paths):
+            results += diff_tool.unstaged_files(paths=tool_paths)
         return list(sorted(results))
 
-    def commited_file_lines(self, branch=DEFAULT_BRANCH):
+    def commited_file_lines(self, branch=DEFAULT_BRANCH, paths=None):
         """Return committed files and lines modified."""
         results = {}
-        for diff_tool in self.diff_tools.values():
-            results.update(diff_tool.commited_file_lines(branch=branch))
+        for diff_tool, tool_paths in self._iter_tools(paths):
+            results.update(
+                diff_tool.commited_file_lines(branch=branch, paths=tool_paths))
         return make_sorted_dict(results)
 
-    def staged_file_lines(self):
+    def staged_file_lines(self, paths=None):
         """Return unstaged files and lines modified."""
         results = {}
-        for diff_tool in self.diff_tools.values():
-            results.update(diff_tool.staged_file_lines())
+        for diff_tool, tool_paths in self._iter_tools(paths):
+            results.update(diff_tool.staged_file_lines(paths=tool_paths))
         return make_sorted_dict(results)
 
-    def unstaged_file_lines(self):
+    def unstaged_file_lines(self, paths=None):
         """Return staged files and lines modified."""
         results = {}
-        for diff_tool in self.diff_tools.values():
-            results.update(diff_tool.unstaged_file_lines())
+        for diff_tool, tool_paths in self._iter_tools(paths):
+            results.update(diff_tool.unstaged_file_lines(paths=tool_paths))
         return make_sorted_dict(results)
 
 
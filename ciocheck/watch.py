@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""Watch folders and files for changes."""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+import os
+import time
+
+# Local imports
+from ciocheck.utils import get_files
+
+
+class FileWatcher(object):
+    """
+    Detect added, modified and removed files by polling.
+
+    Polling file stats only uses the standard library and works the same on
+    every platform, at the cost of walking the watched folders each poll.
+    """
+
+    def __init__(self, paths, interval=0.5, debounce=0.5):
+        """Detect added, modified and removed files by polling.
+
+        Parameters
+        ----------
+        paths : list of str
+            Folders and files to watch.
+        interval : float
+            Seconds between two polls.
+        debounce : float
+            Seconds without changes to wait before reporting a burst of
+            changes.
+        """
+        self.paths = paths
+        self.interval = interval
+        self.debounce = debounce
+        self.stats = {}
+
+    def _stat_files(self):
+        """Return a dict of path: (modification time, size)."""
+        stats = {}
+        for path in get_files(paths=self.paths):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            stats[path] = (stat.st_mtime, stat.st_size)
+        return stats
+
+    def snapshot(self):
+        """Take the current state as reference, ignoring previous changes."""
+        self.stats = self._stat_files()
+
+    def poll(self):
+        """Return the set of paths changed since the last poll."""
+        stats = self._stat_files()
+        changed = set()
+        for path in set(stats) | set(self.stats):
+            if stats.get(path) != self.stats.get(path):
+                changed.add(path)
+        self.stats = stats
+        return changed
+
+    def wait_for_changes(self):
+        """Block until files change and return the changed paths.
+
+        Changes are accumulated until no new change is seen for `debounce`
+        seconds, so saving several files at once triggers a single check.
+        """
+        changed = set()
+        last_change = None
+        while True:
+            time.sleep(self.interval)
+            new_changes = self.poll()
+            if new_changes:
+                changed.update(new_changes)
+                last_change = time.time()
+            elif changed and time.time() - last_change >= self.debounce:
+                return changed
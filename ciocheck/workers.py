@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright (c) 2016 Continuum Analytics, Inc.
+#
+# Licensed under the terms of the MIT License
+# (see LICENSE.txt for details)
+# -----------------------------------------------------------------------------
+"""
+Pool of long lived formatter processes.
+
+Importing yapf, isort and autopep8 takes longer than formatting a small
+file, so each worker process imports them once and formats many batches.
+The time spent formatting each file is recorded once workers are ready, to
+balance the batches of the next runs.
+Files taking too long, too much memory or crashing their worker are skipped,
+their worker is replaced and the rest of its batch is formatted by the next
+one.
+"""
+
+from __future__ import absolute_import, print_function
+
+# Standard library imports
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+# Third party imports
+from six.moves import queue
+
+# Local imports
+from ciocheck.shard import COSTS, FileCosts, estimate_costs, file_weight
+from ciocheck.trace import TRACER
+from ciocheck.utils import end_process, processes_killed, start_process
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+FORMAT_TASK = os.path.join(HERE, 'format_task.py')
+
+# More batches balance the load better, but cost more round trips
+BATCHES_PER_WORKER = 4
+# Keep batches short so results keep coming while formatting
+MAX_BATCH_FILES = 20
+
+# Time formatters spent on each file, kept apart from the time of all tools
+# used to split shards
+FORMAT_COSTS = FileCosts()
+
+
+def make_batches(paths, workers=1, costs=None):
+    """
+    Split `paths` in batches of similar expected formatting cost.
+
+    Costs are estimated from the size and lines of files, and from the time
+    recorded in previous runs in `costs`. Small files are grouped so a round
+    trip to a worker formats several of them, while expensive files are
+    formatted alone. Batches are returned most expensive first, so workers
+    pulling them in order start on large files early instead of ending the
+    run on one straggler (longest processing time first).
+    """
+    if not paths:
+        return []
+
+    estimated = estimate_costs(paths, costs, weight=file_weight)
+    target = sum(estimated.values()) / (max(1, workers) * BATCHES_PER_WORKER)
+    batches = []
+    batch, batch_cost = [], 0.0
+    for path in sorted(paths, key=lambda p: (-estimated[p], p)):
+        batch.append(path)
+        batch_cost += estimated[path]
+        if batch_cost >= target or len(batch) >= MAX_BATCH_FILES:
+            batches.append((batch_cost, batch))
+            batch, batch_cost = [], 0.0
+    if batch:
+        batches.append((batch_cost, batch))
+
+    batches.sort(key=lambda item: -item[0])
+    return [list(sorted(batch)) for (batch_cost, batch) in batches]
+
+
+def add_costs(path, seconds):
+    """Record that formatters spent `seconds` on `path`."""
+    COSTS.add([path], seconds)
+    FORMAT_COSTS.add([path], seconds)
+
+
+class WorkerError(Exception):
+    """A worker process exited while formatting a batch."""
+
+
+class FileSkipped(Exception):
+    """A file went over the time or memory limits of its worker."""
+
+    def __init__(self, path, reason):
+        """A file went over the time or memory limits of its worker."""
+        super(FileSkipped, self).__init__(reason)
+        self.path = path
+        self.reason = reason
+
+
+class FormatterWorker(object):
+    """A formatter process, formatting one batch of files at a time."""
+
+    def __init__(self, cmd_root, check, memory_limit=0):
+        """A formatter process, formatting one batch of files at a time.
+
+        The process can not use more than `memory_limit` megabytes, 0 means
+        no limit.
+        """
+        env = os.environ.copy()
+        env['CIOCHECK_PROJECT_ROOT'] = cmd_root
+        env['CIOCHECK_CHECK'] = str(check)
+        env['CIOCHECK_MEMORY_LIMIT'] = str(memory_limit)
+        self.process = start_process(
+            [sys.executable, FORMAT_TASK, '--worker'],
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE)
+        self.tasks = 0
+        self.memory = None
+        self.ready = False
+
+        # Lines are read by a thread, so reading them can time out
+        self._lines = queue.Queue()
+        self._reader = threading.Thread(target=self._read_lines)
+        self._reader.daemon = True
+        self._reader.start()
+
+    def _read_lines(self):
+        """Queue the lines written by the process until it exits."""
+        try:
+            for line in iter(self.process.stdout.readline, b''):
+                self._lines.put(line)
+        except (IOError, OSError, ValueError):
+            # Closed when killed
+            pass
+        self._lines.put(b'')
+
+    def wait_ready(self):
+        """Wait until the process imported the formatters."""
+        if self.ready:
+            return
+
+        response = self._lines.get()
+        if not response:
+            raise WorkerError('Formatter worker exited with code {0}'.format(
+                self.process.wait()))
+        self.ready = json.loads(response.decode('utf-8')).get('ready', False)
+
+    def iter_format(self, paths, line_ranges=None, timeout=0):
+        """
+        Format `paths`, yielding `(path, results)` as each file is done.
+
+        `line_ranges` is a dict of path: line ranges to format, files not in
+        it are formatted entirely. Raise FileSkipped if a file takes more
+        than `timeout` seconds, 0 means no limit, or more memory than the
+        process limit. The process can not be used anymore after that.
+        """
+        line_ranges = line_ranges or {}
+        tasks = [[path, line_ranges.get(path)] for path in paths]
+        line = json.dumps(tasks) + '\n'
+        try:
+            self.process.stdin.write(line.encode('utf-8'))
+            self.process.stdin.flush()
+        except (IOError, OSError) as error:
+            raise WorkerError(str(error))
+
+        # Files are formatted in order
+        pending = list(paths)
+        while True:
+            try:
+                response = self._lines.get(timeout=timeout or None)
+            except queue.Empty:
+                raise FileSkipped(
+                    pending[0],
+                    'timed out after {0} seconds'.format(timeout))
+            if not response:
+                raise WorkerError(
+                    'Formatter worker exited with code {0}'.format(
+                        self.process.wait()))
+
+            data = json.loads(response.decode('utf-8'))
+            if data.get('done'):
+                break
+            if data.get('skipped'):
+                raise FileSkipped(data['path'], data['skipped'])
+            pending.remove(data['path'])
+            yield data['path'], data['results']
+
+        self.tasks += 1
+        self.memory = data['memory']
+
+    def close(self):
+        """Let the process finish once its current batch is done."""
+        try:
+            self.process.stdin.close()
+            self.process.wait()
+        except (IOError, OSError):
+            pass
+        self._reader.join()
+        self.process.stdout.close()
+        end_process(self.process)
+
+    def kill(self):
+        """Kill the process right away."""
+        try:
+            self.process.kill()
+        except OSError:
+            # Already finished
+            pass
+
+
+class FormatterPool(object):
+    """Format batches of files with a few long lived worker processes."""
+
+    def __init__(self,
+                 cmd_root,
+                 check,
+                 workers=1,
+                 max_tasks=0,
+                 max_memory=0,
+                 timeout=0,
+                 memory_limit=0,
+                 name='multiformatter',
+                 keep_workers=False):
+        """Format batches of files with a few long lived worker processes.
+
+        Workers are replaced after formatting `max_tasks` batches or once
+        they used more than `max_memory` megabytes. Files taking more than
+        `timeout` seconds, or needing more than `memory_limit` megabytes, are
+        skipped and reported as a result of tool `name`. 0 means no limit.
+
+        If `keep_workers` is True, workers are kept running between calls to
+        `iter_run` until the pool is closed.
+        """
+        self.cmd_root = cmd_root
+        self.check = check
+        self.workers = max(1, workers)
+        self.max_tasks = max_tasks
+        self.max_memory = max_memory
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.name = name
+        self.keep_workers = keep_workers
+        self.stopped = False
+        self._running = set()
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _start_worker(self):
+        """Return an idle worker still running, or start a new one."""
+        while True:
+            with self._lock:
+                worker = self._idle.pop() if self._idle else None
+            if worker is None or worker.process.poll() is None:
+                break
+            # Killed while idle, like when stopping a previous run early
+            worker.close()
+
+        if worker is None:
+            worker = FormatterWorker(
+                self.cmd_root, self.check, memory_limit=self.memory_limit)
+        with self._lock:
+            self._running.add(worker)
+        return worker
+
+    def _release_worker(self, worker):
+        """Keep `worker` for the next run if workers are kept, or close it."""
+        if not self.keep_workers or self.stopped:
+            self._close_worker(worker)
+            return
+
+        with self._lock:
+            self._running.discard(worker)
+            self._idle.append(worker)
+
+    def _close_worker(self, worker):
+        """Close `worker`, waiting for it to exit."""
+        with self._lock:
+            self._running.discard(worker)
+        worker.close()
+
+    def _expired(self, worker):
+        """Return True if `worker` should be replaced."""
+        if self.max_tasks and worker.tasks >= self.max_tasks:
+            return True
+        return bool(self.max_memory and worker.memory and
+                    worker.memory > self.max_memory)
+
+    def _replace_worker(self, worker):
+        """Kill a failed `worker`, the next batch starts a new one."""
+        if worker is not None:
+            worker.kill()
+            self._close_worker(worker)
+        return None
+
+    def _skip(self, done, path, reason):
+        """Report `path` as skipped for `reason`, a result of the pool."""
+        result = {'path': path, 'skipped': reason}
+        done.put(([path], [{self.name: result}], None))
+
+    def _work(self, tasks, done, line_ranges):
+        """Format batches from `tasks` until there are none left."""
+        worker = None
+        try:
+            while not self.stopped:
+                try:
+                    batch = tasks.get_nowait()
+                except queue.Empty:
+                    break
+
+                if processes_killed():
+                    # Stopping early, the batch is not formatted
+                    done.put((batch, None, None))
+                    continue
+
+                remaining = list(batch)
+                start = None
+                try:
+                    if worker is None:
+                        worker = self._start_worker()
+                    worker.wait_ready()
+                    start = time.time()
+                    with TRACER.span('format batch', 'formatter',
+                                     files=len(batch)):
+                        for path, results in worker.iter_format(
+                                batch, line_ranges, self.timeout):
+                            now = time.time()
+                            add_costs(path, now - start)
+                            start = now
+                            remaining.remove(path)
+                            done.put(([path], [results], None))
+                except FileSkipped as skipped:
+                    add_costs(skipped.path, time.time() - start)
+                    worker = self._replace_worker(worker)
+                    remaining.remove(skipped.path)
+                    self._skip(done, skipped.path, skipped.reason)
+                    if remaining:
+                        # Formatted by the next worker
+                        tasks.put(remaining)
+                    continue
+                except Exception as error:
+                    worker = self._replace_worker(worker)
+                    if self.stopped or processes_killed():
+                        # Killed when stopping early, not formatted
+                        done.put((remaining, None, None))
+                    elif start is None:
+                        # The worker could not start, the batch is reported
+                        # as failed
+                        done.put((remaining, None, error))
+                    else:
+                        # Files are formatted in order, the first remaining
+                        # one crashed the worker
+                        path = remaining.pop(0)
+                        add_costs(path, time.time() - start)
+                        self._skip(
+                            done, path,
+                            'crashed the formatter worker ({0})'.format(error))
+                        if remaining:
+                            tasks.put(remaining)
+                    continue
+
+                if self._expired(worker):
+                    self._close_worker(worker)
+                    worker = None
+        finally:
+            if worker is not None:
+                self._release_worker(worker)
+
+    def iter_run(self, batches, line_ranges=None):
+        """
+        Format `batches` of paths, yielding `(paths, results)` as they finish.
+
+        Only the lines in `line_ranges`, a dict of path: line ranges, are
+        formatted by formatters supporting it.
+
+        Results are yielded for each file as soon as a worker formatted it,
+        so they are not kept until the whole batch is done. Results are None
+        for paths that were not formatted because workers were killed when
+        stopping early. Skipped files have a result with the `skipped` reason,
+        like the files of batches whose worker could not start.
+        """
+        tasks = queue.Queue()
+        for batch in batches:
+            tasks.put(batch)
+        done = queue.Queue()
+
+        self.stopped = False
+        finished = False
+        threads = []
+        for i in range(min(self.workers, len(batches))):
+            thread = threading.Thread(
+                target=self._work, args=(tasks, done, line_ranges))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        try:
+            pending = sum(len(batch) for batch in batches)
+            while pending:
+                paths, results, error = done.get()
+                if error is not None:
+                    # Only this batch failed, results of others are kept
+                    reason = 'formatter worker failed to start ({0})'.format(
+                        error)
+                    results = [{
+                        self.name: {
+                            'path': path,
+                            'skipped': reason,
+                        }
+                    } for path in paths]
+                pending -= len(paths)
+                yield paths, results
+            finished = True
+        finally:
+            if not finished:
+                self.stop()
+            for thread in threads:
+                thread.join()
+
+    def stop(self):
+        """Stop starting batches and kill running workers."""
+        self.stopped = True
+        with self._lock:
+            running = list(self._running)
+        for worker in running:
+            worker.kill()
+
+    def close(self):
+        """Close the workers kept between runs."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.close()
@@ -60,7 +60,11 @@ setup(
     ],
     entry_points={
         'gui_scripts': [
-            'ciocheck = ciocheck.main:main'
+            'ciocheck = ciocheck.main:main',
+            'ciocheckd = ciocheck.daemon:main',
+            'ciocheck-cache = ciocheck.cache:main',
+            'ciocheck-merge = ciocheck.merge:main',
+            'ciocheck-bench = ciocheck.bench:main',
         ]
     },
     include_package_data=True, )